@@ -1,9 +1,20 @@
 import streamlit as st
 import json
 import os
+import time
+import uuid
 from datetime import datetime
 from claude_api import ClaudeAPIClient
 from google_docs_api import GoogleDocsAPIClient
+from quality_scoring import stable_hash, summarize_quality
+from quality_checker import IncrementalQualityChecker, run_quality_pipeline
+from batch_generation import STATUS_FALLBACK, STATUS_FAILED, STATUS_OK, STATUS_TRUNCATED
+from job_queue import JobQueue, JobWorker, start_workers
+from job_scheduler import DEFAULT_PRIORITY, PRIORITIES
+from material_store import DEFAULT_PAGE_SIZE, MaterialStore
+from material_export import EXPORT_FORMATS, iter_export_bytes
+from material_render import RENDER_FORMATS, render_materials_zip
+from material_model import DiscussionMaterial, ExpressionPracticeMaterial, RoleplayMaterial
 from dotenv import load_dotenv
 
 # 環境変数の読み込み
@@ -25,8 +36,11 @@ if 'context_data' not in st.session_state:
         'topic_list': []
     }
 
-if 'generated_materials' not in st.session_state:
-    st.session_state.generated_materials = []
+if 'context_id' not in st.session_state:
+    st.session_state.context_id = None
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
 
 if 'templates' not in st.session_state:
     st.session_state.templates = {
@@ -86,6 +100,9 @@ def main():
     st.title("📚 語学教材作成支援ツール - 実用版")
     st.markdown("**シンプル・実用重視** - 今すぐ使える教材作成ツール")
     
+    # 監視中のカウンセリングノートの変更は、各タブがコンテキストを描画する前に取り込む
+    watch_context_changes()
+    
     # メインタブ
     tabs = st.tabs(["📝 コンテキスト設定", "🎨 テンプレート管理", "📋 トピック管理", "⚡ 一括生成", "🔍 品質チェッカー", "📁 出力管理", "📚 Obsidian連携"])
     
@@ -111,6 +128,18 @@ def main():
         from obsidian_integration import show_obsidian_integration
         show_obsidian_integration()
 
+def watch_context_changes():
+    """ファイル監視中のカウンセリングノートの変更を取り込む（変更があれば画面全体を再描画）"""
+    if 'context_watcher' not in st.session_state:
+        return
+    from obsidian_integration import apply_context_changes
+    if apply_context_changes():
+        st.rerun()
+
+# ファイル監視中は、操作がなくてもノートの変更を定期的に取り込む
+if hasattr(st, 'fragment'):
+    watch_context_changes = st.fragment(run_every=5)(watch_context_changes)
+
 def show_context_setup():
     """コンテキスト設定タブ"""
     st.header("📝 コンテキスト設定")
@@ -179,6 +208,7 @@ def show_context_setup():
             output_format = st.selectbox("出力形式", ["JSON", "Google Docs", "テキスト"])
     
     # コンテキスト保存
+    context_name = st.text_input("コンテキスト名", key="context_name", placeholder="例: 田中商事_営業部_2025Q3")
     if st.button("💾 コンテキスト情報を保存", type="primary"):
         st.session_state.context_data.update({
             'counseling_memo': counseling_memo,
@@ -188,7 +218,95 @@ def show_context_setup():
             'material_count': material_count,
             'output_format': output_format
         })
+        save_context(context_name)
         st.success("✅ コンテキスト情報を保存しました")
+    
+    show_saved_contexts()
+
+def get_material_store():
+    """教材リポジトリを取得"""
+    if 'material_store' not in st.session_state:
+        st.session_state.material_store = MaterialStore()
+    return st.session_state.material_store
+
+def ensure_context_id(name=''):
+    """現在のコンテキストのIDを取得（未保存なら作成）"""
+    if st.session_state.context_id is None:
+        st.session_state.context_id = get_material_store().create_context(st.session_state.context_data, name)
+    return st.session_state.context_id
+
+def save_context(name=None):
+    """現在のコンテキストとトピックリストをリポジトリに保存"""
+    if st.session_state.context_id is None:
+        ensure_context_id(name or '')
+    else:
+        get_material_store().update_context(st.session_state.context_id, st.session_state.context_data, name or None)
+
+def show_saved_contexts():
+    """保存済みコンテキストの切り替え"""
+    contexts = get_material_store().list_contexts()
+    if not contexts:
+        return
+    
+    with st.expander("📂 保存済みコンテキストを開く"):
+        selected = st.selectbox(
+            "コンテキスト",
+            contexts,
+            format_func=lambda c: f"#{c['id']} {c['name'] or '（無題）'} — 教材{c['material_count']}件（{c['updated_at'][:16]}）",
+            key="saved_context_select"
+        )
+        col_open, col_new = st.columns(2)
+        with col_open:
+            if st.button("📂 開く", key="open_context"):
+                context = get_material_store().get_context(selected['id'])
+                st.session_state.context_data = context['context_data']
+                st.session_state.context_id = context['id']
+                st.success(f"✅ コンテキスト #{context['id']} を開きました")
+                st.rerun()
+        with col_new:
+            if st.button("🆕 新規コンテキスト", key="new_context"):
+                st.session_state.context_data = {
+                    'counseling_memo': '',
+                    'teaching_policy': '',
+                    'business_scenes': '',
+                    'topic_list': []
+                }
+                st.session_state.context_id = None
+                st.rerun()
+
+def count_materials():
+    """現在のコンテキストの教材数"""
+    if st.session_state.context_id is None:
+        return 0
+    return get_material_store().count_materials(st.session_state.context_id)
+
+def load_material_records():
+    """現在のコンテキストの教材を (ID, 教材) で全件読み込み"""
+    if st.session_state.context_id is None:
+        return []
+    return get_material_store().load_material_records(st.session_state.context_id)
+
+def load_materials():
+    return [material for _, material in load_material_records()]
+
+def add_materials(materials):
+    """教材を現在のコンテキストに保存"""
+    return get_material_store().add_materials(materials, ensure_context_id())
+
+def add_job_results(results):
+    """ジョブの結果を保存（自動修正された教材は修正前を初版として履歴に残す）"""
+    store = get_material_store()
+    material_ids = add_materials(original or material for material, original in results)
+    for material_id, (material, original) in zip(material_ids, results):
+        if original is not None:
+            store.update_material(material_id, material, source='重複自動修正')
+    return [material for material, _ in results]
+
+def used_expressions():
+    """現在のコンテキストの使用済み表現"""
+    if st.session_state.context_id is None:
+        return set()
+    return get_material_store().used_expressions(st.session_state.context_id)
 
 def show_template_management():
     """テンプレート管理タブ"""
@@ -651,11 +769,18 @@ def show_topic_management():
         
         if st.button("📥 リストを保存"):
             if st.session_state.context_data['topic_list']:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"topic_list_{timestamp}.json"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(st.session_state.context_data['topic_list'], f, ensure_ascii=False, indent=2)
-                st.success(f"✅ トピックリストを {filename} に保存しました")
+                save_context()
+                st.success(f"✅ トピックリストをコンテキスト #{st.session_state.context_id} に保存しました")
+        
+        if st.session_state.context_data['topic_list']:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            st.download_button(
+                label="📄 JSONでダウンロード",
+                data=json.dumps(st.session_state.context_data['topic_list'], ensure_ascii=False, indent=2).encode('utf-8'),
+                file_name=f"topic_list_{timestamp}.json",
+                mime="application/json",
+                key="download_topic_list"
+            )
 
 def show_batch_generation():
     """一括生成タブ"""
@@ -701,14 +826,24 @@ def show_batch_generation():
             with col_gen1:
                 include_audio = st.checkbox("音声スクリプト含む", True, key="batch_audio")
                 quality_check = st.checkbox("生成後品質チェック", True, key="batch_quality")
+                run_in_background = st.checkbox(
+                    "バックグラウンドで実行", True, key="batch_background",
+                    help="タブを閉じたり再読み込みしても生成を継続し、中断時は完了済みトピックの続きから再開します"
+                )
+                priority = st.selectbox(
+                    "緊急度", PRIORITIES, index=PRIORITIES.index(DEFAULT_PRIORITY), key="batch_priority",
+                    help="最優先のジョブは実行中の通常ジョブより先に処理されます"
+                )
+                client_name = st.text_input(
+                    "クライアント名", key="batch_client_name", placeholder="例: 田中商事_山田様",
+                    help="同じ緊急度のジョブはクライアントごとに公平に順番が回ります"
+                )
             
             with col_gen2:
                 # 既存表現の確認
                 existing_count = 0
-                if st.session_state.generated_materials:
-                    for material in st.session_state.generated_materials:
-                        if 'useful_expressions' in material:
-                            existing_count += len(material['useful_expressions'])
+                if st.session_state.context_id is not None:
+                    existing_count = get_material_store().count_expressions(st.session_state.context_id)
                 
                 st.metric("既存表現数", existing_count)
                 if existing_count > 0:
@@ -723,7 +858,12 @@ def show_batch_generation():
             
             # 生成実行
             if st.button("🚀 一括生成開始", type="primary"):
-                generate_materials(selected_topics, include_audio, quality_check)
+                if run_in_background:
+                    enqueue_generation_job(selected_topics, quality_check, priority, client_name)
+                else:
+                    generate_materials(selected_topics, include_audio, quality_check, priority, client_name)
+            
+            show_background_jobs()
         
         else:
             st.warning("⚠️ 生成前に必要な情報を設定してください")
@@ -735,218 +875,179 @@ def show_batch_generation():
     with col2:
         st.subheader("📊 生成統計")
         
-        if st.session_state.generated_materials:
-            st.metric("生成済み教材数", len(st.session_state.generated_materials))
+        total_materials = count_materials()
+        if total_materials:
+            st.metric("生成済み教材数", total_materials)
             
             # 品質統計
-            total_materials = len(st.session_state.generated_materials)
             if total_materials > 0:
-                # 仮の品質スコア計算
-                avg_quality = 4.2  # サンプル値
-                st.metric("平均品質スコア", f"{avg_quality:.1f}/5.0")
+                quality_summary = get_quality_summary()
+                st.metric("平均品質スコア", f"{quality_summary['avg_quality']:.1f}/5.0")
         
         else:
             st.info("まだ教材が生成されていません")
 
-def generate_materials(topics, include_audio, quality_check):
-    """教材生成処理（重複回避機能付き）"""
+def generate_materials(topics, include_audio, quality_check, priority=DEFAULT_PRIORITY, client_name=''):
+    """教材生成処理（重複回避機能付き・トピックごとに結果を保存）"""
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    client = ClaudeAPIClient()
-    generated_materials = []
-    all_used_expressions = set()  # 使用済み表現を追跡
+    # 画面から直接実行する場合もジョブとして登録し、トピックごとの結果と状態を保存する
+    job_queue = get_job_queue()
+    worker = JobWorker(job_queue, client_factory=ClaudeAPIClient)
+    job_id = create_generation_job(topics, quality_check, priority, client_name)
+    job = job_queue.claim_job(job_id, worker.worker_id)
+    if job is None:
+        st.info(f"📋 ジョブ #{job_id} はバックグラウンドで実行中です")
+        return
     
-    # 既存の教材からも使用済み表現を収集
-    for existing_material in st.session_state.generated_materials:
-        if 'useful_expressions' in existing_material:
-            for expr in existing_material['useful_expressions']:
-                # 英語部分のみを抽出
-                expr_clean = extract_english_part(expr)
-                all_used_expressions.add(expr_clean.lower())
+    def on_progress(done, total, topic, status):
+        status_text.text(f"生成中... {done}/{total}: {topic} ({GENERATION_STATUS_LABELS.get(status, status)})")
+        progress_bar.progress(done / total)
+        if status != STATUS_OK:
+            st.warning(f"'{topic}': {GENERATION_STATUS_LABELS.get(status, status)}")
     
-    # デバッグ情報: 既存の使用済み表現数を表示
-    if all_used_expressions:
-        st.info(f"🔍 既存教材から {len(all_used_expressions)} 個の使用済み表現を検出しました")
+    fix_count = worker.run_job(job, on_progress=on_progress)
     
-    total_topics = len(topics)
+    if fix_count > 0:
+        st.info(f"🔧 {fix_count}件の重複表現を自動修正しました")
     
-    for i, topic in enumerate(topics):
-        status_text.text(f"生成中... {i+1}/{total_topics}: {topic}")
-        
-        try:
-            # 材料のタイプに応じて生成（テンプレート設定を考慮）
-            template_type = st.session_state.context_data.get('template_type', 'ロールプレイ')
-            template_config = st.session_state.templates[template_type]
-            
-            # コンテキストデータにテンプレート設定を追加
-            enhanced_context = st.session_state.context_data.copy()
-            enhanced_context['template_config'] = template_config
-            
-            # 使用済み表現を渡して重複回避
-            used_expressions_list = list(all_used_expressions)
-            if used_expressions_list:
-                status_text.text(f"生成中... {i+1}/{total_topics}: {topic} (回避対象: {len(used_expressions_list)}個)")
-            
-            if template_type == 'ロールプレイ':
-                material = client.generate_roleplay_material(enhanced_context, topic, template_config, used_expressions_list)
-            elif template_type == 'ディスカッション':
-                material = client.generate_discussion_material(enhanced_context, topic, template_config, used_expressions_list)
-            else:  # 表現練習
-                material = client.generate_expression_practice_material(enhanced_context, topic, template_config, used_expressions_list)
-            
-            material['topic'] = topic
-            material['generated_at'] = datetime.now().isoformat()
-            generated_materials.append(material)
-            
-            # 新しく生成された表現を使用済みリストに追加
-            if 'useful_expressions' in material:
-                for expr in material['useful_expressions']:
-                    expr_clean = extract_english_part(expr)
-                    all_used_expressions.add(expr_clean.lower())
-            
-        except Exception as e:
-            st.error(f"❌ '{topic}' の生成中にエラー: {str(e)}")
-        
-        progress_bar.progress((i + 1) / total_topics)
+    # 正常に生成された教材のみ取り込む（中断した場合もここまでの分は取り込む）
+    generated_materials = add_job_results(job_queue.import_results(job_id))
+    if job_queue.get_job(job_id)['status'] != 'completed':
+        status_text.text("⏸️ 一時停止中")
+        st.info(f"⏭️ 緊急度の高いジョブに順番を譲りました（{len(generated_materials)}件取り込み済み）。"
+                f"ジョブ #{job_id} の残りはバックグラウンドで継続します")
+        return
     
-    # 重複チェックと自動修正
-    if quality_check:
-        status_text.text("🔍 品質チェック中...")
-        generated_materials = auto_fix_duplicates(generated_materials)
-        
-        # 修正後に改めて使用済み表現を更新
-        for material in generated_materials:
-            if 'useful_expressions' in material:
-                for expr in material['useful_expressions']:
-                    expr_clean = extract_english_part(expr)
-                    all_used_expressions.add(expr_clean.lower())
-    
-    # 生成完了
-    st.session_state.generated_materials.extend(generated_materials)
     status_text.text("✅ 一括生成完了！")
-    
     st.success(f"🎉 {len(generated_materials)}件の教材を生成しました")
+    # 失敗件数は実行済みトピックの生成状態から数える
+    failed_count = sum(count for status, count in job_queue.status_counts(job_id).items()
+                       if status not in (STATUS_OK, 'pending'))
+    if failed_count:
+        st.warning(f"⚠️ {failed_count}件は正常に生成できませんでした。ジョブ #{job_id} の「失敗分のみ再実行」で再生成できます")
 
-def extract_english_part(expression):
-    """表現から英語部分のみを抽出（改良版）"""
-    import re
-    
-    expr_clean = expression.strip()
-    
-    # 各種区切り文字で英語部分を抽出
-    separators = [': ', ':', '：', ' - ', ' – ', ' — ', ' | ', ' / ']
-    
-    for sep in separators:
-        if sep in expr_clean:
-            parts = expr_clean.split(sep)
-            if len(parts) >= 2:
-                # 最初の部分が日本語のようなら2番目、そうでなければ1番目
-                first_part = parts[0].strip()
-                second_part = parts[1].strip()
-                
-                # 日本語文字が含まれているかチェック
-                if re.search(r'[あ-んア-ンー一-龯]', first_part):
-                    expr_clean = second_part
-                else:
-                    expr_clean = first_part
-                break
-    
-    # 追加の清理
-    expr_clean = re.sub(r'^["\'\[\(]*', '', expr_clean)  # 先頭の記号を除去
-    expr_clean = re.sub(r'["\'\]\)]*$', '', expr_clean)  # 末尾の記号を除去
-    expr_clean = re.sub(r'\s*-\s*[あ-んア-ンー一-龯].*$', '', expr_clean)  # 末尾の日本語説明を除去
-    
-    return expr_clean.strip()
-
-def auto_fix_duplicates(materials):
-    """生成された教材の重複を自動修正"""
-    from claude_api import ClaudeAPIClient
-    
-    # 重複検出
-    expressions_map = {}
-    for i, material in enumerate(materials):
-        if 'useful_expressions' in material:
-            for j, expr in enumerate(material['useful_expressions']):
-                expr_clean = extract_english_part(expr).lower()
-                if expr_clean in expressions_map:
-                    expressions_map[expr_clean].append((i, j, expr))
-                else:
-                    expressions_map[expr_clean] = [(i, j, expr)]
-    
-    # 重複がある場合の自動修正
-    client = ClaudeAPIClient()
-    fix_count = 0
-    
-    for expr_clean, occurrences in expressions_map.items():
-        if len(occurrences) > 1:
-            # 最初の1つは残し、残りを代替表現に置換
-            for k, (mat_idx, expr_idx, original) in enumerate(occurrences[1:], 1):
-                try:
-                    # 代替表現を生成
-                    alternative = generate_single_alternative(expr_clean, client)
-                    if alternative and alternative.lower() != expr_clean:
-                        materials[mat_idx]['useful_expressions'][expr_idx] = alternative
-                        fix_count += 1
-                except Exception as e:
-                    print(f"自動修正エラー: {e}")
-    
-    if fix_count > 0:
-        st.info(f"🔧 {fix_count}件の重複表現を自動修正しました")
-    
-    return materials
+def get_job_queue():
+    """バックグラウンドジョブキューを取得（ワーカーはプロセス内で1度だけ起動）"""
+    if 'job_queue' not in st.session_state:
+        st.session_state.job_queue = JobQueue()
+    start_workers(int(os.getenv('JOB_WORKERS', '1')), st.session_state.job_queue.db_path)
+    return st.session_state.job_queue
 
-def generate_single_alternative(base_expression, client):
-    """単一の代替表現を生成"""
-    try:
-        prompt = f"""
-以下のビジネス英語表現と同じ意味で、異なる表現方法の代替案を1つ生成してください。
+def create_generation_job(topics, quality_check, priority=DEFAULT_PRIORITY, client_name=''):
+    """現在のコンテキストのスナップショットで生成ジョブを登録"""
+    template_type = st.session_state.context_data.get('template_type', 'ロールプレイ')
+    # 取り込み先のコンテキストを保存しておく
+    save_context()
+    return get_job_queue().enqueue(
+        topics,
+        dict(st.session_state.context_data),
+        template_type,
+        st.session_state.templates[template_type],
+        used_expressions=list(used_expressions()),
+        quality_check=quality_check,
+        priority=priority,
+        # 公平配分の単位（セッション×クライアント）
+        owner=f"{st.session_state.session_id}:{client_name}"
+    )
 
-【元の表現】: {base_expression}
+def enqueue_generation_job(topics, quality_check, priority=DEFAULT_PRIORITY, client_name=''):
+    """教材生成をバックグラウンドジョブとして登録"""
+    job_id = create_generation_job(topics, quality_check, priority, client_name)
+    st.success(f"📋 ジョブ #{job_id} を登録しました（{len(topics)}件）。タブを閉じても生成は継続します。")
 
-【要件】:
-1. 同じ意味・ニュアンスを保つ
-2. ビジネス場面で適切
-3. 自然な英語表現
-4. 元の表現とは異なる単語・構造を使用
+JOB_STATUS_LABELS = {
+    'queued': '⏳ 待機中',
+    'running': '⚙️ 実行中',
+    'completed': '✅ 完了',
+    'failed': '❌ 失敗',
+    'cancelled': '⏹️ 中止'
+}
 
-【出力形式】:
-代替表現のみを返してください（説明不要）
-"""
-        
-        response = client.client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=100,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        if hasattr(response, 'content') and len(response.content) > 0:
-            alternative = response.content[0].text.strip()
-            # 余計な装飾を除去
-            alternative = alternative.replace('"', '').replace("'", "").strip()
-            return alternative
+GENERATION_STATUS_LABELS = {
+    STATUS_OK: '✅ 正常',
+    STATUS_FALLBACK: '⚠️ 代替教材',
+    STATUS_TRUNCATED: '✂️ 途中で打ち切り',
+    STATUS_FAILED: '❌ 失敗',
+    'pending': '⏳ 未実行'
+}
+
+def format_wait_time(seconds):
+    """待ち時間を表示用に整形"""
+    if seconds < 60:
+        return f"{int(seconds)}秒"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}分"
+    return f"{seconds / 3600:.1f}時間"
+
+def show_background_jobs():
+    """バックグラウンドジョブの状態表示と結果の取り込み"""
+    job_queue = get_job_queue()
+    jobs = job_queue.list_jobs(limit=10)
+    if not jobs:
+        return
     
-    except Exception as e:
-        print(f"代替表現生成エラー: {e}")
+    st.subheader("📋 バックグラウンドジョブ")
+    if st.button("🔄 状態を更新", key="refresh_jobs"):
+        st.rerun()
     
-    return None
-    
-    # 品質チェック実行
-    if quality_check and generated_materials:
-        st.info("🔍 品質チェックを実行中...")
-        # ここで品質チェック処理を呼び出し
-        perform_quality_check(generated_materials)
-    
-    # 完了通知 [[memory:3871684]]
-    if generated_materials:
-        import subprocess
-        try:
-            subprocess.run([
-                'osascript', '-e', 
-                f'display dialog "教材生成完了！\\n{len(generated_materials)}件の教材を生成しました。" with title "語学教材作成ツール" buttons {{"了解"}} default button 1'
-            ])
-        except:
-            pass
+    # 緊急度ごとのキュー状況
+    stat_cols = st.columns(len(PRIORITIES))
+    for col, stats in zip(stat_cols, job_queue.queue_stats()):
+        with col:
+            st.metric(f"{stats['priority']} 待機トピック", stats['pending_topics'],
+                      help=f"待機ジョブ {stats['queued_jobs']}件 / 実行中 {stats['running_jobs']}件")
+            if stats['queued_jobs']:
+                st.caption(f"最長待ち時間: {format_wait_time(stats['max_wait_seconds'])}")
+    
+    for job in jobs:
+        total = job['total_topics'] or 1
+        status_label = JOB_STATUS_LABELS.get(job['status'], job['status'])
+        wait_label = ""
+        if job['status'] == 'queued' and job['queued_at']:
+            wait_label = f" ・待ち時間 {format_wait_time(time.time() - job['queued_at'])}"
+        st.write(f"**ジョブ #{job['id']}** [{job['priority']}] {status_label} — "
+                 f"{job['completed_topics']}/{job['total_topics']}件 "
+                 f"（{job['params']['template_type']}）{wait_label}")
+        if job['status'] in ('queued', 'running'):
+            st.progress(job['completed_topics'] / total)
+            if st.button("⏹️ 中止", key=f"cancel_job_{job['id']}"):
+                job_queue.cancel_job(job['id'])
+                st.rerun()
+        elif job['error']:
+            st.error(f"エラー: {job['error']}")
+        
+        status_counts = job_queue.status_counts(job['id'])
+        st.caption(" / ".join(f"{GENERATION_STATUS_LABELS.get(status, status)} {count}件"
+                              for status, count in status_counts.items()))
+        if job['status'] in ('queued', 'running'):
+            continue
+        
+        col_import, col_retry = st.columns(2)
+        pending_import = job_queue.pending_import_count(job['id'])
+        with col_import:
+            if pending_import and st.button(f"📥 結果を取り込む（{pending_import}件）", key=f"import_job_{job['id']}"):
+                materials = add_job_results(job_queue.import_results(job['id']))
+                st.success(f"✅ ジョブ #{job['id']} の教材 {len(materials)}件を取り込みました")
+                st.rerun()
+        
+        retry_count = sum(count for status, count in status_counts.items() if status not in (STATUS_OK, 'pending'))
+        if retry_count:
+            with st.expander(f"⚠️ 正常に生成できなかったトピック（{retry_count}件）"):
+                for topic in job_queue.job_topics(job['id']):
+                    if topic['completed'] and topic['status'] != STATUS_OK:
+                        detail = f"（{topic['error']}）" if topic['error'] else ""
+                        st.write(f"- {topic['topic']}: "
+                                 f"{GENERATION_STATUS_LABELS.get(topic['status'], topic['status'])}{detail}")
+            with col_retry:
+                if st.button(f"🔁 失敗分のみ再実行（{retry_count}件）", key=f"retry_job_{job['id']}"):
+                    job_queue.retry_failed(job['id'])
+                    st.rerun()
+
+# 実行中のジョブの進捗を定期的に自動更新
+if hasattr(st, 'fragment'):
+    show_background_jobs = st.fragment(run_every=5)(show_background_jobs)
 
 def show_quality_checker():
     """品質チェッカータブ"""
@@ -974,7 +1075,8 @@ def show_quality_checker():
         - 重複が解消されたことを確認
         """)
     
-    if not st.session_state.generated_materials:
+    total_materials = count_materials()
+    if not total_materials:
         st.info("チェック対象の教材がありません。まず教材を生成してください。")
         return
     
@@ -987,77 +1089,100 @@ def show_quality_checker():
         check_consistency = st.checkbox("ファイル間整合性チェック", True, key="quality_consistency")
         check_level = st.checkbox("レベル調整チェック", True, key="quality_level")
         check_duplicate = st.checkbox("重複チェック", True, key="quality_duplicate")
+        check_judge = st.checkbox(
+            "AI審査モード（Claude）", False, key="quality_judge",
+            help="自然さ・ビジネス適切性をClaudeがルーブリックで採点します（複数教材をまとめて審査、結果はキャッシュ）"
+        )
         
         if st.button("🔍 品質チェック実行", type="primary"):
+            records = load_material_records()
+            # 重複修復で教材インデックスからIDを引けるようにする
+            st.session_state.quality_material_ids = [material_id for material_id, _ in records]
             perform_quality_check(
-                st.session_state.generated_materials,
+                [material for _, material in records],
                 check_context,
                 check_consistency,
                 check_level,
-                check_duplicate
+                check_duplicate,
+                check_judge
             )
     
     with col2:
         st.subheader("📊 チェック統計")
         
-        total_materials = len(st.session_state.generated_materials)
         st.metric("対象教材数", total_materials)
         
-        # 仮の統計値
         if total_materials > 0:
-            st.metric("平均品質スコア", "4.2/5.0")
-            st.metric("要修正", "2件")
-            st.metric("重複検出", "1件")
+            quality_summary = get_quality_summary()
+            st.metric("平均品質スコア", f"{quality_summary['avg_quality']:.1f}/5.0")
+            st.metric("要修正", f"{quality_summary['needs_fix']}件")
+            st.metric("重複検出", f"{quality_summary['duplicate_count']}件")
+
+def get_quality_summary():
+    """生成済み教材の品質サマリーを取得（教材セットが変わったときのみ再計算）"""
+    store = get_material_store()
+    context_id = st.session_state.context_id
+    key = (
+        context_id,
+        store.revision(context_id) if context_id is not None else None,
+        stable_hash(st.session_state.context_data.get('counseling_memo', '')),
+        stable_hash(st.session_state.templates)
+    )
+    cached = st.session_state.get('quality_summary_cache')
+    if cached and cached[0] == key:
+        return cached[1]
+    
+    records = load_material_records()
+    summary = summarize_quality(
+        [material for _, material in records],
+        st.session_state.context_data,
+        st.session_state.templates
+    )
+    store.save_quality_scores(
+        (material_id, material, score, components)
+        for (material_id, material), score, components in zip(records, summary['scores'], summary['components'])
+    )
+    st.session_state.quality_summary_cache = (key, summary)
+    return summary
 
 def perform_quality_check(materials, check_context=True, check_consistency=True, 
-                         check_level=True, check_duplicate=True):
-    """品質チェック実行"""
+                         check_level=True, check_duplicate=True, check_judge=False):
+    """品質チェック実行（登録済みチェックを並列実行し、完了したものから表示）"""
     st.subheader("🔍 品質チェック結果")
     
     issues = []
     
-    # コンテキスト準拠チェック
+    # 表示順を固定するため、チェックごとの表示枠を先に確保
+    check_names = []
     if check_context:
-        st.write("**📝 コンテキスト準拠チェック**")
-        context_issues = check_context_compliance(materials)
-        issues.extend(context_issues)
-        
-        if context_issues:
-            for issue in context_issues:
-                st.warning(f"⚠️ {issue}")
-        else:
-            st.success("✅ 全教材がコンテキストに準拠しています")
-    
-    # レベル調整チェック
+        check_names.append('context')
     if check_level:
-        st.write("**📊 レベル調整チェック**")
-        level_issues = check_level_consistency(materials)
-        issues.extend(level_issues)
-        
-        if level_issues:
-            for issue in level_issues:
-                st.warning(f"⚠️ {issue}")
-        else:
-            st.success("✅ レベル設定が適切です")
-    
-    # 重複チェック
+        check_names.append('level')
     if check_duplicate:
-        st.write("**🔄 重複チェック**")
-        duplicate_issues = check_duplicates(materials)
-        issues.extend(duplicate_issues)
-        
-        if duplicate_issues:
-            for issue in duplicate_issues:
-                st.warning(f"⚠️ {issue}")
-            
-            # 重複修復セクション
-            st.markdown("---")
-            st.subheader("🔧 重複修復")
-            
-            if st.session_state.get('duplicate_details'):
-                show_duplicate_repair_ui()
-        else:
-            st.success("✅ 重複は検出されませんでした")
+        check_names.append('duplicate')
+    if check_judge:
+        check_names.append('judge')
+    
+    if not check_names:
+        st.info("実行するチェックが選択されていません")
+        return
+    
+    sections = {}
+    for check_name in check_names:
+        sections[check_name] = st.container()
+        with sections[check_name]:
+            st.write(f"**{QUALITY_CHECK_HEADINGS[check_name]}**")
+    
+    with st.spinner("品質チェック実行中..."):
+        for check_name, check_issues in run_quality_pipeline(
+            materials,
+            st.session_state.context_data,
+            check_names,
+            checker=get_quality_checker()
+        ):
+            issues.extend(check_issues)
+            with sections[check_name]:
+                show_check_result(check_name, check_issues)
     
     # 総合評価
     if issues:
@@ -1065,77 +1190,44 @@ def perform_quality_check(materials, check_context=True, check_consistency=True,
     else:
         st.success("🎉 全ての品質チェックに合格しました！")
 
-def check_context_compliance(materials):
-    """コンテキスト準拠チェック"""
-    issues = []
-    counseling_keywords = st.session_state.context_data['counseling_memo'].lower().split()
-    
-    for i, material in enumerate(materials):
-        # 簡単なキーワードマッチング
-        content = str(material).lower()
-        relevance_score = sum(1 for keyword in counseling_keywords if keyword in content)
-        
-        if relevance_score < 3:  # 閾値
-            issues.append(f"教材{i+1} '{material.get('topic', 'unknown')}': コンテキストとの関連性が低い可能性")
-    
-    return issues
+QUALITY_CHECK_HEADINGS = {
+    'context': "📝 コンテキスト準拠チェック",
+    'level': "📊 レベル調整チェック",
+    'duplicate': "🔄 重複チェック",
+    'judge': "🤖 AI審査（自然さ・ビジネス適切性）"
+}
 
-def check_level_consistency(materials):
-    """レベル一貫性チェック"""
-    issues = []
-    target_level = "中級"  # デフォルト値
+QUALITY_CHECK_SUCCESS_MESSAGES = {
+    'context': "✅ 全教材がコンテキストに準拠しています",
+    'level': "✅ レベル設定が適切です",
+    'duplicate': "✅ 重複は検出されませんでした",
+    'judge': "✅ AI審査で問題は指摘されませんでした"
+}
+
+def show_check_result(check_name, check_issues):
+    """チェック1件分の結果を表示"""
+    if not check_issues:
+        st.success(QUALITY_CHECK_SUCCESS_MESSAGES.get(check_name, "✅ 問題は検出されませんでした"))
+        return
     
-    for i, material in enumerate(materials):
-        # 語彙の複雑さを粗くチェック
-        if 'useful_expressions' in material:
-            expressions = material['useful_expressions']
-            complex_words = sum(1 for expr in expressions if len(expr.split()) > 3)
-            
-            if complex_words > len(expressions) * 0.7:  # 70%以上が複雑
-                issues.append(f"教材{i+1}: 語彙レベルが目標より高い可能性")
+    for issue in check_issues:
+        st.warning(f"⚠️ {issue}")
     
-    return issues
+    if check_name == 'duplicate':
+        st.session_state.duplicate_details = st.session_state.quality_checker.duplicate_details()
+        
+        # 重複修復セクション
+        st.markdown("---")
+        st.subheader("🔧 重複修復")
+        
+        if st.session_state.get('duplicate_details'):
+            show_duplicate_repair_ui()
 
-def check_duplicates(materials):
-    """重複チェック（改良版）"""
-    issues = []
-    duplicates_detailed = []
-    
-    # より詳細な重複チェック
-    expressions_map = {}  # 表現 -> [(material_index, expression_index)]
-    
-    for i, material in enumerate(materials):
-        if 'useful_expressions' in material:
-            for j, expr in enumerate(material['useful_expressions']):
-                expr_clean = expr.lower().strip()
-                # 英語部分のみを抽出（日本語説明を除外）
-                if ':' in expr:
-                    expr_clean = expr.split(':')[1].strip().lower()
-                elif '-' in expr:
-                    expr_clean = expr.split('-')[0].strip().lower()
-                
-                if expr_clean in expressions_map:
-                    expressions_map[expr_clean].append((i, j, expr))
-                else:
-                    expressions_map[expr_clean] = [(i, j, expr)]
-    
-    # 重複が見つかった場合の詳細情報を収集
-    for expr_clean, occurrences in expressions_map.items():
-        if len(occurrences) > 1:
-            material_nums = [f"教材{i+1}" for i, j, expr in occurrences]
-            issues.append(f"重複表現: '{expr_clean}' が {', '.join(material_nums)} で重複")
-            duplicates_detailed.append({
-                'expression': expr_clean,
-                'occurrences': occurrences,
-                'original_expressions': [expr for i, j, expr in occurrences]
-            })
-    
-    # session_stateに詳細情報を保存
-    if 'duplicate_details' not in st.session_state:
-        st.session_state.duplicate_details = []
-    st.session_state.duplicate_details = duplicates_detailed
-    
-    return issues
+def get_quality_checker():
+    """セッションのインクリメンタル品質チェッカーを取得"""
+    if 'quality_checker' not in st.session_state:
+        st.session_state.quality_checker = IncrementalQualityChecker()
+    return st.session_state.quality_checker
 
 def show_duplicate_repair_ui():
     """重複修復UI"""
@@ -1215,11 +1307,14 @@ def show_duplicate_repair_ui():
 
 def apply_manual_repair(repairs):
     """手動修復を適用"""
+    store = get_material_store()
+    material_ids = st.session_state.get('quality_material_ids', [])
     for mat_idx, expr_idx, new_expr in repairs:
-        if mat_idx < len(st.session_state.generated_materials):
-            material = st.session_state.generated_materials[mat_idx]
-            if 'useful_expressions' in material and expr_idx < len(material['useful_expressions']):
+        if mat_idx < len(material_ids):
+            material = store.get_material(material_ids[mat_idx])
+            if material and 'useful_expressions' in material and expr_idx < len(material['useful_expressions']):
                 material['useful_expressions'][expr_idx] = new_expr
+                store.update_material(material_ids[mat_idx], material, source='手動修復')
 
 def generate_alternative_expressions(base_expression, count):
     """代替表現をAIで生成"""
@@ -1279,211 +1374,310 @@ def show_output_management():
     """出力管理タブ"""
     st.header("📁 出力管理")
     
-    if not st.session_state.generated_materials:
+    total_materials = count_materials()
+    if not total_materials:
         st.info("出力対象の教材がありません。まず教材を生成してください。")
         return
     
+    store = get_material_store()
+    context_id = st.session_state.context_id
+    
     col1, col2 = st.columns([2, 1])
     
     with col1:
+        st.subheader("🔎 教材検索")
+        col_query, col_scope = st.columns([3, 1])
+        with col_query:
+            search_query = st.text_input(
+                "キーワード", key="material_search", placeholder="例: 融資 negotiate（空白区切りでAND検索）",
+                label_visibility="collapsed"
+            )
+        with col_scope:
+            search_all = st.checkbox("全コンテキスト", key="material_search_all")
+        if search_query.strip():
+            show_search_results(search_query, None if search_all else context_id)
+        
         st.subheader("📋 生成済み教材一覧")
         
-        for i, material in enumerate(st.session_state.generated_materials):
-            with st.expander(f"教材 {i+1}: {material.get('topic', 'Unknown Topic')}"):
-                st.write(f"**タイプ**: {material.get('type', 'Unknown')}")
-                st.write(f"**生成日時**: {material.get('generated_at', 'Unknown')}")
-                
-                if 'model_dialogue' in material:
-                    st.text_area("対話文", material['model_dialogue'], height=100, key=f"dialogue_{i}")
+        # リポジトリからページ単位で読み込む
+        page_count = (total_materials + DEFAULT_PAGE_SIZE - 1) // DEFAULT_PAGE_SIZE
+        page = st.number_input(f"ページ（全{page_count}ページ・{total_materials}件）",
+                               min_value=1, max_value=page_count, value=1, key="output_page")
+        offset = (page - 1) * DEFAULT_PAGE_SIZE
+        
+        # 見出しのみ読み込み、本文は表示する項目だけ取り出す
+        for i, material in enumerate(store.list_typed_materials(context_id, offset, DEFAULT_PAGE_SIZE), offset):
+            with st.expander(f"教材 {i+1}: {material.topic or 'Unknown Topic'}"):
+                show_material_summary(material, key_prefix="output")
                 
-                if 'useful_expressions' in material:
-                    st.write("**有用表現**:")
-                    for expr in material['useful_expressions']:
-                        st.write(f"• {expr}")
+                if st.checkbox("🕘 変更履歴", key=f"history_{material.id}"):
+                    show_material_history(material.id)
     
     with col2:
         st.subheader("📤 出力オプション")
         
-        output_format = st.selectbox("出力形式", ["JSON", "Google Docs", "テキストファイル"])
+        output_format = st.selectbox(
+            "出力形式", ["JSON", "JSONL", "Google Docs", "Word（DOCX・ZIP）", "PDF（ZIP）", "テキストファイル"]
+        )
         
         # 全教材出力
         st.markdown("### 📁 全教材出力")
-        if output_format in ["JSON", "テキストファイル"]:
+        if output_format in EXPORT_FILE_TYPES:
             col_btn1, col_btn2 = st.columns(2)
             with col_btn1:
                 if st.button("💾 全教材を出力", type="primary", key="export_all"):
-                    export_materials(st.session_state.generated_materials, output_format)
+                    export_materials(store.iter_materials(context_id), output_format)
             with col_btn2:
-                # 即座ダウンロード用の準備
-                if output_format == "JSON":
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"materials_{timestamp}.json"
-                    json_data = json.dumps(st.session_state.generated_materials, ensure_ascii=False, indent=2)
-                    st.download_button(
-                        label="📥 JSON即ダウンロード",
-                        data=json_data.encode('utf-8'),
-                        file_name=filename,
-                        mime="application/json",
-                        key="quick_json_all"
-                    )
-                else:  # テキストファイル
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"materials_{timestamp}.txt"
-                    text_content = generate_text_content(st.session_state.generated_materials)
-                    st.download_button(
-                        label="📥 テキスト即ダウンロード",
-                        data=text_content.encode('utf-8'),
-                        file_name=filename,
-                        mime="text/plain",
-                        key="quick_text_all"
-                    )
+                show_quick_download("all", None, output_format, "materials")
         else:
+            course_book = st.checkbox(
+                "📘 コースブックとして1つのドキュメントにまとめる", key="gdocs_course_book",
+                help="目次と見出し付きの1ドキュメントに全教材を書き出します（API呼び出しは約2回）"
+            )
             if st.button("💾 全教材を出力", type="primary", key="export_all_gdocs"):
-                export_materials(st.session_state.generated_materials, output_format)
+                export_google_docs(store.load_material_records(context_id), course_book)
         
-        # 個別出力
+        # 個別出力（一覧はIDとトピックのみ読み込む）
         st.markdown("### 🎯 個別出力")
-        selected_indices = st.multiselect(
+        titles = store.material_titles(context_id)
+        positions = {material_id: i for i, (material_id, _) in enumerate(titles)}
+        topics = dict(titles)
+        selected_ids = st.multiselect(
             "出力する教材を選択",
-            range(len(st.session_state.generated_materials)),
-            format_func=lambda x: f"教材{x+1}: {st.session_state.generated_materials[x].get('topic', 'Unknown')}"
+            [material_id for material_id, _ in titles],
+            format_func=lambda x: f"教材{positions[x]+1}: {topics[x] or 'Unknown'}"
         )
         
-        if selected_indices:
-            if output_format in ["JSON", "テキストファイル"]:
+        if selected_ids:
+            if output_format in EXPORT_FILE_TYPES:
                 col_btn3, col_btn4 = st.columns(2)
                 with col_btn3:
                     if st.button("📤 選択教材を出力", key="export_selected"):
-                        selected_materials = [st.session_state.generated_materials[i] for i in selected_indices]
-                        export_materials(selected_materials, output_format)
+                        export_materials(store.get_materials(selected_ids), output_format)
                 with col_btn4:
-                    # 選択教材の即座ダウンロード
-                    selected_materials = [st.session_state.generated_materials[i] for i in selected_indices]
-                    if output_format == "JSON":
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"selected_materials_{timestamp}.json"
-                        json_data = json.dumps(selected_materials, ensure_ascii=False, indent=2)
-                        st.download_button(
-                            label="📥 JSON即ダウンロード",
-                            data=json_data.encode('utf-8'),
-                            file_name=filename,
-                            mime="application/json",
-                            key="quick_json_selected"
-                        )
-                    else:  # テキストファイル
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"selected_materials_{timestamp}.txt"
-                        text_content = generate_text_content(selected_materials)
-                        st.download_button(
-                            label="📥 テキスト即ダウンロード",
-                            data=text_content.encode('utf-8'),
-                            file_name=filename,
-                            mime="text/plain",
-                            key="quick_text_selected"
-                        )
+                    show_quick_download("selected", selected_ids, output_format, "selected_materials")
             else:
                 if st.button("📤 選択教材を出力", key="export_selected_gdocs"):
-                    selected_materials = [st.session_state.generated_materials[i] for i in selected_indices]
-                    export_materials(selected_materials, output_format)
+                    export_google_docs(store.get_material_records(selected_ids), course_book)
+
+# ファイルとしてダウンロードできる出力形式（material_export・material_render の形式・ボタン表示名）
+EXPORT_FILE_TYPES = {
+    "JSON": ("json", "JSON"),
+    "JSONL": ("jsonl", "JSONL"),
+    "テキストファイル": ("text", "テキスト"),
+    "Word（DOCX・ZIP）": ("docx", "Word ZIP"),
+    "PDF（ZIP）": ("pdf", "PDF ZIP")
+}
 
-def generate_text_content(materials):
-    """教材をテキスト形式で生成"""
-    text_content = ""
+def export_file_type(output_format):
+    """出力形式の (形式, ボタン表示名, 拡張子, MIMEタイプ)（DOCX・PDFは教材ごとのファイルをZIPにまとめる）"""
+    export_format, label = EXPORT_FILE_TYPES[output_format]
+    if export_format in RENDER_FORMATS:
+        return export_format, label, "zip", "application/zip"
+    extension, mime = EXPORT_FORMATS[export_format]
+    return export_format, label, extension, mime
+
+def build_export_payload(materials, output_format):
+    """教材を1件ずつ書き出してダウンロード用のバイト列にする"""
+    export_format, _ = EXPORT_FILE_TYPES[output_format]
+    if export_format in RENDER_FORMATS:
+        return render_materials_zip(materials, export_format)
+    return b"".join(iter_export_bytes(materials, export_format))
+
+def get_export_payload(slot, material_ids, output_format, build=True):
+    """ダウンロード用の出力内容を取得（教材セット・選択・形式が変わったときのみ再生成）
+    
+    slot: 全教材（"all"）/選択教材（"selected"）ごとに直近の1件だけ保持する
+    build=False のときは生成せず、最新の出力内容がなければ None を返す
+    """
+    store = get_material_store()
+    context_id = st.session_state.context_id
+    key = (
+        output_format,
+        context_id,
+        store.revision(context_id),
+        tuple(material_ids) if material_ids is not None else None
+    )
+    cache = st.session_state.setdefault('export_payload_cache', {})
+    cached = cache.get(slot)
+    if cached and cached[0] == key:
+        return cached[1]
+    if not build:
+        return None
+    
+    # 全教材は少しずつ読み込みながら書き出す
+    materials = store.iter_materials(context_id) if material_ids is None else store.get_materials(material_ids)
+    payload = build_export_payload(materials, output_format)
+    cache[slot] = (key, payload)
+    return payload
+
+def show_quick_download(slot, material_ids, output_format, file_prefix):
+    """即ダウンロードボタン（出力内容は教材が変わるまで再利用）
+    
+    DOCX・PDFは全教材の描画に時間がかかるため、「準備」ボタンで生成してからダウンロードを表示する
+    """
+    export_format, label, extension, mime = export_file_type(output_format)
+    if export_format in RENDER_FORMATS:
+        payload = get_export_payload(slot, material_ids, output_format, build=False)
+        if payload is None:
+            if not st.button(f"🛠️ {label}を準備", key=f"prepare_{export_format}_{slot}"):
+                return
+            with st.spinner(f"{label}を作成中..."):
+                payload = get_export_payload(slot, material_ids, output_format)
+    else:
+        payload = get_export_payload(slot, material_ids, output_format)
     
-    for i, material in enumerate(materials):
-        text_content += f"=== 教材 {i+1}: {material.get('topic', 'Unknown')} ===\n\n"
-        text_content += f"タイプ: {material.get('type', 'Unknown')}\n"
-        text_content += f"生成日時: {material.get('generated_at', 'Unknown')}\n"
-        
-        if 'model_dialogue' in material:
-            text_content += f"\n【対話文】\n{material['model_dialogue']}\n"
-        
-        if 'useful_expressions' in material:
-            text_content += f"\n【有用表現】\n"
-            for expr in material['useful_expressions']:
-                text_content += f"• {expr}\n"
-        
-        if 'additional_questions' in material:
-            text_content += f"\n【追加質問】\n"
-            for q in material['additional_questions']:
-                text_content += f"• {q}\n"
-        
-        if 'discussion_topic' in material:
-            text_content += f"\n【ディスカッショントピック】\n{material['discussion_topic']}\n"
-        
-        if 'background_info' in material:
-            text_content += f"\n【背景情報】\n{material['background_info']}\n"
-        
-        if 'key_points' in material:
-            text_content += f"\n【議論ポイント】\n"
-            for point in material['key_points']:
-                text_content += f"• {point}\n"
-        
-        if 'discussion_questions' in material:
-            text_content += f"\n【討議質問】\n"
-            for q in material['discussion_questions']:
-                text_content += f"• {q}\n"
-        
-        if 'chart_description' in material:
-            text_content += f"\n【図表説明】\n{material['chart_description']}\n"
-        
-        if 'vocabulary' in material:
-            text_content += f"\n【重要語彙】\n"
-            for vocab in material['vocabulary']:
-                text_content += f"• {vocab}\n"
-        
-        if 'practice_questions' in material:
-            text_content += f"\n【練習問題】\n"
-            for q in material['practice_questions']:
-                text_content += f"• {q}\n"
-        
-        text_content += "\n" + "="*50 + "\n\n"
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    st.download_button(
+        label=f"📥 {label}即ダウンロード",
+        data=payload,
+        file_name=f"{file_prefix}_{timestamp}.{extension}",
+        mime=mime,
+        key=f"quick_{extension}_{slot}"
+    )
+
+def format_history_value(value):
+    """差分表示用に値を1行へ整形"""
+    if value is None:
+        return "（なし）"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def show_material_history(material_id):
+    """教材の版一覧・差分表示・ロールバック"""
+    store = get_material_store()
+    versions = store.list_versions(material_id)
+    if len(versions) <= 1:
+        st.caption("変更履歴はありません")
+        return
+    
+    labels = {
+        v['version']: f"v{v['version']} {v['source'] or '変更'}（{(v['created_at'] or '')[:16]}）"
+        for v in versions
+    }
+    current = versions[0]['version']
+    col_old, col_new = st.columns(2)
+    with col_old:
+        old_version = st.selectbox("比較元", list(labels)[1:], format_func=labels.get,
+                                   key=f"history_old_{material_id}")
+    with col_new:
+        new_version = st.selectbox("比較先", list(labels), format_func=labels.get,
+                                   key=f"history_new_{material_id}")
+    
+    changes = store.diff_versions(material_id, old_version, new_version)
+    if not changes:
+        st.caption("差分はありません")
+    for change in changes:
+        field = change['field'] if change['index'] is None else f"{change['field']}[{change['index'] + 1}]"
+        st.markdown(f"**{field}**")
+        st.code(f"- {format_history_value(change['old'])}\n+ {format_history_value(change['new'])}",
+                language="diff")
+    
+    if old_version != current and st.button(f"↩️ v{old_version}に戻す", key=f"rollback_{material_id}"):
+        store.rollback_material(material_id, old_version)
+        st.success(f"v{old_version}の内容に戻しました（v{current + 1}として記録）")
+        st.rerun()
+
+def show_search_results(query, context_id):
+    """全文検索の結果を表示"""
+    store = get_material_store()
+    results = store.search(query, context_id)
+    if not results:
+        st.info("該当する教材はありません")
+        return
     
-    return text_content
+    st.caption(f"{len(results)}件" + ("（上位のみ表示）" if len(results) >= 50 else ""))
+    for result in results:
+        with st.expander(f"#{result['id']} {result['topic'] or 'Unknown'}（{result['type']}）"):
+            st.markdown(result['snippet'])
+            material = store.get_typed_material(result['id'])
+            if material:
+                show_material_summary(material, key_prefix="search", show_header=False)
+
+def show_material_summary(material, key_prefix, show_header=True):
+    """型付き教材の概要を表示（タイプごとの主要項目）"""
+    if show_header:
+        st.write(f"**タイプ**: {material.type or 'Unknown'}")
+        st.write(f"**生成日時**: {material.generated_at or 'Unknown'}")
+    
+    if isinstance(material, RoleplayMaterial):
+        if material.model_dialogue:
+            st.text_area("対話文", material.model_dialogue, height=100, key=f"{key_prefix}_dialogue_{material.id}")
+    elif isinstance(material, DiscussionMaterial):
+        if material.discussion_topic:
+            st.write(f"**ディスカッショントピック**: {material.discussion_topic}")
+    elif isinstance(material, ExpressionPracticeMaterial):
+        if material.chart_description:
+            st.text_area("図表説明", material.chart_description, height=100, key=f"{key_prefix}_chart_{material.id}")
+    
+    expressions = material.get('useful_expressions') or material.get('useful_vocabulary')
+    if expressions:
+        st.write("**有用表現**:")
+        for expr in expressions:
+            st.write(f"• {expr}")
 
 def export_materials(materials, format_type):
-    """教材出力処理"""
+    """ファイル形式の教材出力処理"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    _, label, extension, mime = export_file_type(format_type)
+    filename = f"materials_{timestamp}.{extension}"
+    
+    st.download_button(
+        label=f"📥 {label}ファイルをダウンロード",
+        data=build_export_payload(materials, format_type),
+        file_name=filename,
+        mime=mime,
+        key=f"{extension}_download_{timestamp}"
+    )
+    st.success(f"✅ {filename} のダウンロード準備完了")
+
+def export_google_docs(records, course_book=False):
+    """Google Docs出力処理（records: (教材ID, 教材) のリスト）
     
-    if format_type == "JSON":
-        filename = f"materials_{timestamp}.json"
-        json_data = json.dumps(materials, ensure_ascii=False, indent=2)
-        
-        st.download_button(
-            label="📥 JSONファイルをダウンロード",
-            data=json_data.encode('utf-8'),
-            file_name=filename,
-            mime="application/json",
-            key=f"json_download_{timestamp}"
-        )
-        st.success(f"✅ {filename} のダウンロード準備完了")
-    
-    elif format_type == "Google Docs":
-        try:
-            google_client = GoogleDocsAPIClient()
-            if google_client.is_available():
-                for i, material in enumerate(materials):
-                    title = f"教材_{timestamp}_{i+1}_{material.get('topic', 'Unknown')}"
-                    document_url = google_client.create_and_write_material(title, material)
-                    if document_url:
-                        st.success(f"✅ [教材{i+1}]({document_url}) をGoogle Docsに出力しました")
+    教材ごとの出力では前回出力したドキュメントを更新し、変更のない教材は書き込まない。
+    course_book: 全教材を1つのドキュメントにまとめる（毎回新しいドキュメントを作成）
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    store = get_material_store()
+    try:
+        google_client = GoogleDocsAPIClient()
+        if not google_client.is_available():
+            st.error("Google Docs APIが利用できません。設定を確認してください。")
+        elif course_book:
+            context = store.get_context(st.session_state.context_id) if st.session_state.context_id else None
+            title = f"コースブック_{(context or {}).get('name') or '教材'}_{timestamp}"
+            with st.spinner("📘 コースブックを作成中..."):
+                document_url = google_client.create_course_book(title, [material for _, material in records])
+            if document_url:
+                st.success(f"✅ [コースブック]({document_url}) をGoogle Docsに出力しました")
             else:
-                st.error("Google Docs APIが利用できません。設定を確認してください。")
-        except Exception as e:
-            st.error(f"Google Docs出力エラー: {str(e)}")
-    
-    elif format_type == "テキストファイル":
-        filename = f"materials_{timestamp}.txt"
-        text_content = generate_text_content(materials)
-        
-        st.download_button(
-            label="📥 テキストファイルをダウンロード",
-            data=text_content.encode('utf-8'),
-            file_name=filename,
-            mime="text/plain",
-            key=f"text_download_{timestamp}"
-        )
-        st.success(f"✅ {filename} のダウンロード準備完了")
+                st.error("コースブックの出力に失敗しました")
+        elif records:
+            exports = store.doc_exports([material_id for material_id, _ in records])
+            items = [(f"教材_{timestamp}_{i+1}_{material.get('topic', 'Unknown')}", material, exports.get(material_id))
+                     for i, (material_id, material) in enumerate(records)]
+            # 割り当ての範囲で並列に同期し、完了したものから表示
+            progress_bar = st.progress(0.0)
+            synced = {}
+            unchanged = 0
+            for done, (i, status, export) in enumerate(google_client.sync_materials(items), 1):
+                progress_bar.progress(done / len(items))
+                if status == 'failed':
+                    st.error(f"教材{i+1} のGoogle Docs出力に失敗しました")
+                    continue
+                if status == 'unchanged':
+                    unchanged += 1
+                    continue
+                synced[records[i][0]] = export
+                document_url = f"https://docs.google.com/document/d/{export['document_id']}/edit"
+                action = "更新しました" if status == 'updated' else "出力しました"
+                st.success(f"✅ [教材{i+1}]({document_url}) をGoogle Docsに{action}")
+            store.save_doc_exports(synced)
+            if unchanged:
+                st.info(f"変更のない教材 {unchanged}件 は前回のドキュメントのままです")
+    except Exception as e:
+        st.error(f"Google Docs出力エラー: {str(e)}")
 
 def generate_audio_prompt(dialogue):
     """音声生成用プロンプトを作成"""
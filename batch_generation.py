@@ -0,0 +1,145 @@
+"""
+一括生成の共通処理
+Streamlitに依存しない教材生成・重複回避処理（画面とバックグラウンドジョブの両方から利用）
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# トピックごとの生成状態
+STATUS_OK = 'ok'
+STATUS_FALLBACK = 'fallback'
+STATUS_FAILED = 'failed'
+STATUS_TRUNCATED = 'truncated'
+
+
+def extract_english_part(expression):
+    """表現から英語部分のみを抽出（改良版）"""
+    expr_clean = expression.strip()
+
+    # 各種区切り文字で英語部分を抽出
+    separators = [': ', ':', '：', ' - ', ' – ', ' — ', ' | ', ' / ']
+
+    for sep in separators:
+        if sep in expr_clean:
+            parts = expr_clean.split(sep)
+            if len(parts) >= 2:
+                # 最初の部分が日本語のようなら2番目、そうでなければ1番目
+                first_part = parts[0].strip()
+                second_part = parts[1].strip()
+
+                # 日本語文字が含まれているかチェック
+                if re.search(r'[あ-んア-ンー一-龯]', first_part):
+                    expr_clean = second_part
+                else:
+                    expr_clean = first_part
+                break
+
+    # 追加の清理
+    expr_clean = re.sub(r'^["\'\[\(]*', '', expr_clean)  # 先頭の記号を除去
+    expr_clean = re.sub(r'["\'\]\)]*$', '', expr_clean)  # 末尾の記号を除去
+    expr_clean = re.sub(r'\s*-\s*[あ-んア-ンー一-龯].*$', '', expr_clean)  # 末尾の日本語説明を除去
+
+    return expr_clean.strip()
+
+
+def collect_used_expressions(materials: Iterable[Dict]) -> Set[str]:
+    """教材から使用済み表現（英語部分・小文字）を収集"""
+    used_expressions = set()
+    for material in materials:
+        for expr in material.get('useful_expressions') or []:
+            used_expressions.add(extract_english_part(expr).lower())
+    return used_expressions
+
+
+def generate_topic_material(client, context_data: Dict, template_type: str, template_config: Dict,
+                            topic: str, used_expressions: List[str]) -> Tuple[Dict, str, Optional[str]]:
+    """トピック1件分の教材を生成し、(教材, 生成状態, エラー内容) を返す"""
+    # コンテキストデータにテンプレート設定を追加
+    enhanced_context = dict(context_data)
+    enhanced_context['template_config'] = template_config
+
+    if template_type == 'ロールプレイ':
+        material = client.generate_roleplay_material(enhanced_context, topic, template_config, used_expressions)
+    elif template_type == 'ディスカッション':
+        material = client.generate_discussion_material(enhanced_context, topic, template_config, used_expressions)
+    else:  # 表現練習
+        material = client.generate_expression_practice_material(enhanced_context, topic, template_config, used_expressions)
+
+    # 生成状態は教材本体から分離して返す
+    status = material.pop('generation_status', STATUS_OK)
+    error = material.pop('generation_error', None)
+    return material, status, error
+
+
+def auto_fix_duplicates(materials: List[Dict], client, on_fix=None) -> int:
+    """生成された教材の重複を自動修正し、修正件数を返す
+
+    on_fix: 代替表現1件の生成ごとに呼ばれるコールバック（ジョブのハートビート用）
+    """
+    # 重複検出
+    expressions_map = {}
+    for i, material in enumerate(materials):
+        if 'useful_expressions' in material:
+            for j, expr in enumerate(material['useful_expressions']):
+                expr_clean = extract_english_part(expr).lower()
+                if expr_clean in expressions_map:
+                    expressions_map[expr_clean].append((i, j, expr))
+                else:
+                    expressions_map[expr_clean] = [(i, j, expr)]
+
+    # 重複がある場合の自動修正
+    fix_count = 0
+
+    for expr_clean, occurrences in expressions_map.items():
+        if len(occurrences) > 1:
+            # 最初の1つは残し、残りを代替表現に置換
+            for k, (mat_idx, expr_idx, original) in enumerate(occurrences[1:], 1):
+                try:
+                    # 代替表現を生成
+                    alternative = generate_single_alternative(expr_clean, client)
+                    if alternative and alternative.lower() != expr_clean:
+                        materials[mat_idx]['useful_expressions'][expr_idx] = alternative
+                        fix_count += 1
+                except Exception as e:
+                    print(f"自動修正エラー: {e}")
+                if on_fix:
+                    on_fix()
+
+    return fix_count
+
+
+def generate_single_alternative(base_expression, client):
+    """単一の代替表現を生成"""
+    try:
+        prompt = f"""
+以下のビジネス英語表現と同じ意味で、異なる表現方法の代替案を1つ生成してください。
+
+【元の表現】: {base_expression}
+
+【要件】:
+1. 同じ意味・ニュアンスを保つ
+2. ビジネス場面で適切
+3. 自然な英語表現
+4. 元の表現とは異なる単語・構造を使用
+
+【出力形式】:
+代替表現のみを返してください（説明不要）
+"""
+
+        response = client.client.messages.create(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=100,
+            messages=[{"role": "user", "content": prompt}]
+        )
+
+        if hasattr(response, 'content') and len(response.content) > 0:
+            alternative = response.content[0].text.strip()
+            # 余計な装飾を除去
+            alternative = alternative.replace('"', '').replace("'", "").strip()
+            return alternative
+
+    except Exception as e:
+        print(f"代替表現生成エラー: {e}")
+
+    return None
@@ -2,6 +2,7 @@ import os
 import anthropic
 from typing import List, Dict
 import json
+from batch_generation import STATUS_FALLBACK, STATUS_TRUNCATED
 
 class ClaudeAPIClient:
     def __init__(self):
@@ -205,6 +206,7 @@ JSON配列で3個のシチュエーションを返してください。
 }}
 """
 
+        truncated = False
         try:
             response = self.client.messages.create(
                 model="claude-3-5-sonnet-20241022",
@@ -212,6 +214,7 @@ JSON配列で3個のシチュエーションを返してください。
                 messages=[{"role": "user", "content": prompt}]
             )
             
+            truncated = getattr(response, 'stop_reason', None) == 'max_tokens'
             content = response.content[0].text
             start = content.find('{')
             end = content.rfind('}') + 1
@@ -223,13 +226,13 @@ JSON配列で3個のシチュエーションを返してください。
                 material["type"] = "ロールプレイ"
                 if include_audio:
                     material["audio_script"] = "※音声ファイル作成用スクリプト（開発予定）"
-                return material
+                return self._mark_truncated(material, truncated)
             else:
-                return self._get_fallback_roleplay()
+                return self._mark_fallback(self._get_fallback_roleplay(), "応答からJSONを抽出できませんでした", truncated)
                 
         except Exception as e:
             print(f"Claude API エラー: {e}")
-            return self._get_fallback_roleplay()
+            return self._mark_fallback(self._get_fallback_roleplay(), str(e), truncated)
 
     def generate_discussion_material(self, context_data: Dict, topic: str, template_config: Dict = None, used_expressions: List[str] = None) -> Dict:
         """ディスカッション教材を生成"""
@@ -330,6 +333,7 @@ JSON配列で3個のシチュエーションを返してください。
 }}
 """
 
+        truncated = False
         try:
             response = self.client.messages.create(
                 model="claude-3-5-sonnet-20241022",
@@ -337,6 +341,7 @@ JSON配列で3個のシチュエーションを返してください。
                 messages=[{"role": "user", "content": prompt}]
             )
             
+            truncated = getattr(response, 'stop_reason', None) == 'max_tokens'
             content = response.content[0].text
             start = content.find('{')
             end = content.rfind('}') + 1
@@ -346,13 +351,13 @@ JSON配列で3個のシチュエーションを返してください。
                 material_json = ''.join(char for char in material_json if ord(char) >= 32 or char in '\n\r\t')
                 material = json.loads(material_json)
                 material["type"] = "ディスカッション"
-                return material
+                return self._mark_truncated(material, truncated)
             else:
-                return self._get_fallback_discussion()
+                return self._mark_fallback(self._get_fallback_discussion(), "応答からJSONを抽出できませんでした", truncated)
                 
         except Exception as e:
             print(f"Claude API エラー: {e}")
-            return self._get_fallback_discussion()
+            return self._mark_fallback(self._get_fallback_discussion(), str(e), truncated)
 
     def generate_expression_practice_material(self, context_data: Dict, topic: str, template_config: Dict = None, used_expressions: List[str] = None) -> Dict:
         """表現練習教材を生成"""
@@ -455,6 +460,7 @@ JSON配列で3個のシチュエーションを返してください。
 }}
 """
 
+        truncated = False
         try:
             response = self.client.messages.create(
                 model="claude-3-5-sonnet-20241022",
@@ -462,6 +468,7 @@ JSON配列で3個のシチュエーションを返してください。
                 messages=[{"role": "user", "content": prompt}]
             )
             
+            truncated = getattr(response, 'stop_reason', None) == 'max_tokens'
             content = response.content[0].text
             start = content.find('{')
             end = content.rfind('}') + 1
@@ -471,13 +478,72 @@ JSON配列で3個のシチュエーションを返してください。
                 material_json = ''.join(char for char in material_json if ord(char) >= 32 or char in '\n\r\t')
                 material = json.loads(material_json)
                 material["type"] = "表現練習"
-                return material
+                return self._mark_truncated(material, truncated)
             else:
-                return self._get_fallback_expression_practice()
+                return self._mark_fallback(self._get_fallback_expression_practice(), "応答からJSONを抽出できませんでした", truncated)
                 
         except Exception as e:
             print(f"Claude API エラー: {e}")
-            return self._get_fallback_expression_practice()
+            return self._mark_fallback(self._get_fallback_expression_practice(), str(e), truncated)
+
+    def judge_materials(self, materials: List[Dict], rubric: str, context_data: Dict = None) -> List[Dict]:
+        """複数教材をルーブリックに基づいてまとめて審査"""
+        context = context_data or {}
+        materials_section = json.dumps(
+            [{"id": f"m{i}", **material} for i, material in enumerate(materials)],
+            ensure_ascii=False
+        )
+        
+        prompt = f"""
+あなたは語学教材の品質審査の専門家です。以下の{len(materials)}件の教材を、ルーブリックに従って1件ずつ審査してください。
+
+【受講者コンテキスト】
+- 英語レベル: {context.get('english_level', '中級')}
+- カウンセリングメモ: {context.get('counseling_memo', '')[:300]}
+
+【ルーブリック】
+{rubric}
+
+【教材一覧（JSON）】
+{materials_section}
+
+【出力形式】
+各教材について以下のJSON配列で出力してください（idは入力と同じ値）：
+[
+  {{"id": "m0", "naturalness": 4, "business_appropriateness": 5, "level_fit": 4, "overall": 4, "issues": ["問題点があれば日本語で簡潔に"]}}
+]
+"""
+
+        response = self.client.messages.create(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=min(8000, 300 * len(materials) + 500),
+            messages=[{"role": "user", "content": prompt}]
+        )
+        
+        content = response.content[0].text
+        start = content.find('[')
+        end = content.rfind(']') + 1
+        if start == -1 or end == 0:
+            raise ValueError("審査結果のJSONが見つかりません")
+        
+        verdicts_json = content[start:end]
+        # 制御文字を除去
+        verdicts_json = ''.join(char for char in verdicts_json if ord(char) >= 32 or char in '\n\r\t')
+        verdicts = {verdict.get('id'): verdict for verdict in json.loads(verdicts_json)}
+        return [verdicts.get(f"m{i}") for i in range(len(materials))]
+
+    def _mark_truncated(self, material: Dict, truncated: bool) -> Dict:
+        """出力が最大トークン数で打ち切られた教材に生成状態を記録"""
+        if truncated:
+            material["generation_status"] = STATUS_TRUNCATED
+            material["generation_error"] = "出力が最大トークン数で打ち切られました"
+        return material
+
+    def _mark_fallback(self, material: Dict, reason: str, truncated: bool = False) -> Dict:
+        """フォールバック教材に生成状態を記録（成功した教材と区別できるようにする）"""
+        material["generation_status"] = STATUS_TRUNCATED if truncated else STATUS_FALLBACK
+        material["generation_error"] = reason
+        return material
 
     # フォールバック用のメソッド群
     def _get_fallback_topics(self) -> List[str]:
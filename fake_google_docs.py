@@ -0,0 +1,319 @@
+"""
+ローカルのGoogle Docs APIスタンドイン
+documents.create / documents.batchUpdate / documents.get をプロセス内で再現し、
+認証情報なしでGoogle Docs出力の動作確認とスループット計測ができるようにする
+
+- インデックスは本物と同じUTF-16コード単位（本文は index 1 から、新規ドキュメントは改行1つ）
+- insertText・deleteContentRange・updateParagraphStyle・createParagraphBullets・deleteParagraphBullets に対応
+- 範囲外のインデックスは本物と同じく 400 エラー
+- リクエストごとの遅延、一定割合の 429、1分あたりの書き込み上限超過の 429 を再現できる
+
+GOOGLE_DOCS_BACKEND=fake で GoogleDocsAPIClient がこのスタンドインを使う。
+
+使い方（出力スループットの計測）:
+    python fake_google_docs.py --materials 50 --workers 4 --latency 0.15 --error-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# 1リクエストあたりの平均遅延（秒）と、ランダムに 429 を返す割合
+FAKE_LATENCY = float(os.getenv('GOOGLE_DOCS_FAKE_LATENCY', '0.15'))
+FAKE_ERROR_RATE = float(os.getenv('GOOGLE_DOCS_FAKE_ERROR_RATE', '0.0'))
+
+# プロジェクト全体の1分あたりの書き込み上限（Docs APIの既定の割り当て）
+FAKE_WRITE_QUOTA = int(os.getenv('GOOGLE_DOCS_FAKE_WRITE_QUOTA', '600'))
+
+
+def _http_error(status: int, message: str) -> HttpError:
+    content = json.dumps({'error': {'code': status, 'message': message}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+class FakeDocument:
+    """本文（UTF-16）と段落スタイル・箇条書きの範囲を持つドキュメント"""
+
+    def __init__(self, document_id: str, title: str):
+        self.document_id = document_id
+        self.title = title
+        self.text = "\n".encode('utf-16-le')
+        self.styles = []   # [開始, 終了, 段落スタイル]
+        self.bullets = []  # [開始, 終了, プリセット]
+        self.revision = 1
+
+    @property
+    def end_index(self) -> int:
+        """本文末尾のインデックス（最後の改行の後ろ）"""
+        return len(self.text) // 2 + 1
+
+    def _check_range(self, start: int, end: int, allow_last_newline: bool = True):
+        limit = self.end_index if allow_last_newline else self.end_index - 1
+        if not (1 <= start < end <= limit):
+            raise _http_error(400, f"Invalid range: {start}-{end} (end index {self.end_index})")
+
+    def insert_text(self, index: int, text: str):
+        if not 1 <= index < self.end_index:
+            raise _http_error(400, f"Index {index} must be less than the end index {self.end_index}")
+        data = text.encode('utf-16-le')
+        offset = (index - 1) * 2
+        self.text = self.text[:offset] + data + self.text[offset:]
+        length = len(data) // 2
+        for ranges in (self.styles, self.bullets):
+            for item in ranges:
+                if item[0] >= index:
+                    item[0] += length
+                if item[1] > index:
+                    item[1] += length
+
+    def delete_range(self, start: int, end: int):
+        # 最後の改行は削除できない
+        self._check_range(start, end, allow_last_newline=False)
+        self.text = self.text[:(start - 1) * 2] + self.text[(end - 1) * 2:]
+        length = end - start
+
+        def shift(position):
+            if position >= end:
+                return position - length
+            return min(position, start)
+
+        for ranges in (self.styles, self.bullets):
+            ranges[:] = [[shift(a), shift(b), value] for a, b, value in ranges if shift(a) < shift(b)]
+
+    def apply(self, request: Dict):
+        if 'insertText' in request:
+            body = request['insertText']
+            self.insert_text(body['location']['index'], body['text'])
+        elif 'deleteContentRange' in request:
+            body = request['deleteContentRange']['range']
+            self.delete_range(body['startIndex'], body['endIndex'])
+        elif 'updateParagraphStyle' in request:
+            body = request['updateParagraphStyle']
+            start, end = body['range']['startIndex'], body['range']['endIndex']
+            self._check_range(start, end)
+            self.styles.append([start, end, body['paragraphStyle']['namedStyleType']])
+        elif 'createParagraphBullets' in request:
+            body = request['createParagraphBullets']
+            start, end = body['range']['startIndex'], body['range']['endIndex']
+            self._check_range(start, end)
+            self.bullets.append([start, end, body['bulletPreset']])
+        elif 'deleteParagraphBullets' in request:
+            body = request['deleteParagraphBullets']['range']
+            start, end = body['startIndex'], body['endIndex']
+            self._check_range(start, end)
+            self.bullets.append([start, end, None])
+        else:
+            raise _http_error(400, f"Unsupported request: {list(request)}")
+
+    def _paragraph_value(self, ranges: List, start: int, end: int) -> Optional[str]:
+        """段落に重なる範囲のうち最後に設定された値"""
+        value = None
+        for a, b, item in ranges:
+            if a < end and start < b:
+                value = item
+        return value
+
+    def to_resource(self) -> Dict:
+        """documents.get の応答（本文は段落ごと）"""
+        content = [{'startIndex': 0, 'endIndex': 1, 'sectionBreak': {}}]
+        text = self.text.decode('utf-16-le')
+        index = 1
+        for line in text.split("\n")[:-1]:
+            paragraph_text = line + "\n"
+            end = index + len(paragraph_text.encode('utf-16-le')) // 2
+            paragraph = {
+                'elements': [{'startIndex': index, 'endIndex': end, 'textRun': {'content': paragraph_text}}],
+                'paragraphStyle': {'namedStyleType': self._paragraph_value(self.styles, index, end) or 'NORMAL_TEXT'}
+            }
+            bullet = self._paragraph_value(self.bullets, index, end)
+            if bullet:
+                paragraph['bullet'] = {'listId': bullet}
+            content.append({'startIndex': index, 'endIndex': end, 'paragraph': paragraph})
+            index = end
+        return {
+            'documentId': self.document_id,
+            'title': self.title,
+            'revisionId': str(self.revision),
+            'body': {'content': content}
+        }
+
+
+class FakeDocsBackend:
+    """ドキュメントを保持し、遅延・割り当てエラーを再現する（スレッドセーフ）"""
+
+    def __init__(self, latency: float = FAKE_LATENCY, error_rate: float = FAKE_ERROR_RATE,
+                 write_quota: int = FAKE_WRITE_QUOTA, seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.write_quota = write_quota
+        self.documents: Dict[str, FakeDocument] = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.write_times = deque()
+        self.stats = {'create': 0, 'batchUpdate': 0, 'get': 0, 'requests': 0, 'errors_429': 0}
+
+    def _call(self, method: str, write: bool):
+        """遅延を入れ、割り当て超過・ランダムな 429 を判定"""
+        with self.lock:
+            delay = self.latency * self.random.uniform(0.5, 1.5)
+            inject = self.random.random() < self.error_rate
+        time.sleep(delay)
+        with self.lock:
+            now = time.monotonic()
+            if write:
+                while self.write_times and now - self.write_times[0] >= 60:
+                    self.write_times.popleft()
+                if len(self.write_times) >= self.write_quota:
+                    inject = True
+            if inject:
+                self.stats['errors_429'] += 1
+                raise _http_error(429, "Quota exceeded for quota metric 'Write requests'")
+            if write:
+                self.write_times.append(now)
+            self.stats[method] += 1
+
+    def create(self, body: Dict) -> Dict:
+        self._call('create', write=True)
+        with self.lock:
+            document_id = uuid.uuid4().hex
+            self.documents[document_id] = FakeDocument(document_id, body.get('title', ''))
+            return self.documents[document_id].to_resource()
+
+    def batch_update(self, document_id: str, body: Dict) -> Dict:
+        self._call('batchUpdate', write=True)
+        with self.lock:
+            document = self._get(document_id)
+            requests = body.get('requests', [])
+            # 途中で失敗した場合は本物と同様に何も反映しない
+            snapshot = (document.text, [list(r) for r in document.styles], [list(r) for r in document.bullets])
+            try:
+                for request in requests:
+                    document.apply(request)
+            except HttpError:
+                document.text, document.styles, document.bullets = snapshot
+                raise
+            document.revision += 1
+            self.stats['requests'] += len(requests)
+            return {'documentId': document_id, 'replies': [{} for _ in requests],
+                    'writeControl': {'requiredRevisionId': str(document.revision)}}
+
+    def get(self, document_id: str) -> Dict:
+        self._call('get', write=False)
+        with self.lock:
+            return self._get(document_id).to_resource()
+
+    def _get(self, document_id: str) -> FakeDocument:
+        if document_id not in self.documents:
+            raise _http_error(404, f"Requested entity was not found: {document_id}")
+        return self.documents[document_id]
+
+    def text(self, document_id: str) -> str:
+        """ドキュメント本文（テスト・確認用）"""
+        with self.lock:
+            return self._get(document_id).text.decode('utf-16-le')
+
+
+class _FakeRequest:
+    """googleapiclient の HttpRequest と同じく execute() で実行される"""
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def execute(self, http=None, num_retries=0):
+        return self.func(*self.args)
+
+
+class _FakeDocuments:
+    def __init__(self, backend: FakeDocsBackend):
+        self.backend = backend
+
+    def create(self, body: Dict) -> _FakeRequest:
+        return _FakeRequest(self.backend.create, body)
+
+    def batchUpdate(self, documentId: str, body: Dict) -> _FakeRequest:
+        return _FakeRequest(self.backend.batch_update, documentId, body)
+
+    def get(self, documentId: str) -> _FakeRequest:
+        return _FakeRequest(self.backend.get, documentId)
+
+
+class FakeDocsService:
+    """build('docs', 'v1') の代わりに使うサービス"""
+
+    def __init__(self, backend: Optional[FakeDocsBackend] = None):
+        self.backend = backend or FakeDocsBackend()
+
+    def documents(self) -> _FakeDocuments:
+        return _FakeDocuments(self.backend)
+
+
+_fake_service = None
+_fake_lock = threading.Lock()
+
+
+def get_fake_service() -> FakeDocsService:
+    """プロセス内で共有するスタンドイン"""
+    global _fake_service
+    with _fake_lock:
+        if _fake_service is None:
+            _fake_service = FakeDocsService()
+        return _fake_service
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """スタンドインに対してGoogle Docs出力のスループットを計測"""
+    parser = argparse.ArgumentParser(description="Google Docs出力のスループット計測（ローカルのスタンドイン使用）")
+    parser.add_argument('--materials', type=int, default=50, help="出力する教材数")
+    parser.add_argument('--workers', type=int, default=4, help="並列出力の同時実行数")
+    parser.add_argument('--latency', type=float, default=FAKE_LATENCY, help="1リクエストの平均遅延（秒）")
+    parser.add_argument('--error-rate', type=float, default=FAKE_ERROR_RATE, help="ランダムに 429 を返す割合")
+    parser.add_argument('--write-quota', type=int, default=600, help="クライアント側の1分あたり書き込み上限")
+    args = parser.parse_args(argv)
+
+    os.environ['GOOGLE_DOCS_BACKEND'] = 'fake'
+    # スクリプト実行時もクライアントと同じモジュールのスタンドインを使う
+    import fake_google_docs
+    import google_docs_api
+    from claude_api import ClaudeAPIClient
+
+    google_docs_api.DOCS_WRITE_QUOTA = args.write_quota
+    service = fake_google_docs.get_fake_service()
+    service.backend.latency = args.latency
+    service.backend.error_rate = args.error_rate
+
+    samples = [ClaudeAPIClient._get_fallback_roleplay(None), ClaudeAPIClient._get_fallback_discussion(None),
+               ClaudeAPIClient._get_fallback_expression_practice(None)]
+    materials = [dict(samples[i % 3], topic=f"トピック{i + 1}") for i in range(args.materials)]
+    client = google_docs_api.GoogleDocsAPIClient()
+
+    started = time.perf_counter()
+    items = [(f"教材_{i + 1}", material) for i, material in enumerate(materials)]
+    results = list(client.create_and_write_materials(items, max_workers=args.workers))
+    elapsed = time.perf_counter() - started
+    succeeded = sum(1 for _, url in results if url)
+    print(f"教材ごとの出力: {succeeded}/{len(items)}件 {elapsed:.2f}秒（{succeeded / elapsed:.1f}件/秒）")
+
+    started = time.perf_counter()
+    url = client.create_course_book("コースブック", materials)
+    elapsed = time.perf_counter() - started
+    print(f"コースブック: {'成功' if url else '失敗'} {elapsed:.2f}秒")
+
+    stats = service.backend.stats
+    print(f"API呼び出し: create {stats['create']}回 / batchUpdate {stats['batchUpdate']}回 / "
+          f"429 {stats['errors_429']}回", file=sys.stderr)
+    return 0 if succeeded == len(items) and url else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,44 +1,416 @@
 import os
+import hashlib
 import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Optional
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+DOCS_SCOPES = [
+    'https://www.googleapis.com/auth/documents',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# 1分あたりのリクエスト上限（Docs APIの割り当てに合わせて環境変数で調整）
+DOCS_WRITE_QUOTA = int(os.getenv('GOOGLE_DOCS_WRITE_QUOTA', '60'))
+DOCS_READ_QUOTA = int(os.getenv('GOOGLE_DOCS_READ_QUOTA', '300'))
+
+# 一括出力の同時実行数
+DOCS_EXPORT_WORKERS = int(os.getenv('GOOGLE_DOCS_EXPORT_WORKERS', '4'))
+
+# 接続先（fake: fake_google_docs のローカルスタンドイン。認証情報なしで動作確認・計測できる）
+DOCS_BACKEND = os.getenv('GOOGLE_DOCS_BACKEND', 'google')
+
+# 1回の batchUpdate に含めるリクエスト数の上限（超える場合は書式設定を分けて送る）
+MAX_REQUESTS_PER_BATCH = 500
+
+# 教材の項目（出力順）: (キー, 見出し, リスト項目か)
+# app_practical のフラットな教材と app.py の generated_material の両方の項目を含む
+DOC_SECTIONS = [
+    ('model_dialogue', '💬 モデルダイアログ', False),
+    ('discussion_topic', '💭 ディスカッショントピック', False),
+    ('discussion_aim', '🎯 ディスカッションの狙い', False),
+    ('background_info', '📖 背景情報', False),
+    ('key_points', '📌 議論ポイント', True),
+    ('guide_questions', '❓ ガイド質問', True),
+    ('chart_description', '📊 図表・データ説明', False),
+    ('explanation_points', '💡 説明のポイント', False),
+    ('key_phrases', '🔑 キーフレーズ', True),
+    ('practice_steps', '📚 段階的練習ステップ', True),
+    ('useful_expressions', '📝 有用表現・語彙', True),
+    ('useful_vocabulary', '📝 重要語彙', True),
+    ('vocabulary', '📝 重要語彙', True),
+    ('discussion_questions', '❓ 討議質問', True),
+    ('practice_questions', '❓ 練習問題', True),
+    ('additional_questions', '❓ 追加質問', True)
+]
+
+# 箇条書きの種類
+NUMBERED_LIST = 'NUMBERED_DECIMAL_ALPHA_ROMAN'
+BULLET_LIST = 'BULLET_DISC_CIRCLE_SQUARE'
+
+# 割り当て超過・一時的なエラーの再試行
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
+
+class RateLimiter:
+    """トークンバケット方式のリクエスト数制限（スレッド間で共有）
+
+    1分あたり per_minute 件まで。溜められるのは10秒分までとし、割り当ての1分枠を超えにくくする
+    """
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_services: Dict[str, Tuple[object, object]] = {}
+_shared_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def get_rate_limiter(project_id: str, kind: str) -> RateLimiter:
+    """プロジェクト・リクエスト種別（write/read）ごとの共有リミッター"""
+    with _shared_lock:
+        key = (project_id, kind)
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(DOCS_WRITE_QUOTA if kind == 'write' else DOCS_READ_QUOTA)
+        return _limiters[key]
+
+
+def get_docs_service(credentials_path: str) -> Optional[Tuple[object, object]]:
+    """認証情報ファイルごとに1度だけ (認証情報, Docs APIサービス) を構築し、プロセス内で共有"""
+    with _shared_lock:
+        if credentials_path not in _services:
+            try:
+                # サービスアカウント認証
+                credentials = service_account.Credentials.from_service_account_file(
+                    credentials_path, scopes=DOCS_SCOPES
+                )
+                service = build('docs', 'v1', credentials=credentials, cache_discovery=False)
+                print("Google Docs API初期化成功")
+            except Exception as e:
+                print(f"Google Docs API初期化エラー: {e}")
+                return None
+            _services[credentials_path] = (credentials, service)
+        return _services[credentials_path]
+
+
+def _thread_http(credentials) -> google_auth_httplib2.AuthorizedHttp:
+    """スレッドごとのHTTP接続（httplib2.Http はスレッド間で共有できないため）"""
+    https = getattr(_thread_local, 'https', None)
+    if https is None:
+        https = _thread_local.https = {}
+    key = id(credentials)
+    if key not in https:
+        https[key] = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    return https[key]
+
+
+def utf16_len(text: str) -> int:
+    """Google Docsのインデックス単位（UTF-16コード単位）での文字列長（絵文字は2）"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class DocRequestBuilder:
+    """Google Docs の batchUpdate リクエストを組み立てる（インデックスはUTF-16コード単位で管理）
+
+    本文はまとめて1回の insertText で挿入し、段落スタイル・箇条書きは挿入後のインデックスで
+    同じバッチに含める（書式設定はインデックスをずらさないため、後から位置を補正する呼び出しが不要）
+    """
+
+    def __init__(self, start_index: int = 1):
+        self.start_index = start_index
+        self.index = start_index
+        self.parts: List[str] = []
+        self.format_requests: List[Dict] = []
+
+    def text(self, text: str) -> Tuple[int, int]:
+        """テキストを追加し、その範囲 (開始, 終了) を返す"""
+        start = self.index
+        self.parts.append(text)
+        self.index += utf16_len(text)
+        return start, self.index
+
+    def paragraph(self, text: str = '', style: Optional[str] = None) -> Tuple[int, int]:
+        """1段落を追加（style: TITLE・HEADING_1 などの段落スタイル）"""
+        start, end = self.text(f"{text}\n")
+        if style:
+            self.format_requests.append({
+                'updateParagraphStyle': {
+                    'range': {'startIndex': start, 'endIndex': end},
+                    'paragraphStyle': {'namedStyleType': style},
+                    'fields': 'namedStyleType'
+                }
+            })
+        return start, end
+
+    def heading(self, text: str, level: int = 1) -> Tuple[int, int]:
+        return self.paragraph(text, f'HEADING_{level}')
+
+    def list_items(self, items: Iterable, preset: str = NUMBERED_LIST) -> Optional[Tuple[int, int]]:
+        """各項目を1段落として追加し、まとめて箇条書きにする"""
+        items = [str(item).replace('\n', ' ') for item in items]
+        if not items:
+            return None
+        start = self.index
+        for item in items:
+            self.text(f"{item}\n")
+        self.format_requests.append({
+            'createParagraphBullets': {
+                'range': {'startIndex': start, 'endIndex': self.index},
+                'bulletPreset': preset
+            }
+        })
+        return start, self.index
+
+    def section(self, label: str, value, is_list: bool, level: int = 2):
+        """見出し付きの項目（リストは番号付き箇条書き）"""
+        self.heading(label, level)
+        if is_list and isinstance(value, (list, tuple)):
+            self.list_items(value)
+        else:
+            self.paragraph(str(value))
+        self.paragraph()
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def requests(self, reset_style: bool = False) -> List[Dict]:
+        """挿入→書式設定の順のリクエスト（本文がなければ空）
+
+        reset_style: 既存の本文の途中に挿入する場合に指定する。挿入位置の段落から引き継ぐ
+        見出しスタイル・箇条書きを解除してから書式を設定する
+        """
+        if not self.parts:
+            return []
+        requests = [{'insertText': {'location': {'index': self.start_index}, 'text': self.content}}]
+        if reset_style:
+            text_range = {'startIndex': self.start_index, 'endIndex': self.index}
+            requests.append({
+                'updateParagraphStyle': {
+                    'range': text_range,
+                    'paragraphStyle': {'namedStyleType': 'NORMAL_TEXT'},
+                    'fields': 'namedStyleType'
+                }
+            })
+            requests.append({'deleteParagraphBullets': {'range': dict(text_range)}})
+        return requests + self.format_requests
+
+
+def split_material_data(material_data: Dict) -> Tuple[Dict, Optional[Dict], Optional[str]]:
+    """出力データを (教材, 受講者情報, シチュエーション) に分ける
+
+    app.py の {user_info, final_situation, generated_material} と app_practical のフラットな教材の両方に対応
+    """
+    if 'generated_material' in material_data:
+        return (material_data['generated_material'] or {}, material_data.get('user_info'),
+                material_data.get('final_situation'))
+    return material_data, material_data.get('user_info'), None
+
+
+def add_material_sections(builder: DocRequestBuilder, material: Dict, level: int = 2):
+    for key, label, is_list in DOC_SECTIONS:
+        value = material.get(key)
+        if value:
+            builder.section(label, value, is_list, level)
+
+
+def material_blocks(material_data: Dict) -> List[Tuple[str, Callable[[DocRequestBuilder], None]]]:
+    """教材1件分のドキュメントを更新単位のブロック (キー, 書き込み関数) に分ける（末尾の作成情報は含まない）"""
+    material, user_info, situation = split_material_data(material_data)
+
+    def header(builder: DocRequestBuilder):
+        builder.paragraph(f"📚 語学教材: {material.get('type', '教材')}", 'TITLE')
+        builder.paragraph()
+        if user_info:
+            builder.heading("📋 基本情報")
+            builder.list_items([
+                f"業界: {user_info.get('industry', 'N/A')}",
+                f"職種: {user_info.get('job_role', 'N/A')}",
+                f"英語レベル: {user_info.get('english_level', 'N/A')}",
+                f"学習目標: {user_info.get('learning_goal', 'N/A')}"
+            ], BULLET_LIST)
+            builder.paragraph()
+
+    blocks = [('header', header)]
+    if situation:
+        blocks.append(('topic', lambda builder: builder.section("🎯 シチュエーション", situation, False, level=1)))
+    elif material.get('topic'):
+        blocks.append(('topic', lambda builder: builder.section("🎯 トピック", material['topic'], False, level=1)))
+
+    for key, label, is_list in DOC_SECTIONS:
+        value = material.get(key)
+        if value:
+            blocks.append((key, lambda builder, label=label, value=value, is_list=is_list:
+                           builder.section(label, value, is_list)))
+    return blocks
+
+
+def write_material_document(builder: DocRequestBuilder, material_data: Dict):
+    """教材1件分のドキュメント全体を builder に書き込む（ローカル出力の material_render も同じ構成を使う）"""
+    for _, write in material_blocks(material_data):
+        write(builder)
+    builder.paragraph("---")
+    builder.paragraph(f"作成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}")
+    builder.paragraph("作成者: 語学教材作成支援ツール")
+
+
+def build_material_document(material_data: Dict, start_index: int = 1) -> DocRequestBuilder:
+    """教材1件分のドキュメント全体を組み立てる"""
+    builder = DocRequestBuilder(start_index)
+    write_material_document(builder, material_data)
+    return builder
+
+
+def build_material_requests(material_data: Dict, start_index: int = 1) -> List[Dict]:
+    """教材1件分のドキュメントの batchUpdate リクエスト"""
+    return build_material_document(material_data, start_index).requests()
+
+
+def material_doc_sections(material_data: Dict) -> List[List]:
+    """ブロックごとの [キー, 内容ハッシュ, 長さ（UTF-16）]（出力済みドキュメントとの差分検出用）"""
+    sections = []
+    for key, write in material_blocks(material_data):
+        builder = DocRequestBuilder()
+        write(builder)
+        digest = hashlib.sha1(
+            json.dumps(builder.requests(), ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        sections.append([key, digest, utf16_len(builder.content)])
+    return sections
+
+
+def build_sync_requests(material_data: Dict, old_sections: List[List]) -> List[Dict]:
+    """出力済みドキュメント（ブロック構成 old_sections）を現在の教材に合わせる batchUpdate リクエスト
+
+    変更・追加・削除されたブロックだけを置き換える。ドキュメントの後ろのブロックから順に処理するため、
+    前のブロックのインデックスは各リクエストの時点でも出力時のままになる
+    """
+    blocks = material_blocks(material_data)
+    new_sections = material_doc_sections(material_data)
+    offsets = [1]
+    for _, _, length in old_sections:
+        offsets.append(offsets[-1] + length)
+
+    matcher = SequenceMatcher(None, [(key, digest) for key, digest, _ in old_sections],
+                              [(key, digest) for key, digest, _ in new_sections], autojunk=False)
+    requests = []
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            continue
+        start, end = offsets[i1], offsets[i2]
+        if end > start:
+            requests.append({'deleteContentRange': {'range': {'startIndex': start, 'endIndex': end}}})
+        builder = DocRequestBuilder(start)
+        for _, write in blocks[j1:j2]:
+            write(builder)
+        requests.extend(builder.requests(reset_style=True))
+    return requests
+
+
+def build_course_book_requests(title: str, materials: List[Dict]) -> List[Dict]:
+    """全教材を1つのドキュメントにまとめる batchUpdate リクエストを作成"""
+    builder = DocRequestBuilder()
+    builder.paragraph(f"📚 {title}", 'TITLE')
+    builder.paragraph(f"作成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')} ・ 教材数: {len(materials)}")
+    builder.paragraph()
+
+    # 目次（見出しのIDは作成後にしか分からないため、テキストの一覧にする）
+    builder.heading("目次")
+    builder.list_items(
+        f"{material.get('topic', 'Unknown')}（{material.get('type', '教材')}）" for material in materials
+    )
+    builder.paragraph()
+
+    for i, material in enumerate(materials, 1):
+        builder.heading(f"教材 {i}: {material.get('topic', 'Unknown')}")
+        builder.paragraph(f"タイプ: {material.get('type', '教材')}")
+        builder.paragraph()
+        add_material_sections(builder, material)
+
+    builder.paragraph("---")
+    builder.paragraph("作成者: 語学教材作成支援ツール")
+    return builder.requests()
+
+
+
 class GoogleDocsAPIClient:
     def __init__(self):
         self.service = None
+        self.credentials = None
+        self.project_id = 'default'
         self.credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
         self._initialize_service()
     
     def _initialize_service(self):
-        """Google Docs APIサービスを初期化"""
+        """Google Docs APIサービスを初期化（構築済みのサービスを再利用）"""
+        if os.getenv('GOOGLE_DOCS_BACKEND', DOCS_BACKEND) == 'fake':
+            from fake_google_docs import get_fake_service
+            self.service = get_fake_service()
+            self.project_id = 'fake'
+            return
+        
         if not self.credentials_path or not os.path.exists(self.credentials_path):
             print("Google認証情報が見つかりません。")
             return
         
-        try:
-            # サービスアカウント認証
-            credentials = service_account.Credentials.from_service_account_file(
-                self.credentials_path,
-                scopes=[
-                    'https://www.googleapis.com/auth/documents',
-                    'https://www.googleapis.com/auth/drive'
-                ]
-            )
-            
-            self.service = build('docs', 'v1', credentials=credentials)
-            print("Google Docs API初期化成功")
-            
-        except Exception as e:
-            print(f"Google Docs API初期化エラー: {e}")
-            self.service = None
+        cached = get_docs_service(self.credentials_path)
+        if cached:
+            self.credentials, self.service = cached
+            self.project_id = getattr(self.credentials, 'project_id', None) or 'default'
     
     def is_available(self) -> bool:
         """Google Docs APIが利用可能かチェック"""
         return self.service is not None
     
+    def _execute(self, request, write: bool = True):
+        """割り当てに合わせて待機しながらリクエストを実行（429・5xxは指数バックオフで再試行）"""
+        limiter = get_rate_limiter(self.project_id, 'write' if write else 'read')
+        for attempt in range(MAX_RETRIES + 1):
+            limiter.acquire()
+            try:
+                http = _thread_http(self.credentials) if self.credentials is not None else None
+                return request.execute(http=http)
+            except HttpError as e:
+                if e.resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    raise
+                time.sleep(min(2 ** attempt, 32) + random.random())
+    
+    def _batch_update(self, document_id: str, requests: List[Dict]):
+        """batchUpdate を上限件数ごとに分けて送信"""
+        for start in range(0, len(requests), MAX_REQUESTS_PER_BATCH):
+            self._execute(self.service.documents().batchUpdate(
+                documentId=document_id,
+                body={'requests': requests[start:start + MAX_REQUESTS_PER_BATCH]}
+            ))
+    
     def create_document(self, title: str) -> Optional[str]:
         """新しいドキュメントを作成"""
         if not self.is_available():
@@ -49,7 +421,7 @@ class GoogleDocsAPIClient:
                 'title': title
             }
             
-            doc = self.service.documents().create(body=document).execute()
+            doc = self._execute(self.service.documents().create(body=document))
             document_id = doc.get('documentId')
             print(f'ドキュメント作成成功: {document_id}')
             return document_id
@@ -58,254 +430,31 @@ class GoogleDocsAPIClient:
             print(f'ドキュメント作成エラー: {e}')
             return None
     
+    def get_document(self, document_id: str) -> Optional[Dict]:
+        """ドキュメントの内容を取得"""
+        if not self.is_available():
+            return None
+        
+        try:
+            return self._execute(self.service.documents().get(documentId=document_id), write=False)
+        except HttpError as e:
+            print(f'ドキュメント取得エラー: {e}')
+            return None
+    
     def write_material_to_doc(self, document_id: str, material_data: Dict) -> bool:
-        """教材データをGoogle Docsに書き込み"""
+        """教材データをGoogle Docsに書き込み（見出し・箇条書きの書式も同じバッチで設定）"""
         if not self.is_available():
             return False
         
         try:
-            # ドキュメント構造を作成
-            requests = []
-            current_index = 1
-            
-            # タイトル挿入
-            requests.append({
-                'insertText': {
-                    'location': {'index': current_index},
-                    'text': f"📚 語学教材: {material_data.get('type', '教材')}\n\n"
-                }
-            })
-            current_index += len(f"📚 語学教材: {material_data.get('type', '教材')}\n\n")
-            
-            # 基本情報
-            if 'user_info' in material_data:
-                info = material_data['user_info']
-                basic_info = f"""📋 基本情報
-• 業界: {info.get('industry', 'N/A')}
-• 職種: {info.get('job_role', 'N/A')}
-• 英語レベル: {info.get('english_level', 'N/A')}
-• 学習目標: {info.get('learning_goal', 'N/A')}
-
-"""
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_index},
-                        'text': basic_info
-                    }
-                })
-                current_index += len(basic_info)
-            
-            # シチュエーション
-            if 'final_situation' in material_data:
-                situation_text = f"""🎯 シチュエーション
-{material_data['final_situation']}
-
-"""
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_index},
-                        'text': situation_text
-                    }
-                })
-                current_index += len(situation_text)
+            self._batch_update(document_id, build_material_requests(material_data))
+            return True
             
-            # 教材コンテンツ
-            if 'generated_material' in material_data:
-                material = material_data['generated_material']
-                material_type = material.get('type', '教材')
-                
-                if material_type == 'ロールプレイ':
-                    # モデルダイアログ
-                    if 'model_dialogue' in material:
-                        dialogue_text = f"""💬 モデルダイアログ
-{material['model_dialogue']}
-
-"""
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': dialogue_text
-                            }
-                        })
-                        current_index += len(dialogue_text)
-                    
-                    # 有用表現・語彙
-                    if 'useful_expressions' in material:
-                        expressions_text = "📝 有用表現・語彙\n"
-                        for i, expr in enumerate(material['useful_expressions'], 1):
-                            expressions_text += f"{i}. {expr}\n"
-                        expressions_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': expressions_text
-                            }
-                        })
-                        current_index += len(expressions_text)
-                    
-                    # 追加質問
-                    if 'additional_questions' in material:
-                        questions_text = "❓ 追加質問\n"
-                        for i, question in enumerate(material['additional_questions'], 1):
-                            questions_text += f"{i}. {question}\n"
-                        questions_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': questions_text
-                            }
-                        })
-                        current_index += len(questions_text)
-                
-                elif material_type == 'ディスカッション':
-                    # ディスカッショントピック
-                    if 'discussion_topic' in material:
-                        topic_text = f"""💭 ディスカッショントピック
-{material['discussion_topic']}
-
-"""
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': topic_text
-                            }
-                        })
-                        current_index += len(topic_text)
-                    
-                    # ディスカッションの狙い
-                    if 'discussion_aim' in material:
-                        aim_text = f"""🎯 ディスカッションの狙い
-{material['discussion_aim']}
-
-"""
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': aim_text
-                            }
-                        })
-                        current_index += len(aim_text)
-                    
-                    # ガイド質問
-                    if 'guide_questions' in material:
-                        guide_text = "❓ ガイド質問\n"
-                        for i, question in enumerate(material['guide_questions'], 1):
-                            guide_text += f"{i}. {question}\n"
-                        guide_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': guide_text
-                            }
-                        })
-                        current_index += len(guide_text)
-                    
-                    # 有用表現・語彙
-                    if 'useful_expressions' in material:
-                        expressions_text = "📝 有用表現・語彙\n"
-                        for i, expr in enumerate(material['useful_expressions'], 1):
-                            expressions_text += f"{i}. {expr}\n"
-                        expressions_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': expressions_text
-                            }
-                        })
-                        current_index += len(expressions_text)
-                
-                elif material_type == '表現練習':
-                    # 図表・データ説明
-                    if 'chart_description' in material:
-                        chart_text = f"""📊 図表・データ説明
-{material['chart_description']}
-
-"""
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': chart_text
-                            }
-                        })
-                        current_index += len(chart_text)
-                    
-                    # キーフレーズ
-                    if 'key_phrases' in material:
-                        phrases_text = "🔑 キーフレーズ\n"
-                        for i, phrase in enumerate(material['key_phrases'], 1):
-                            phrases_text += f"{i}. {phrase}\n"
-                        phrases_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': phrases_text
-                            }
-                        })
-                        current_index += len(phrases_text)
-                    
-                    # 段階的練習ステップ
-                    if 'practice_steps' in material:
-                        steps_text = "📚 段階的練習ステップ\n"
-                        for i, step in enumerate(material['practice_steps'], 1):
-                            steps_text += f"{i}. {step}\n"
-                        steps_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': steps_text
-                            }
-                        })
-                        current_index += len(steps_text)
-                    
-                    # 追加質問
-                    if 'additional_questions' in material:
-                        questions_text = "❓ 追加質問\n"
-                        for i, question in enumerate(material['additional_questions'], 1):
-                            questions_text += f"{i}. {question}\n"
-                        questions_text += "\n"
-                        
-                        requests.append({
-                            'insertText': {
-                                'location': {'index': current_index},
-                                'text': questions_text
-                            }
-                        })
-                        current_index += len(questions_text)
-            
-            # フッター
-            footer_text = f"""
----
-作成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M')}
-作成者: 語学教材作成支援ツール
-"""
-            requests.append({
-                'insertText': {
-                    'location': {'index': current_index},
-                    'text': footer_text
-                }
-            })
-            
-            # バッチアップデート実行
-            if requests:
-                self.service.documents().batchUpdate(
-                    documentId=document_id,
-                    body={'requests': requests}
-                ).execute()
-                
-                return True
-                
         except HttpError as e:
             print(f'ドキュメント書き込みエラー: {e}')
             return False
-        
-        return False
     
+
     def create_and_write_material(self, title: str, material_data: Dict) -> Optional[str]:
         """教材用ドキュメントを作成して内容を書き込み"""
         document_id = self.create_document(title)
@@ -320,6 +469,126 @@ class GoogleDocsAPIClient:
         
         return None
     
+    def create_course_book(self, title: str, materials: List[Dict]) -> Optional[str]:
+        """全教材を1つのドキュメント（目次・見出し付き）に出力し、URLを返す
+        
+        ドキュメント作成1回と batchUpdate 1回（リクエストが多い場合は数回）で書き込む
+        """
+        if not materials:
+            return None
+        document_id = self.create_document(title)
+        if not document_id:
+            return None
+        
+        try:
+            self._batch_update(document_id, build_course_book_requests(title, materials))
+        except HttpError as e:
+            print(f'コースブック書き込みエラー: {e}')
+            return None
+        
+        return f"https://docs.google.com/document/d/{document_id}/edit"
+    
+    def create_and_write_materials(self, items: List[Tuple[str, Dict]],
+                                   max_workers: Optional[int] = None) -> Iterator[Tuple[int, Optional[str]]]:
+        """複数の教材を並列にドキュメント出力し、完了順に (items内の位置, URL) を返す
+        
+        items: (タイトル, 教材データ) のリスト。失敗した教材のURLは None
+        """
+        workers = max(1, min(max_workers or DOCS_EXPORT_WORKERS, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._create_and_write_safely, title, material_data): i
+                for i, (title, material_data) in enumerate(items)
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    
+    def _create_and_write_safely(self, title: str, material_data: Dict) -> Optional[str]:
+        try:
+            return self.create_and_write_material(title, material_data)
+        except Exception as e:
+            print(f'ドキュメント出力エラー（{title}）: {e}')
+            return None
+    
+    def sync_material(self, title: str, material_data: Dict,
+                      export: Optional[Dict] = None) -> Tuple[str, Optional[Dict]]:
+        """教材のドキュメントを出力済みの内容に合わせて更新し、(結果, 出力記録) を返す
+        
+        export: 前回の出力記録 {document_id, sections, end_index}（未出力なら None）
+        結果: unchanged（変更なし。APIを呼ばない）/ updated（変更したブロックだけ置換）/
+              created（新規作成）/ failed
+        """
+        sections = material_doc_sections(material_data)
+        if export and export['sections'] == sections:
+            return 'unchanged', export
+        
+        if export:
+            try:
+                document = self._execute(
+                    self.service.documents().get(documentId=export['document_id']), write=False
+                )
+            except HttpError as e:
+                if e.resp.status != 404:
+                    print(f'ドキュメント取得エラー: {e}')
+                    return 'failed', export
+                # ドキュメントが削除されていれば作り直す
+                document = None
+            
+            if document:
+                end_index = document['body']['content'][-1]['endIndex']
+                if end_index == export['end_index']:
+                    requests = build_sync_requests(material_data, export['sections'])
+                    new_end_index = (end_index + sum(length for _, _, length in sections)
+                                     - sum(length for _, _, length in export['sections']))
+                else:
+                    # 出力後に手で編集されている場合はブロックの位置が分からないため、本文全体を書き直す
+                    builder = build_material_document(material_data)
+                    requests = []
+                    if end_index > 2:
+                        requests.append({'deleteContentRange': {'range': {'startIndex': 1, 'endIndex': end_index - 1}}})
+                    requests.extend(builder.requests(reset_style=True))
+                    new_end_index = builder.index + 1
+                try:
+                    self._batch_update(export['document_id'], requests)
+                except HttpError as e:
+                    print(f'ドキュメント更新エラー: {e}')
+                    return 'failed', export
+                return 'updated', {'document_id': export['document_id'], 'sections': sections,
+                                   'end_index': new_end_index}
+        
+        document_id = self.create_document(title)
+        if not document_id:
+            return 'failed', export
+        builder = build_material_document(material_data)
+        try:
+            self._batch_update(document_id, builder.requests())
+        except HttpError as e:
+            print(f'ドキュメント書き込みエラー: {e}')
+            return 'failed', export
+        return 'created', {'document_id': document_id, 'sections': sections, 'end_index': builder.index + 1}
+    
+    def sync_materials(self, items: List[Tuple[str, Dict, Optional[Dict]]],
+                       max_workers: Optional[int] = None) -> Iterator[Tuple[int, str, Optional[Dict]]]:
+        """複数の教材を並列に同期し、完了順に (items内の位置, 結果, 出力記録) を返す
+        
+        items: (タイトル, 教材データ, 前回の出力記録) のリスト
+        """
+        workers = max(1, min(max_workers or DOCS_EXPORT_WORKERS, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._sync_safely, title, material_data, export): i
+                for i, (title, material_data, export) in enumerate(items)
+            }
+            for future in as_completed(futures):
+                yield (futures[future],) + future.result()
+    
+    def _sync_safely(self, title: str, material_data: Dict, export: Optional[Dict]) -> Tuple[str, Optional[Dict]]:
+        try:
+            return self.sync_material(title, material_data, export)
+        except Exception as e:
+            print(f'ドキュメント同期エラー（{title}）: {e}')
+            return 'failed', export
+    
     def get_setup_instructions(self) -> str:
         """Google Docs API設定手順を返す"""
         return """
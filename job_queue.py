@@ -0,0 +1,543 @@
+"""
+バックグラウンドジョブキュー
+SQLiteに永続化した教材生成ジョブを、Streamlitの実行ループ外のワーカースレッドで処理する
+
+トピックごとの生成結果は完了した時点で保存されるため、ブラウザを閉じても、
+プロセスが再起動しても、最後に完了したトピックの続きから再開できる。
+
+ワーカーを別プロセスとして起動する場合:
+    python job_queue.py --workers 2
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from batch_generation import (
+    STATUS_FAILED,
+    STATUS_OK,
+    auto_fix_duplicates,
+    collect_used_expressions,
+    generate_topic_material
+)
+from job_scheduler import DEFAULT_PRIORITY, PRIORITIES, SCHEDULER_SCHEMA, charge, select_next_job
+
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs.db')
+
+# ワーカーのハートビートがこの秒数途絶えたジョブは再キューする
+STALE_JOB_SECONDS = 300
+
+# キューが空のときのポーリング間隔（秒）
+WORKER_POLL_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    priority TEXT NOT NULL DEFAULT '通常',
+    owner TEXT NOT NULL DEFAULT '',
+    params TEXT NOT NULL,
+    total_topics INTEGER NOT NULL,
+    completed_topics INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker_id TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    queued_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+
+CREATE TABLE IF NOT EXISTS job_topics (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    topic_index INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    material TEXT,
+    original_material TEXT,
+    status TEXT,
+    error TEXT,
+    imported INTEGER NOT NULL DEFAULT 0,
+    completed_at TEXT,
+    PRIMARY KEY (job_id, topic_index)
+);
+"""
+
+# 既存のDBに後から追加した列
+MIGRATIONS = {
+    'jobs': {
+        'priority': "ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT '通常'",
+        'owner': "ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''",
+        'queued_at': "ALTER TABLE jobs ADD COLUMN queued_at REAL"
+    },
+    'job_topics': {
+        'status': "ALTER TABLE job_topics ADD COLUMN status TEXT",
+        'imported': "ALTER TABLE job_topics ADD COLUMN imported INTEGER NOT NULL DEFAULT 0",
+        'original_material': "ALTER TABLE job_topics ADD COLUMN original_material TEXT"
+    }
+}
+
+
+class JobQueue:
+    """SQLiteで永続化された教材生成ジョブキュー"""
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            conn.executescript(SCHEDULER_SCHEMA)
+            self._migrate(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        for table, columns in MIGRATIONS.items():
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, statement in columns.items():
+                if column not in existing:
+                    conn.execute(statement)
+
+    @contextmanager
+    def _connection(self):
+        """トランザクション付きの接続（終了時にコミットして閉じる）"""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, topics: List[str], context_data: Dict, template_type: str, template_config: Dict,
+                used_expressions: List[str] = None, quality_check: bool = True,
+                priority: str = DEFAULT_PRIORITY, owner: str = '') -> int:
+        """生成ジョブを登録（コンテキストはこの時点のスナップショットを保存）
+
+        priority: 緊急度（通常/急ぎ/最優先）
+        owner: 公平配分の単位（セッション・クライアント）
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"不明な緊急度です: {priority}")
+        params = {
+            'topics': list(topics),
+            'context_data': context_data,
+            'template_type': template_type,
+            'template_config': template_config,
+            'used_expressions': sorted(used_expressions or []),
+            'quality_check': quality_check
+        }
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (priority, owner, params, total_topics, created_at, queued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (priority, owner, json.dumps(params, ensure_ascii=False), len(topics),
+                 datetime.now().isoformat(), time.time())
+            )
+            job_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO job_topics (job_id, topic_index, topic) VALUES (?, ?, ?)",
+                [(job_id, i, topic) for i, topic in enumerate(topics)]
+            )
+        return job_id
+
+    def claim_next(self, worker_id: str) -> Optional[Dict]:
+        """スケジューラが選んだ待機中のジョブを1件取得して実行中にする"""
+        return self._claim(worker_id)
+
+    def claim_job(self, job_id: int, worker_id: str) -> Optional[Dict]:
+        """指定した待機中のジョブを実行中にする（画面から直接実行する場合）"""
+        return self._claim(worker_id, job_id)
+
+    def _claim(self, worker_id: str, job_id: Optional[int] = None) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if job_id is None:
+                job_id = select_next_job(conn)
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, heartbeat_at = ?, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (worker_id, time.time(), datetime.now().isoformat(), row['id'])
+            )
+            conn.execute("COMMIT")
+            return self._row_to_job(row)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def requeue_stale(self, stale_seconds: int = STALE_JOB_SECONDS) -> int:
+        """ハートビートが途絶えた実行中ジョブを待機中に戻す"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker_id = NULL, queued_at = ? "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (time.time(), time.time() - stale_seconds)
+            )
+            return cursor.rowcount
+
+    def should_yield(self, job_id: int, worker_id: str, finishing: bool = False) -> bool:
+        """トピック1件分を計上し、他のジョブを先に処理すべきなら実行中のジョブを待機中に戻す
+
+        finishing: ジョブの最後のトピックの場合（計上のみ行い、順番は譲らない）
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute("SELECT priority, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                conn.execute("COMMIT")
+                return False
+            charge(conn, job['priority'], job['owner'])
+            yielded = False
+            if not finishing and select_next_job(conn, include_job_id=job_id) != job_id:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker_id = NULL, queued_at = ? "
+                    "WHERE id = ? AND status = 'running' AND worker_id = ?",
+                    (time.time(), job_id, worker_id)
+                )
+                yielded = cursor.rowcount == 1
+            conn.execute("COMMIT")
+            return yielded
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: int):
+        with self._connection() as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def record_topic_result(self, job_id: int, topic_index: int, material: Optional[Dict] = None,
+                            status: str = STATUS_OK, error: Optional[str] = None):
+        """トピック1件分の結果を生成状態とともに保存"""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE job_topics SET material = ?, status = ?, error = ?, completed_at = ? "
+                "WHERE job_id = ? AND topic_index = ?",
+                (json.dumps(material, ensure_ascii=False) if material is not None else None,
+                 status, error, datetime.now().isoformat(), job_id, topic_index)
+            )
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ?, completed_topics = "
+                "(SELECT COUNT(*) FROM job_topics WHERE job_id = ? AND completed_at IS NOT NULL) "
+                "WHERE id = ?",
+                (time.time(), job_id, job_id)
+            )
+
+    def update_materials(self, job_id: int, materials: Dict[int, Dict]):
+        """保存済みの教材を更新（重複の自動修正後など）。変更前の教材は取り込み時の履歴用に残す"""
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE job_topics SET original_material = CASE "
+                "WHEN original_material IS NULL AND material != ?1 THEN material ELSE original_material END, "
+                "material = ?1 WHERE job_id = ?2 AND topic_index = ?3",
+                [(json.dumps(material, ensure_ascii=False), job_id, index)
+                 for index, material in materials.items()]
+            )
+
+    def finish_job(self, job_id: int, status: str, error: Optional[str] = None,
+                   worker_id: Optional[str] = None) -> bool:
+        """実行中のジョブを終了（worker_id 指定時は、そのワーカーが実行中の場合のみ）"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?1, error = ?2, finished_at = ?3, worker_id = NULL "
+                "WHERE id = ?4 AND status = 'running' AND (?5 IS NULL OR worker_id = ?5)",
+                (status, error, datetime.now().isoformat(), job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def retry_failed(self, job_id: int) -> int:
+        """ok以外のトピックを未実行に戻し、ジョブを再キューする（登録時のコンテキストで再生成）"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE job_topics SET material = NULL, original_material = NULL, status = NULL, error = NULL, "
+                "completed_at = NULL "
+                "WHERE job_id = ? AND completed_at IS NOT NULL AND status != ? AND imported = 0 "
+                "AND EXISTS (SELECT 1 FROM jobs WHERE id = ? AND status NOT IN ('queued', 'running'))",
+                (job_id, STATUS_OK, job_id)
+            )
+            retried = cursor.rowcount
+            if retried:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL, queued_at = ?, "
+                    "completed_topics = "
+                    "(SELECT COUNT(*) FROM job_topics WHERE job_id = ? AND completed_at IS NOT NULL) "
+                    "WHERE id = ?",
+                    (time.time(), job_id, job_id)
+                )
+        return retried
+
+    def cancel_job(self, job_id: int):
+        """待機中・実行中のジョブを中止（実行中のトピックは完了後に停止）"""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (datetime.now().isoformat(), job_id)
+            )
+
+    def queue_stats(self) -> List[Dict]:
+        """緊急度ごとのキューの深さと待ち時間"""
+        now = time.time()
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT j.priority, j.status, j.queued_at, "
+                "(SELECT COUNT(*) FROM job_topics t WHERE t.job_id = j.id AND t.completed_at IS NULL) AS pending "
+                "FROM jobs j WHERE j.status IN ('queued', 'running')"
+            ).fetchall()
+        stats = []
+        for priority in PRIORITIES:
+            level_rows = [row for row in rows if row['priority'] == priority]
+            waits = [now - row['queued_at'] for row in level_rows
+                     if row['status'] == 'queued' and row['queued_at'] is not None]
+            stats.append({
+                'priority': priority,
+                'queued_jobs': sum(1 for row in level_rows if row['status'] == 'queued'),
+                'running_jobs': sum(1 for row in level_rows if row['status'] == 'running'),
+                'pending_topics': sum(row['pending'] for row in level_rows),
+                'max_wait_seconds': max(waits) if waits else 0.0
+            })
+        return stats
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def job_topics(self, job_id: int) -> List[Dict]:
+        """ジョブのトピックごとの結果"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_topics WHERE job_id = ? ORDER BY topic_index", (job_id,)
+            ).fetchall()
+        return [
+            {
+                'topic_index': row['topic_index'],
+                'topic': row['topic'],
+                'material': json.loads(row['material']) if row['material'] else None,
+                'status': row['status'],
+                'error': row['error'],
+                'imported': bool(row['imported']),
+                'completed': row['completed_at'] is not None
+            }
+            for row in rows
+        ]
+
+    def job_materials(self, job_id: int) -> List[Dict]:
+        """ジョブで正常に生成された教材（トピック順）"""
+        return [topic['material'] for topic in self.job_topics(job_id)
+                if topic['status'] == STATUS_OK and topic['material'] is not None]
+
+    def status_counts(self, job_id: int) -> Dict[str, int]:
+        """生成状態ごとのトピック数（未実行は 'pending'）"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT COALESCE(status, 'pending') AS status, COUNT(*) AS count "
+                "FROM job_topics WHERE job_id = ? GROUP BY 1", (job_id,)
+            ).fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def pending_import_count(self, job_id: int) -> int:
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM job_topics WHERE job_id = ? AND status = ? AND imported = 0",
+                (job_id, STATUS_OK)
+            ).fetchone()[0]
+
+    def import_results(self, job_id: int) -> List[Tuple[Dict, Optional[Dict]]]:
+        """未取り込みの正常な教材を取り込み済みにして (教材, 自動修正前の教材) で返す（同じ教材は2度返さない）"""
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT topic_index, material, original_material FROM job_topics "
+                "WHERE job_id = ? AND status = ? AND imported = 0 AND material IS NOT NULL "
+                "ORDER BY topic_index", (job_id, STATUS_OK)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE job_topics SET imported = 1 WHERE job_id = ? AND topic_index = ?",
+                [(job_id, row['topic_index']) for row in rows]
+            )
+        return [
+            (json.loads(row['material']),
+             json.loads(row['original_material']) if row['original_material'] else None)
+            for row in rows
+        ]
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+
+class JobWorker(threading.Thread):
+    """ジョブキューからジョブを取り出して教材を生成するワーカー"""
+
+    def __init__(self, queue: JobQueue, client_factory=None, poll_seconds: float = WORKER_POLL_SECONDS):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.client_factory = client_factory
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.queue.requeue_stale()
+                job = self.queue.claim_next(self.worker_id)
+            except Exception as e:
+                print(f"ジョブ取得エラー: {e}")
+                job = None
+
+            if job is None:
+                self._stop_event.wait(self.poll_seconds)
+                continue
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                print(f"ジョブ実行エラー (job {job['id']}): {e}")
+                self.queue.finish_job(job['id'], 'failed', str(e), worker_id=self.worker_id)
+
+    def _create_client(self):
+        if self.client_factory:
+            return self.client_factory()
+        from claude_api import ClaudeAPIClient
+        return ClaudeAPIClient()
+
+    def run_job(self, job: Dict, on_progress=None) -> int:
+        """ジョブを実行（完了済みのトピックは飛ばして続きから再開）し、重複の自動修正件数を返す
+
+        on_progress: トピックごとに (完了数, 総数, トピック, 生成状態) で呼ばれるコールバック
+        """
+        params = job['params']
+        client = self._create_client()
+        topics = self.queue.job_topics(job['id'])
+        done = sum(1 for topic in topics if topic['completed'])
+
+        used_expressions = set(params.get('used_expressions', []))
+        used_expressions |= collect_used_expressions(
+            topic['material'] for topic in topics if topic['material'] is not None
+        )
+
+        for topic in topics:
+            if topic['completed']:
+                continue
+            current = self.queue.get_job(job['id'])
+            if (current is None or current['status'] != 'running'
+                    or current['worker_id'] != self.worker_id or self._stop_event.is_set()):
+                return 0
+
+            try:
+                material, status, error = generate_topic_material(
+                    client, params['context_data'], params['template_type'], params['template_config'],
+                    topic['topic'], list(used_expressions)
+                )
+                material['topic'] = topic['topic']
+                material['generated_at'] = datetime.now().isoformat()
+                self.queue.record_topic_result(job['id'], topic['topic_index'], material=material,
+                                               status=status, error=error)
+                if status == STATUS_OK:
+                    used_expressions |= collect_used_expressions([material])
+            except Exception as e:
+                status = STATUS_FAILED
+                self.queue.record_topic_result(job['id'], topic['topic_index'], status=status, error=str(e))
+
+            done += 1
+            if on_progress:
+                on_progress(done, len(topics), topic['topic'], status)
+
+            # 緊急度の高いジョブや他の利用者のジョブが待っていれば順番を譲る
+            if self.queue.should_yield(job['id'], self.worker_id, finishing=done >= len(topics)):
+                return 0
+
+        # 重複チェックと自動修正（取り込み済みの教材は書き換えない）
+        fix_count = 0
+        if params.get('quality_check'):
+            topics = [topic for topic in self.queue.job_topics(job['id'])
+                      if topic['status'] == STATUS_OK and topic['material'] is not None]
+            materials = [topic['material'] for topic in topics]
+            # 代替表現の生成は時間がかかるため、1件ごとにハートビートを送って回収されないようにする
+            fix_count = auto_fix_duplicates(materials, client, on_fix=lambda: self.queue.heartbeat(job['id']))
+            current = self.queue.get_job(job['id'])
+            if current is None or current['worker_id'] != self.worker_id:
+                return 0
+            if fix_count:
+                self.queue.update_materials(
+                    job['id'], {topic['topic_index']: material for topic, material in zip(topics, materials)
+                                if not topic['imported']}
+                )
+
+        self.queue.finish_job(job['id'], 'completed', worker_id=self.worker_id)
+        return fix_count
+
+
+_workers: List[JobWorker] = []
+_workers_lock = threading.Lock()
+
+
+def start_workers(count: int = 1, db_path: str = JOB_DB_PATH) -> List[JobWorker]:
+    """プロセス内ワーカーを起動（既に起動済みなら何もしない）"""
+    with _workers_lock:
+        alive = [worker for worker in _workers if worker.is_alive()]
+        _workers[:] = alive
+        queue = JobQueue(db_path)
+        for _ in range(count - len(alive)):
+            worker = JobWorker(queue)
+            worker.start()
+            _workers.append(worker)
+        return list(_workers)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """ワーカーを独立プロセスとして実行"""
+    parser = argparse.ArgumentParser(description="教材生成ジョブのワーカー")
+    parser.add_argument('--workers', type=int, default=1, help="ワーカースレッド数")
+    parser.add_argument('--db', default=JOB_DB_PATH, help="ジョブDBのパス")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    workers = start_workers(args.workers, args.db)
+    print(f"ワーカー {len(workers)} 件を起動しました（DB: {args.db}）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,93 @@
+"""
+ジョブスケジューラ
+緊急度ごとのキューと、セッション・クライアント間の重み付き公平配分で次に処理するジョブを決める
+
+ストライドスケジューリング（トピック1件ごとに課金）:
+- 緊急度ごとに「パス値」を持ち、トピックを1件処理するたびに 1/重み だけ進める
+- パス値が最も小さい緊急度から処理するため、最優先は通常の16倍の頻度で処理される
+- 同じ緊急度の中では、利用者（セッション×クライアント）ごとのパス値で順番に処理する
+- しばらく待機ジョブがなかった緊急度・利用者は全体の仮想時刻まで引き上げ、溜まった分で独占しないようにする
+"""
+
+import sqlite3
+from typing import Dict, List, Optional
+
+PRIORITIES = ['最優先', '急ぎ', '通常']
+DEFAULT_PRIORITY = '通常'
+
+# 緊急度ごとの処理比率
+PRIORITY_WEIGHTS = {
+    '最優先': 16,
+    '急ぎ': 4,
+    '通常': 1
+}
+
+SCHEDULER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduler_passes (
+    key TEXT PRIMARY KEY,
+    pass REAL NOT NULL
+);
+"""
+
+
+def _load_passes(conn: sqlite3.Connection) -> Dict[str, float]:
+    return {row[0]: row[1] for row in conn.execute("SELECT key, pass FROM scheduler_passes")}
+
+
+def _store_pass(conn: sqlite3.Connection, key: str, value: float):
+    conn.execute(
+        "INSERT INTO scheduler_passes (key, pass) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET pass = excluded.pass",
+        (key, value)
+    )
+
+
+def _priority_weight(priority: str) -> int:
+    return PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS[DEFAULT_PRIORITY])
+
+
+def pick_job(candidates: List[Dict], passes: Dict[str, float]) -> Optional[int]:
+    """候補ジョブ（id, priority, owner を持つ辞書）から次に処理するジョブIDを選ぶ"""
+    if not candidates:
+        return None
+
+    global_pass = passes.get('global', 0.0)
+    levels = {job['priority'] for job in candidates}
+    level = min(levels, key=lambda p: (max(passes.get(f'priority:{p}', 0.0), global_pass),
+                                       -_priority_weight(p)))
+
+    in_level = [job for job in candidates if job['priority'] == level]
+    level_pass = passes.get(f'global:{level}', 0.0)
+    first_job = {}
+    for job in in_level:
+        first_job[job['owner']] = min(first_job.get(job['owner'], job['id']), job['id'])
+    owner = min(first_job, key=lambda o: (max(passes.get(f'owner:{level}:{o}', 0.0), level_pass),
+                                          first_job[o]))
+    return first_job[owner]
+
+
+def charge(conn: sqlite3.Connection, priority: str, owner: str, passes: Optional[Dict[str, float]] = None):
+    """トピック1件分の処理を緊急度と利用者のパス値に計上"""
+    passes = passes if passes is not None else _load_passes(conn)
+
+    level_pass = max(passes.get(f'priority:{priority}', 0.0), passes.get('global', 0.0))
+    passes['global'] = level_pass
+    passes[f'priority:{priority}'] = level_pass + 1.0 / _priority_weight(priority)
+
+    owner_pass = max(passes.get(f'owner:{priority}:{owner}', 0.0), passes.get(f'global:{priority}', 0.0))
+    passes[f'global:{priority}'] = owner_pass
+    passes[f'owner:{priority}:{owner}'] = owner_pass + 1.0
+
+    for key in ('global', f'priority:{priority}', f'global:{priority}', f'owner:{priority}:{owner}'):
+        _store_pass(conn, key, passes[key])
+    return passes
+
+
+def select_next_job(conn: sqlite3.Connection, include_job_id: Optional[int] = None) -> Optional[int]:
+    """待機中のジョブ（と指定した実行中ジョブ）から次に処理するジョブIDを選ぶ"""
+    rows = conn.execute(
+        "SELECT id, priority, owner FROM jobs WHERE status = 'queued' OR id = ?",
+        (include_job_id if include_job_id is not None else -1,)
+    ).fetchall()
+    candidates = [{'id': row[0], 'priority': row[1], 'owner': row[2]} for row in rows]
+    return pick_job(candidates, _load_passes(conn))
@@ -0,0 +1,454 @@
+"""
+過去の出力ファイルの一括取り込み
+app.py / app_practical.py が作業ディレクトリに書き出した
+教材_*.json・materials_*.json・topic_list_*.json・materials_*.txt を教材リポジトリに取り込む
+JSONL出力と大きなJSON配列出力はプロセスプールに渡さず、1件ずつ読み込みながら取り込む
+
+使い方:
+    python legacy_importer.py ./old_outputs ./archive --db materials.db --workers 4
+"""
+
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from material_export import iter_material_file
+from material_store import MATERIAL_DB_PATH, MaterialStore
+from quality_scoring import material_content_hash, stable_hash
+
+# 取り込み対象のファイル名パターン -> 種別
+FILE_PATTERNS = [
+    ('教材_*.json', 'material_json'),
+    ('materials_*.json', 'material_json'),
+    ('selected_materials_*.json', 'material_json'),
+    ('materials_*.jsonl', 'material_jsonl'),
+    ('selected_materials_*.jsonl', 'material_jsonl'),
+    ('topic_list_*.json', 'topic_list'),
+    ('materials_*.txt', 'material_text'),
+    ('selected_materials_*.txt', 'material_text'),
+]
+
+# 受講者情報のない教材・トピックの取り込み先コンテキスト
+IMPORT_CONTEXT = {'counseling_memo': '', 'teaching_policy': '', 'business_scenes': ''}
+IMPORT_CONTEXT_KEY = stable_hash({'legacy_import': IMPORT_CONTEXT})
+
+# 1タスクで処理するファイル数
+FILES_PER_TASK = 32
+
+# 1トランザクションで挿入する教材数
+INSERT_BATCH_SIZE = 500
+
+# これより大きいJSON出力は1件ずつ読み込む（ファイル全体をメモリに載せない）
+STREAM_FILE_SIZE = 8 * 1024 * 1024
+
+# 1件ずつ読み込むファイルで、まとめて重複排除・挿入に回す教材数
+STREAM_RESULT_SIZE = 1000
+
+# 取り込み結果に表示する不正ファイルの件数上限
+BAD_FILE_REPORT_LIMIT = 20
+
+# テキスト出力の見出し -> (フィールド, リストかどうか)
+TEXT_SECTIONS = {
+    '対話文': ('model_dialogue', False),
+    '有用表現': ('useful_expressions', True),
+    '追加質問': ('additional_questions', True),
+    'ディスカッショントピック': ('discussion_topic', False),
+    '背景情報': ('background_info', False),
+    '議論ポイント': ('key_points', True),
+    '討議質問': ('discussion_questions', True),
+    '図表説明': ('chart_description', False),
+    '重要語彙': ('useful_vocabulary', True),
+    '練習問題': ('practice_questions', True),
+}
+
+# 古い出力で使われていたフィールド名 -> 現在のフィールド名
+FIELD_ALIASES = {
+    'vocabulary': 'useful_vocabulary',
+}
+
+_MATERIAL_HEADER = re.compile(r'^=== 教材 \d+: (.*) ===$')
+_SECTION_HEADER = re.compile(r'^(?:【(.+?)】|(.+?)[:：])\s*$')
+_SEPARATOR = re.compile(r'^={10,}$')
+
+
+def classify_file(filename: str) -> Optional[str]:
+    """ファイル名から種別を判定（対象外は None）"""
+    for pattern, kind in FILE_PATTERNS:
+        if fnmatch.fnmatch(filename, pattern):
+            return kind
+    return None
+
+
+def iter_legacy_files(paths: Iterable[str]) -> Iterator[str]:
+    """指定パス（ファイル・ディレクトリ）以下の取り込み対象ファイルを順に列挙"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if classify_file(filename):
+                        yield os.path.join(root, filename)
+        elif os.path.isfile(path):
+            yield path
+
+
+def normalize_material(material: Dict, topic: Optional[str] = None, generated_at: Optional[str] = None) -> Dict:
+    """教材を現在のスキーマに揃える"""
+    normalized = {FIELD_ALIASES.get(key, key): value for key, value in material.items()}
+    if topic and not normalized.get('topic'):
+        normalized['topic'] = topic
+    normalized.setdefault('topic', 'Unknown')
+    if generated_at and not normalized.get('generated_at'):
+        normalized['generated_at'] = generated_at
+    for field, is_list in TEXT_SECTIONS.values():
+        value = normalized.get(field)
+        if is_list and isinstance(value, str):
+            normalized[field] = [line.strip() for line in value.splitlines() if line.strip()]
+        elif not is_list and isinstance(value, str):
+            normalized[field] = value.strip()
+    return normalized
+
+
+def parse_material_json(data) -> Tuple[List[Dict], Optional[Dict]]:
+    """教材JSONを (教材一覧, 受講者情報) に変換"""
+    if isinstance(data, list):
+        if not all(isinstance(item, dict) for item in data):
+            raise ValueError("教材リストに辞書以外の要素があります")
+        return [normalize_material(item) for item in data], None
+    if not isinstance(data, dict):
+        raise ValueError("教材JSONの形式が不正です")
+
+    # app.py の保存形式
+    if 'generated_material' in data:
+        user_info = data.get('user_info') or {}
+        material = normalize_material(
+            data['generated_material'],
+            topic=data.get('final_situation'),
+            generated_at=data.get('created_at') or user_info.get('created_at')
+        )
+        return [material], user_info or None
+    if 'materials' in data:
+        return parse_material_json(data['materials'])
+    if 'type' in data:
+        return [normalize_material(data)], None
+    raise ValueError("教材が見つかりません")
+
+
+def parse_text_export(text: str) -> List[Dict]:
+    """テキスト出力（generate_text_content 形式）を教材一覧に変換"""
+    materials = []
+    material = None
+    field = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        header = _MATERIAL_HEADER.match(stripped)
+        if header:
+            material = {'topic': header.group(1).strip()}
+            materials.append(material)
+            field = None
+            continue
+        if material is None or _SEPARATOR.match(stripped):
+            field = None
+            continue
+
+        if field is None and stripped.startswith('タイプ:'):
+            material['type'] = stripped.split(':', 1)[1].strip()
+            continue
+        if field is None and stripped.startswith('生成日時:'):
+            generated_at = stripped.split(':', 1)[1].strip()
+            if generated_at and generated_at != 'Unknown':
+                material['generated_at'] = generated_at
+            continue
+
+        section = _SECTION_HEADER.match(stripped)
+        label = (section.group(1) or section.group(2)) if section else None
+        if label in TEXT_SECTIONS:
+            field = TEXT_SECTIONS[label][0]
+            material[field] = []
+            continue
+
+        # 見出し内の行をまとめて、最後にリスト・本文に変換する
+        if field is not None:
+            material[field].append(line.rstrip())
+
+    for material in materials:
+        for field, is_list in TEXT_SECTIONS.values():
+            lines = material.get(field)
+            if lines is None:
+                continue
+            if is_list:
+                material[field] = [line.strip().lstrip('•').strip() for line in lines if line.strip()]
+            else:
+                material[field] = '\n'.join(lines).strip()
+    return [normalize_material(material) for material in materials]
+
+
+def parse_legacy_file(path: str) -> Dict:
+    """1ファイルを解析（プロセスプールで実行）"""
+    result = {'path': path, 'kind': classify_file(os.path.basename(path)), 'materials': [],
+              'topics': [], 'contexts': [], 'error': None}
+    try:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            content = f.read()
+
+        kind = result['kind'] or ('material_text' if path.endswith('.txt') else 'material_json')
+        if kind == 'topic_list':
+            topics = json.loads(content)
+            if not isinstance(topics, list) or not all(isinstance(t, str) for t in topics):
+                raise ValueError("トピックリストの形式が不正です")
+            result['topics'] = [topic.strip() for topic in topics if topic.strip()]
+            return result
+
+        if kind == 'material_text':
+            materials, user_info = parse_text_export(content), None
+        else:
+            materials, user_info = parse_material_json(json.loads(content))
+        if not materials:
+            raise ValueError("教材が見つかりません")
+
+        context_key = None
+        if user_info:
+            context = {k: v for k, v in user_info.items() if k != 'created_at'}
+            context_key = stable_hash(context)
+            result['contexts'].append((context_key, context))
+        result['materials'] = [(material_content_hash(material), context_key, material) for material in materials]
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def is_streamed_file(path: str) -> bool:
+    """1件ずつ読み込んで取り込むファイルか（JSONL・大きなJSON出力）"""
+    kind = classify_file(os.path.basename(path))
+    if kind == 'material_jsonl' or path.endswith('.jsonl'):
+        return True
+    return kind == 'material_json' and os.path.getsize(path) > STREAM_FILE_SIZE
+
+
+def parse_streamed_file(path: str, result_size: int = STREAM_RESULT_SIZE) -> Iterator[Dict]:
+    """JSONL・JSON配列出力を1件ずつ読み込み、result_size 件ごとの解析結果として返す
+
+    2件目以降の結果には continued を付け、ファイル数を重複して数えないようにする
+    """
+    def new_result(continued):
+        return {'path': path, 'kind': 'material_jsonl', 'materials': [], 'topics': [], 'contexts': [],
+                'error': None, 'continued': continued}
+
+    result = new_result(False)
+    count = 0
+    try:
+        for material in iter_material_file(path):
+            material = normalize_material(material)
+            result['materials'].append((material_content_hash(material), None, material))
+            count += 1
+            if len(result['materials']) >= result_size:
+                yield result
+                result = new_result(True)
+        if not count:
+            raise ValueError("教材が見つかりません")
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    yield result
+
+
+def _parse_chunk(paths: List[str]) -> List[Dict]:
+    return [parse_legacy_file(path) for path in paths]
+
+
+def _chunks(items: Iterator[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_files(paths: Iterable[str], workers: Optional[int] = None) -> Iterator[Dict]:
+    """ファイルをプロセスプールで解析し、完了順に結果を返す（投入数を制限してメモリを抑える）"""
+    workers = workers or os.cpu_count() or 1
+    chunk_iter = _chunks(iter(paths), FILES_PER_TASK)
+    if workers <= 1:
+        for chunk in chunk_iter:
+            yield from _parse_chunk(chunk)
+        return
+
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        in_flight = []
+        for chunk in chunk_iter:
+            in_flight.append(pool.submit(_parse_chunk, chunk))
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.pop(0).result()
+        for future in in_flight:
+            yield from future.result()
+
+
+class LegacyImporter:
+    """解析結果を重複排除してリポジトリにまとめて挿入する"""
+
+    def __init__(self, store: MaterialStore, batch_size: int = INSERT_BATCH_SIZE):
+        self.store = store
+        self.batch_size = batch_size
+        self.seen_hashes = set()
+        self.context_ids = {}
+        self.pending = []
+        self.topics = {}
+        self.import_context_id = None
+        self.stats = {
+            'files': 0,
+            'bad_files': 0,
+            'materials_parsed': 0,
+            'materials_inserted': 0,
+            'duplicates': 0,
+            'topics': 0,
+            'contexts': 0
+        }
+        self.bad_files = []
+
+    def add_result(self, result: Dict):
+        if not result.get('continued'):
+            self.stats['files'] += 1
+        if result['error']:
+            self.stats['bad_files'] += 1
+            if len(self.bad_files) < BAD_FILE_REPORT_LIMIT:
+                self.bad_files.append({'path': result['path'], 'error': result['error']})
+            return
+
+        for context_key, context in result['contexts']:
+            if context_key not in self.context_ids:
+                name = "_".join(str(context.get(key, '')) for key in ('industry', 'job_role') if context.get(key))
+                self.context_ids[context_key] = self._find_or_create_context(context_key, context,
+                                                                             name or "取り込み")
+
+        for topic in result['topics']:
+            self.topics.setdefault(topic, None)
+
+        for content_hash, context_key, material in result['materials']:
+            self.stats['materials_parsed'] += 1
+            if content_hash in self.seen_hashes:
+                self.stats['duplicates'] += 1
+                continue
+            self.seen_hashes.add(content_hash)
+            self.pending.append((content_hash, context_key, material))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def _find_or_create_context(self, context_key: str, context: Dict, name: str) -> int:
+        """同じ内容のコンテキストが取り込み済みならそれを使う（再取り込みで重複させない）"""
+        context_id = self.store.find_context(context_key)
+        if context_id is None:
+            context_id = self.store.create_context(context, name, content_hash=context_key)
+            self.stats['contexts'] += 1
+        return context_id
+
+    def _get_import_context_id(self) -> int:
+        """受講者情報のない教材・トピックの取り込み先（実際に挿入するときに初めて作成する）"""
+        if self.import_context_id is None:
+            self.import_context_id = self._find_or_create_context(
+                IMPORT_CONTEXT_KEY, IMPORT_CONTEXT,
+                f"過去ファイル取り込み {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+            )
+        return self.import_context_id
+
+    def flush(self):
+        """保留中の教材を挿入（リポジトリに既にある内容はスキップ）"""
+        if not self.pending:
+            return
+        existing = self.store.existing_hashes([content_hash for content_hash, _, _ in self.pending])
+        by_context = {}
+        for content_hash, context_key, material in self.pending:
+            if content_hash in existing:
+                self.stats['duplicates'] += 1
+                continue
+            context_id = self.context_ids[context_key] if context_key else self._get_import_context_id()
+            by_context.setdefault(context_id, []).append(material)
+        for context_id, materials in by_context.items():
+            self.stats['materials_inserted'] += len(self.store.add_materials(materials, context_id))
+        self.pending = []
+
+    def finish(self):
+        self.flush()
+        if not self.topics:
+            return
+        # 取り込み済みのトピックしかなければ取り込み先を作らない
+        context_id = self.import_context_id or self.store.find_context(IMPORT_CONTEXT_KEY)
+        existing = set(self.store.get_context(context_id)['context_data']['topic_list'] if context_id else [])
+        new_topics = [topic for topic in self.topics if topic not in existing]
+        if not new_topics:
+            return
+        context_id = self._get_import_context_id()
+        context = self.store.get_context(context_id)['context_data']
+        context['topic_list'] = context['topic_list'] + new_topics
+        self.store.update_context(context_id, context)
+        self.stats['topics'] = len(new_topics)
+
+
+def import_legacy_files(paths: Iterable[str], store: MaterialStore, workers: Optional[int] = None,
+                        batch_size: int = INSERT_BATCH_SIZE) -> Dict:
+    """過去の出力ファイルを取り込み、件数とスループットを返す"""
+    started = time.perf_counter()
+    importer = LegacyImporter(store, batch_size)
+    streamed = []
+
+    def pooled_files():
+        for path in iter_legacy_files(paths):
+            if is_streamed_file(path):
+                streamed.append(path)
+            else:
+                yield path
+
+    for result in parse_files(pooled_files(), workers):
+        importer.add_result(result)
+    for path in streamed:
+        for result in parse_streamed_file(path):
+            importer.add_result(result)
+    importer.finish()
+    elapsed = time.perf_counter() - started
+
+    report = dict(importer.stats)
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['files_per_second'] = round(report['files'] / elapsed, 1) if elapsed else 0.0
+    report['materials_per_second'] = round(report['materials_parsed'] / elapsed, 1) if elapsed else 0.0
+    report['bad_file_examples'] = importer.bad_files
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """過去の出力ファイルをコマンドラインから一括取り込み"""
+    parser = argparse.ArgumentParser(description="過去の教材・トピックリスト出力ファイルの一括取り込み")
+    parser.add_argument('paths', nargs='+', help="取り込むファイルまたはディレクトリ")
+    parser.add_argument('--db', default=MATERIAL_DB_PATH, help="教材DBのパス")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="解析プロセス数")
+    parser.add_argument('--batch-size', type=int, default=INSERT_BATCH_SIZE, help="1トランザクションの挿入件数")
+    parser.add_argument('--report', help="取り込み結果を書き出すJSONファイル")
+    args = parser.parse_args(argv)
+
+    report = import_legacy_files(args.paths, MaterialStore(args.db), args.workers, args.batch_size)
+
+    print(f"ファイル: {report['files']}件（不正 {report['bad_files']}件） / "
+          f"教材: {report['materials_parsed']}件解析・{report['materials_inserted']}件追加・"
+          f"{report['duplicates']}件重複 / トピック: {report['topics']}件", file=sys.stderr)
+    print(f"処理時間: {report['elapsed_seconds']}秒（{report['files_per_second']}ファイル/秒、"
+          f"{report['materials_per_second']}教材/秒）", file=sys.stderr)
+    for bad_file in report['bad_file_examples']:
+        print(f"  不正: {bad_file['path']}: {bad_file['error']}", file=sys.stderr)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
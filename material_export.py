@@ -0,0 +1,242 @@
+"""
+教材の書き出し・読み込み
+テキスト・JSON・JSONL出力を教材1件ずつの断片として生成し、ファイルやダウンロード応答へ順に書き込む
+（全体を文字列連結で組み立てないため、件数に比例した時間と教材1件分のメモリで出力できる）
+JSON・JSONL出力は iter_material_file で1件ずつ読み戻せる
+
+使い方:
+    python material_export.py materials.jsonl --format jsonl --db materials.db --context 3
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from material_store import MATERIAL_DB_PATH, MaterialStore
+
+# 出力形式 -> (拡張子, MIMEタイプ)
+EXPORT_FORMATS = {
+    'text': ('txt', 'text/plain'),
+    'json': ('json', 'application/json'),
+    'jsonl': ('jsonl', 'application/x-ndjson')
+}
+
+# テキスト出力の項目（出力順）: (キー, 見出し, リスト項目か)
+TEXT_SECTIONS = [
+    ('model_dialogue', '対話文', False),
+    ('useful_expressions', '有用表現', True),
+    ('additional_questions', '追加質問', True),
+    ('discussion_topic', 'ディスカッショントピック', False),
+    ('background_info', '背景情報', False),
+    ('key_points', '議論ポイント', True),
+    ('discussion_questions', '討議質問', True),
+    ('chart_description', '図表説明', False),
+    ('vocabulary', '重要語彙', True),
+    ('practice_questions', '練習問題', True)
+]
+
+MATERIAL_SEPARATOR = "\n" + "=" * 50 + "\n\n"
+
+# エンコード済み出力をまとめて書き出す単位
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def format_material_text(number: int, material: Dict) -> str:
+    """教材1件分のテキスト（number は1始まりの通し番号）"""
+    parts = [
+        f"=== 教材 {number}: {material.get('topic', 'Unknown')} ===\n\n",
+        f"タイプ: {material.get('type', 'Unknown')}\n",
+        f"生成日時: {material.get('generated_at', 'Unknown')}\n"
+    ]
+    for key, label, is_list in TEXT_SECTIONS:
+        if key not in material:
+            continue
+        if is_list:
+            parts.append(f"\n【{label}】\n")
+            parts.extend([f"• {item}\n" for item in material[key]])
+        else:
+            parts.append(f"\n【{label}】\n{material[key]}\n")
+    parts.append(MATERIAL_SEPARATOR)
+    return "".join(parts)
+
+
+def iter_text_export(materials: Iterable[Dict]) -> Iterator[str]:
+    """テキスト出力を教材1件ずつ返す（教材はイテレータでもよい）"""
+    for i, material in enumerate(materials):
+        yield format_material_text(i + 1, material)
+
+
+def iter_json_export(materials: Iterable[Dict], indent: int = 2) -> Iterator[str]:
+    """JSON配列出力を教材1件ずつ返す（json.dumps(materials, indent=indent) と同じ内容）"""
+    prefix = "\n" + " " * indent
+    first = True
+    for material in materials:
+        # 文字列中の改行はエスケープされるため、行頭に字下げを足すだけで配列要素の字下げになる
+        item = json.dumps(material, ensure_ascii=False, indent=indent).replace("\n", prefix)
+        yield ("[" if first else ",") + prefix + item
+        first = False
+    yield "[]" if first else "\n]"
+
+
+def iter_jsonl_export(materials: Iterable[Dict]) -> Iterator[str]:
+    """JSONL出力（1行1教材）を返す"""
+    for material in materials:
+        yield json.dumps(material, ensure_ascii=False) + "\n"
+
+
+def iter_export(materials: Iterable[Dict], export_format: str) -> Iterator[str]:
+    """指定形式の出力を教材1件ずつ返す"""
+    if export_format == 'json':
+        return iter_json_export(materials)
+    if export_format == 'jsonl':
+        return iter_jsonl_export(materials)
+    if export_format == 'text':
+        return iter_text_export(materials)
+    raise ValueError(f"未対応の出力形式です: {export_format}")
+
+
+def iter_export_bytes(materials: Iterable[Dict], export_format: str, encoding: str = 'utf-8',
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """エンコード済みの出力を chunk_size 程度ごとに返す（HTTP応答へのストリーミング用）"""
+    buffer = []
+    size = 0
+    for text in iter_export(materials, export_format):
+        data = text.encode(encoding)
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def write_export(materials: Iterable[Dict], fp: TextIO, export_format: str = 'text') -> int:
+    """出力をファイル風オブジェクトへ順に書き込み、書き出した教材数を返す"""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for material in materials:
+            count += 1
+            yield material
+
+    for text in iter_export(counted(), export_format):
+        fp.write(text)
+    return count
+
+
+def generate_text_content(materials: Iterable[Dict]) -> str:
+    """教材をテキスト形式で生成"""
+    return "".join(iter_text_export(materials))
+
+
+def iter_json_array(fp: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator:
+    """JSON配列を要素ごとに読み込む（ファイル全体は読み込まない）"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        # 大きな要素でも読み直しが増えすぎないよう、読み込み量はバッファに合わせて増やす
+        chunk = fp.read(max(chunk_size, len(buffer) - pos))
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError("JSON配列ではありません")
+    pos += 1
+    skip_whitespace()
+    if pos < len(buffer) and buffer[pos] == ']':
+        return
+
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # バッファ末尾で終わる数値などは続きがある可能性があるため読み足して確認する
+            if end >= len(buffer) and not eof:
+                fill()
+                continue
+            break
+        yield value
+        pos = end
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError("JSON配列が途中で終わっています")
+        separator = buffer[pos]
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"JSON配列の区切りが不正です: {separator!r}")
+
+
+def iter_material_file(path: str) -> Iterator[Dict]:
+    """JSONL・JSON配列の出力ファイルから教材を1件ずつ読み込む"""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        if path.endswith('.jsonl'):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    material = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{line_number}行目: {e}") from e
+                if not isinstance(material, dict):
+                    raise ValueError(f"{line_number}行目: 教材が辞書ではありません")
+                yield material
+            return
+
+        for material in iter_json_array(f):
+            if not isinstance(material, dict):
+                raise ValueError("教材リストに辞書以外の要素があります")
+            yield material
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """教材リポジトリの教材をファイルへ書き出す"""
+    parser = argparse.ArgumentParser(description="教材リポジトリの教材を1件ずつファイルへ書き出す")
+    parser.add_argument('output', help="出力ファイル（- で標準出力）")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='jsonl', help="出力形式")
+    parser.add_argument('--db', default=MATERIAL_DB_PATH, help="教材DBのパス")
+    parser.add_argument('--context', type=int, help="コンテキストID（省略時は全教材）")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    materials = MaterialStore(args.db).iter_materials(args.context)
+    if args.output == '-':
+        count = write_export(materials, sys.stdout, args.format)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            count = write_export(materials, f, args.format)
+    elapsed = time.perf_counter() - started
+    print(f"{count}件を書き出しました（{elapsed:.1f}秒）", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+"""
+型付き教材モデル
+教材タイプごとに項目を固定した軽量クラス（__slots__）。
+
+一覧・検索ではID・タイプ・トピック・生成日時と項目名だけを読み込み、対話文や表現リストなどの
+本文項目は初めて参照したときにリポジトリから項目単位で取り出す（一覧ではページ内の教材の同じ項目を
+まとめて取り出す）。タイプ・トピック・項目名の組はインターンして教材間で共有するため、
+数千件を保持してもメモリはほぼ見出し分で済む。
+従来の辞書と同じく material.get('topic') / 'useful_expressions' in material でも参照できる。
+"""
+
+import json
+import sys
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# (教材ID, 項目名) から項目の値を読み込む関数
+FieldLoader = Callable[[int, str], object]
+
+# 見出し項目（リポジトリの列から読み込み、常に保持する）
+HEADER_FIELDS = ('type', 'topic', 'generated_at')
+
+# 項目名の組（JSON配列の文字列 → タプル）。同じ構成の教材で1つのタプルを共有する
+_KEY_SETS: Dict[str, Tuple[str, ...]] = {}
+
+
+def intern_keys(keys_json: str) -> Tuple[str, ...]:
+    """項目名の組（JSON配列）を共有タプルに変換"""
+    keys = _KEY_SETS.get(keys_json)
+    if keys is None:
+        keys = tuple(sys.intern(key) for key in json.loads(keys_json))
+        _KEY_SETS[keys_json] = keys
+    return keys
+
+
+class Material:
+    """教材の共通部分（未知のタイプもこのクラスで扱う）"""
+
+    __slots__ = ('id', 'type', 'topic', 'generated_at', '_keys', '_loader', '_extra')
+
+    # タイプ固有の本文項目（サブクラスで定義。参照時に読み込む）
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, material_id: Optional[int], material_type: str, topic: str,
+                 generated_at: Optional[str], keys: Tuple[str, ...], loader: Optional[FieldLoader] = None):
+        self.id = material_id
+        self.type = sys.intern(material_type or '')
+        self.topic = sys.intern(topic or '')
+        self.generated_at = generated_at
+        self._keys = keys
+        self._loader = loader
+        # タイプ固有でない項目（audio_script など）の読み込み済みの値
+        self._extra = None
+
+    def __getattr__(self, name):
+        # 未読み込みの本文項目は初回参照時に読み込んで保持する
+        if name not in type(self).FIELDS:
+            raise AttributeError(name)
+        value = self._load(name)
+        object.__setattr__(self, name, value)
+        return value
+
+    def _load(self, name: str):
+        if name not in self._keys or self._loader is None:
+            return None
+        return self._loader(self.id, name)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self.id}, topic={self.topic!r})"
+
+    # --- 辞書互換 ---
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __getitem__(self, key: str):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key in HEADER_FIELDS or key in type(self).FIELDS:
+            return getattr(self, key)
+        if self._extra is None:
+            self._extra = {}
+        if key not in self._extra:
+            self._extra[key] = self._load(key)
+        return self._extra[key]
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._keys else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._keys
+
+    def to_dict(self) -> Dict:
+        """辞書に変換（出力・品質チェックなど既存処理へ渡す用。未読み込みの項目はここで読み込む）"""
+        return {key: self[key] for key in self._keys}
+
+
+class RoleplayMaterial(Material):
+    """ロールプレイ教材"""
+
+    __slots__ = ('model_dialogue', 'useful_expressions', 'additional_questions')
+    FIELDS = __slots__
+
+
+class DiscussionMaterial(Material):
+    """ディスカッション教材"""
+
+    __slots__ = ('discussion_topic', 'background_info', 'key_points', 'useful_expressions',
+                 'discussion_questions')
+    FIELDS = __slots__
+
+
+class ExpressionPracticeMaterial(Material):
+    """表現練習教材"""
+
+    __slots__ = ('chart_description', 'chart_data', 'useful_vocabulary', 'practice_questions',
+                 'explanation_points')
+    FIELDS = __slots__
+
+
+MATERIAL_CLASSES = {
+    'ロールプレイ': RoleplayMaterial,
+    'ディスカッション': DiscussionMaterial,
+    '表現練習': ExpressionPracticeMaterial
+}
+
+
+def material_class(material_type: str) -> type:
+    return MATERIAL_CLASSES.get(material_type, Material)
+
+
+def material_from_row(material_id: int, material_type: str, topic: str, generated_at: Optional[str],
+                      keys_json: str, loader: FieldLoader) -> Material:
+    """リポジトリの見出し列から本文未読み込みの教材を作成"""
+    cls = material_class(material_type)
+    return cls(material_id, material_type, topic, generated_at, intern_keys(keys_json), loader)
+
+
+def material_from_dict(material: Dict, material_id: Optional[int] = None) -> Material:
+    """辞書の教材から型付き教材を作成（すべての項目を読み込み済みにする）"""
+    cls = material_class(material.get('type', ''))
+    obj = cls(material_id, material.get('type', ''), material.get('topic', ''), material.get('generated_at'),
+              intern_keys(json.dumps(list(material), ensure_ascii=False)))
+    for field in cls.FIELDS:
+        object.__setattr__(obj, field, material.get(field))
+    obj._extra = {key: value for key, value in material.items()
+                  if key not in HEADER_FIELDS and key not in cls.FIELDS}
+    return obj
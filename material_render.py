@@ -0,0 +1,387 @@
+"""
+教材のローカル出力（DOCX・PDF）
+Google Docs出力と同じ構成（google_docs_api.write_material_document）の教材ドキュメントを、
+APIを使わずにファイルとして生成し、ZIPにまとめる
+
+- DOCX: 標準ライブラリ（zipfile・XML）のみで生成。見出し・番号付き/記号付き箇条書きはWordのスタイルで設定
+- PDF: 標準ライブラリのみで生成。日本語はPDFビューアが標準で持つ HeiseiKakuGo-W5（フォント埋め込みなし）で表示し、
+  フォントにない絵文字は出力しない
+- 件数が多い場合はプロセスプールで並列に生成する
+
+使い方:
+    python material_render.py materials.zip --format docx --db materials.db --context 3
+"""
+
+import argparse
+import io
+import re
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, Iterable, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from google_docs_api import BULLET_LIST, NUMBERED_LIST, DocRequestBuilder, write_material_document
+from material_store import MATERIAL_DB_PATH, MaterialStore
+
+# 出力形式 -> (拡張子, MIMEタイプ)
+RENDER_FORMATS = {
+    'docx': ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    'pdf': ('pdf', 'application/pdf')
+}
+
+# この件数以上はプロセスプールで生成する（少ない場合はプロセス起動の方が時間がかかる）
+PROCESS_POOL_THRESHOLD = 50
+
+# ファイル名に使えない文字
+_UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\r\n\t]+')
+
+# XMLに含められない制御文字
+_XML_INVALID = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# PDFの標準日本語フォントにない文字（BMP外の絵文字・記号類と異体字セレクタ。直後の空白も除く）
+_PDF_UNSUPPORTED = re.compile('[\U00010000-\U0010ffff\u2600-\u27bf\ufe0f\u200d]+ ?')
+
+
+class OutlineBuilder(DocRequestBuilder):
+    """DocRequestBuilder と同じ呼び出しで段落の一覧を集める（ローカル出力用）
+
+    paragraphs: (段落スタイル, テキスト, 箇条書き) のリスト。箇条書きは (リスト番号, 種類) または None
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.paragraphs: List[Tuple[Optional[str], str, Optional[Tuple[int, str]]]] = []
+        self.list_count = 0
+
+    def paragraph(self, text: str = '', style: Optional[str] = None) -> Tuple[int, int]:
+        # Google Docsと同じく、テキスト中の改行は段落の区切りになる
+        for line in str(text).split('\n'):
+            self.paragraphs.append((style, line, None))
+        return 0, 0
+
+    def list_items(self, items: Iterable, preset: str = NUMBERED_LIST) -> Optional[Tuple[int, int]]:
+        items = [str(item).replace('\n', ' ') for item in items]
+        if not items:
+            return None
+        self.list_count += 1
+        for item in items:
+            self.paragraphs.append((None, item, (self.list_count, preset)))
+        return 0, 0
+
+
+def material_outline(material: Dict) -> OutlineBuilder:
+    outline = OutlineBuilder()
+    write_material_document(outline, material)
+    return outline
+
+
+# --- DOCX ---
+
+_DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>
+<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>
+</Types>"""
+
+_DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>
+</Relationships>"""
+
+_DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering" Target="numbering.xml"/>
+</Relationships>"""
+
+_W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+# 段落スタイル -> (WordのスタイルID, 表示名, 文字サイズ（半ポイント）, 見出しレベル)
+_DOCX_STYLES = {
+    'TITLE': ('Title', 'Title', 48, None),
+    'HEADING_1': ('Heading1', 'heading 1', 32, 0),
+    'HEADING_2': ('Heading2', 'heading 2', 26, 1)
+}
+
+
+def _docx_styles() -> str:
+    styles = [
+        '<w:docDefaults><w:rPrDefault><w:rPr>'
+        '<w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="Yu Gothic" w:cs="Calibri"/>'
+        '<w:sz w:val="21"/><w:lang w:val="en-US" w:eastAsia="ja-JP"/></w:rPr></w:rPrDefault>'
+        '<w:pPrDefault><w:pPr><w:spacing w:after="80" w:line="300" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+        '</w:docDefaults>',
+        '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>',
+        '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+        '<w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="720"/></w:pPr></w:style>'
+    ]
+    for style_id, name, size, level in _DOCX_STYLES.values():
+        outline = f'<w:outlineLvl w:val="{level}"/>' if level is not None else ''
+        styles.append(
+            f'<w:style w:type="paragraph" w:styleId="{style_id}"><w:name w:val="{name}"/>'
+            f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+            f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/>{outline}</w:pPr>'
+            f'<w:rPr><w:b/><w:sz w:val="{size}"/></w:rPr></w:style>'
+        )
+    return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:styles {_W_NS}>{"".join(styles)}</w:styles>'
+
+
+def _docx_numbering(lists: Dict[int, str]) -> str:
+    """番号付き（abstractNum 0）・記号付き（abstractNum 1）の定義と、リストごとの番号（1から振り直す）"""
+    parts = [
+        '<w:abstractNum w:abstractNumId="0"><w:multiLevelType w:val="singleLevel"/>'
+        '<w:lvl w:ilvl="0"><w:start w:val="1"/><w:numFmt w:val="decimal"/><w:lvlText w:val="%1."/>'
+        '<w:lvlJc w:val="left"/><w:pPr><w:ind w:left="720" w:hanging="360"/></w:pPr></w:lvl></w:abstractNum>',
+        '<w:abstractNum w:abstractNumId="1"><w:multiLevelType w:val="singleLevel"/>'
+        '<w:lvl w:ilvl="0"><w:start w:val="1"/><w:numFmt w:val="bullet"/><w:lvlText w:val="•"/>'
+        '<w:lvlJc w:val="left"/><w:pPr><w:ind w:left="720" w:hanging="360"/></w:pPr></w:lvl></w:abstractNum>'
+    ]
+    for list_id, preset in lists.items():
+        abstract_id = 1 if preset == BULLET_LIST else 0
+        parts.append(
+            f'<w:num w:numId="{list_id}"><w:abstractNumId w:val="{abstract_id}"/>'
+            f'<w:lvlOverride w:ilvl="0"><w:startOverride w:val="1"/></w:lvlOverride></w:num>'
+        )
+    return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:numbering {_W_NS}>{"".join(parts)}</w:numbering>'
+
+
+def _docx_text(text: str) -> str:
+    return escape(_XML_INVALID.sub('', text))
+
+
+def render_docx(material: Dict) -> bytes:
+    """教材1件分のDOCX"""
+    outline = material_outline(material)
+    body = []
+    lists = {}
+    for style, text, list_item in outline.paragraphs:
+        properties = ''
+        if style in _DOCX_STYLES:
+            properties = f'<w:pStyle w:val="{_DOCX_STYLES[style][0]}"/>'
+        elif list_item:
+            list_id, preset = list_item
+            lists[list_id] = preset
+            properties = (f'<w:pStyle w:val="ListParagraph"/>'
+                          f'<w:numPr><w:ilvl w:val="0"/><w:numId w:val="{list_id}"/></w:numPr>')
+        run = f'<w:r><w:t xml:space="preserve">{_docx_text(text)}</w:t></w:r>' if text else ''
+        body.append(f'<w:p><w:pPr>{properties}</w:pPr>{run}</w:p>' if properties else f'<w:p>{run}</w:p>')
+    body.append('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+                '<w:pgMar w:top="1440" w:right="1200" w:bottom="1440" w:left="1200" '
+                'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>')
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<w:document {_W_NS}><w:body>{"".join(body)}</w:body></w:document>')
+    core = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:title>{_docx_text(str(material.get("topic", "")))}</dc:title>'
+        '<dc:creator>語学教材作成支援ツール</dc:creator></cp:coreProperties>'
+    )
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('[Content_Types].xml', _DOCX_CONTENT_TYPES)
+        docx.writestr('_rels/.rels', _DOCX_RELS)
+        docx.writestr('word/_rels/document.xml.rels', _DOCX_DOCUMENT_RELS)
+        docx.writestr('word/document.xml', document)
+        docx.writestr('word/styles.xml', _docx_styles())
+        docx.writestr('word/numbering.xml', _docx_numbering(lists))
+        docx.writestr('docProps/core.xml', core)
+    return buffer.getvalue()
+
+
+# --- PDF ---
+
+# A4（ポイント）と余白
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 56
+PDF_LIST_INDENT = 18
+
+# 段落スタイル -> 文字サイズ（ポイント）
+_PDF_SIZES = {'TITLE': 20, 'HEADING_1': 16, 'HEADING_2': 13}
+PDF_FONT_SIZE = 10.5
+PDF_LINE_SPACING = 1.6
+
+
+def _pdf_char_width(char: str) -> float:
+    """文字幅（1emあたり）。UniJIS-UCS2-HW-H ではASCIIは半角、それ以外は全角"""
+    return 0.5 if ' ' <= char <= '~' else 1.0
+
+
+def _pdf_wrap(text: str, size: float, width: float) -> List[str]:
+    """幅に収まるよう行を分ける（英文は空白の位置で、日本語は文字単位で折り返す）"""
+    lines = []
+    line = ''
+    line_width = 0.0
+    last_space = -1
+    for char in text:
+        char_width = _pdf_char_width(char) * size
+        if line and line_width + char_width > width:
+            if last_space > 0 and char != ' ':
+                lines.append(line[:last_space])
+                line = line[last_space + 1:]
+            else:
+                lines.append(line)
+                line = ''
+            line_width = sum(_pdf_char_width(c) for c in line) * size
+            last_space = -1
+            if char == ' ' and not line:
+                continue
+        if char == ' ':
+            last_space = len(line)
+        line += char
+        line_width += char_width
+    lines.append(line)
+    return lines
+
+
+def _pdf_hex(text: str) -> str:
+    return '<' + text.encode('utf-16-be').hex() + '>'
+
+
+def _pdf_lines(outline: OutlineBuilder) -> List[List[Tuple[float, float, float, str]]]:
+    """段落をページごとの行 (x, y, 文字サイズ, テキスト) に割り付ける"""
+    pages = [[]]
+    y = PDF_PAGE_HEIGHT - PDF_MARGIN
+    numbers = {}
+    for style, text, list_item in outline.paragraphs:
+        size = _PDF_SIZES.get(style, PDF_FONT_SIZE)
+        text = _PDF_UNSUPPORTED.sub('', text).strip() if style else _PDF_UNSUPPORTED.sub('', text)
+        x = PDF_MARGIN
+        if list_item:
+            list_id, preset = list_item
+            numbers[list_id] = numbers.get(list_id, 0) + 1
+            marker = '•' if preset == BULLET_LIST else f"{numbers[list_id]}."
+            text = f"{marker} {text}"
+            x += PDF_LIST_INDENT
+        if style:
+            y -= size * 0.6
+        for line in _pdf_wrap(text, size, PDF_PAGE_WIDTH - PDF_MARGIN - x):
+            y -= size * PDF_LINE_SPACING
+            if y < PDF_MARGIN:
+                pages.append([])
+                y = PDF_PAGE_HEIGHT - PDF_MARGIN - size * PDF_LINE_SPACING
+            pages[-1].append((x, y, size, line))
+    return pages
+
+
+def render_pdf(material: Dict) -> bytes:
+    """教材1件分のPDF"""
+    pages = _pdf_lines(material_outline(material))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # ページ一覧（ページのオブジェクト番号が決まってから作成）
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5 /Encoding /UniJIS-UCS2-HW-H "
+        b"/DescendantFonts [4 0 R] >>",
+        b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5 "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >> "
+        b"/FontDescriptor 5 0 R /DW 1000 /W [231 389 500 631 631 500] >>",
+        b"<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4 /FontBBox [-92 -250 1010 922] "
+        b"/ItalicAngle 0 /Ascent 752 /Descent -221 /CapHeight 737 /StemV 58 >>",
+        ("<< /Title " + _pdf_hex('\ufeff' + _PDF_UNSUPPORTED.sub('', str(material.get('topic', ''))))
+         + " /Producer (language-material-creator) >>").encode('ascii')
+    ]
+    page_ids = []
+    for lines in pages:
+        commands = [f"BT /F1 {size} Tf 1 0 0 1 {x:.2f} {y:.2f} Tm {_pdf_hex(line)} Tj ET"
+                    for x, y, size, line in lines if line]
+        stream = zlib.compress("\n".join(commands).encode('ascii'))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+             f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode('ascii')
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode('ascii')
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    output.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R /Info 6 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                 % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+# --- 一括出力 ---
+
+_RENDERERS = {'docx': render_docx, 'pdf': render_pdf}
+
+
+def material_filename(number: int, material: Dict, render_format: str) -> str:
+    topic = _UNSAFE_FILENAME.sub('_', str(material.get('topic') or 'Unknown')).strip()[:60]
+    return f"教材{number:03d}_{topic}.{RENDER_FORMATS[render_format][0]}"
+
+
+def render_material(material: Dict, render_format: str) -> bytes:
+    """教材1件を指定形式で生成"""
+    if render_format not in _RENDERERS:
+        raise ValueError(f"未対応の出力形式です: {render_format}")
+    return _RENDERERS[render_format](material)
+
+
+def _render_item(item: Tuple[Dict, str]) -> bytes:
+    # プロセスプールから呼ぶため引数は1つにまとめる
+    return render_material(*item)
+
+
+def render_materials_zip(materials: Iterable[Dict], render_format: str, max_workers: Optional[int] = None) -> bytes:
+    """教材を1件1ファイルで生成し、ZIPにまとめる
+
+    PROCESS_POOL_THRESHOLD 件以上はプロセスプールで並列に生成する（max_workers: 既定はCPU数）
+    """
+    materials = list(materials)
+    items = [(material, render_format) for material in materials]
+    if len(items) >= PROCESS_POOL_THRESHOLD and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn')) as pool:
+            files = list(pool.map(_render_item, items, chunksize=max(1, len(items) // 32)))
+    else:
+        files = [_render_item(item) for item in items]
+
+    buffer = io.BytesIO()
+    # DOCXは圧縮済み・PDFは本文を圧縮済みのため、ZIPでは圧縮しない
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for i, (material, data) in enumerate(zip(materials, files), 1):
+            archive.writestr(material_filename(i, material, render_format), data)
+    return buffer.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """教材リポジトリの教材をDOCX・PDFのZIPに書き出す"""
+    parser = argparse.ArgumentParser(description="教材リポジトリの教材をDOCX・PDFのZIPに書き出す")
+    parser.add_argument('output', help="出力するZIPファイル")
+    parser.add_argument('--format', choices=list(RENDER_FORMATS), default='docx', help="出力形式")
+    parser.add_argument('--db', default=MATERIAL_DB_PATH, help="教材DBのパス")
+    parser.add_argument('--context', type=int, help="コンテキストID（省略時は全教材）")
+    parser.add_argument('--workers', type=int, help="生成に使うプロセス数（1で並列化しない）")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    materials = MaterialStore(args.db).load_materials(args.context)
+    data = render_materials_zip(materials, args.format, args.workers)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    elapsed = time.perf_counter() - started
+    rate = len(materials) / elapsed if elapsed else 0
+    print(f"{len(materials)}件を書き出しました（{elapsed:.1f}秒・{rate:.0f}件/秒・{len(data) / 1024:.0f}KB）")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
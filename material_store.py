@@ -0,0 +1,781 @@
+"""
+教材リポジトリ
+コンテキスト・トピック・教材・有用表現・品質結果をSQLite（WAL）に保存し、ページ単位で読み出す
+
+教材の編集履歴は、最新版を materials に置き、過去の版は「1つ新しい版から戻すための
+フィールド単位の差分」として material_versions に保存する（一定間隔で全体のスナップショットも保存）。
+"""
+
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from batch_generation import extract_english_part
+from material_model import Material, material_from_row
+from quality_scoring import material_content_hash
+
+MATERIAL_DB_PATH = os.getenv('MATERIAL_DB_PATH', 'materials.db')
+
+# 出力管理タブなどで1ページに表示する教材数
+DEFAULT_PAGE_SIZE = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contexts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_contexts_updated ON contexts(updated_at);
+
+-- 取り込み元のコンテキスト内容ハッシュ -> コンテキスト（再取り込み時に同じコンテキストを使う）
+CREATE TABLE IF NOT EXISTS context_sources (
+    content_hash TEXT PRIMARY KEY,
+    context_id INTEGER NOT NULL REFERENCES contexts(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS topics (
+    context_id INTEGER NOT NULL REFERENCES contexts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    PRIMARY KEY (context_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS materials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    context_id INTEGER REFERENCES contexts(id) ON DELETE SET NULL,
+    topic TEXT NOT NULL DEFAULT '',
+    type TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    generated_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_materials_context ON materials(context_id, id);
+CREATE INDEX IF NOT EXISTS idx_materials_type ON materials(type, id);
+CREATE INDEX IF NOT EXISTS idx_materials_hash ON materials(content_hash);
+
+CREATE TABLE IF NOT EXISTS expressions (
+    material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    expression TEXT NOT NULL,
+    english TEXT NOT NULL,
+    PRIMARY KEY (material_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_expressions_english ON expressions(english);
+
+CREATE TABLE IF NOT EXISTS quality_results (
+    material_id INTEGER PRIMARY KEY REFERENCES materials(id) ON DELETE CASCADE,
+    content_hash TEXT NOT NULL,
+    score REAL NOT NULL,
+    components TEXT NOT NULL,
+    checked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quality_score ON quality_results(score);
+
+CREATE TABLE IF NOT EXISTS material_versions (
+    material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    delta TEXT NOT NULL,
+    snapshot TEXT,
+    source TEXT NOT NULL DEFAULT '',
+    changed_fields TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (material_id, version)
+);
+
+CREATE TABLE IF NOT EXISTS doc_exports (
+    material_id INTEGER PRIMARY KEY REFERENCES materials(id) ON DELETE CASCADE,
+    document_id TEXT NOT NULL,
+    sections TEXT NOT NULL,
+    end_index INTEGER NOT NULL,
+    exported_at TEXT NOT NULL
+);
+"""
+
+# この版数ごとに過去版の全体スナップショットを保存し、復元時に適用する差分の数を抑える
+VERSION_SNAPSHOT_INTERVAL = 10
+
+# リストの変更要素がこの割合未満なら要素単位の差分で保存する
+LIST_ITEM_DELTA_RATIO = 0.5
+
+# 全文検索インデックス
+# trigramトークナイザで3文字以上の語を部分一致検索し、
+# trigramでは引けない2文字の語（「融資」「契約」など）は2-gramに分割した補助インデックスで検索する
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS materials_fts USING fts5(
+    topic, dialogue, expressions, questions, discussion,
+    tokenize = 'trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS materials_bigram USING fts5(
+    grams,
+    tokenize = 'unicode61 remove_diacritics 0'
+);
+"""
+
+# 検索インデックスの列 -> 教材のフィールド
+SEARCH_FIELDS = {
+    'topic': ['topic'],
+    'dialogue': ['model_dialogue', 'chart_description'],
+    'expressions': ['useful_expressions', 'useful_vocabulary'],
+    'questions': ['additional_questions', 'discussion_questions', 'practice_questions'],
+    'discussion': ['discussion_topic', 'background_info', 'key_points', 'explanation_points'],
+}
+
+# trigramで検索できる最小文字数（これより短い語は2-gramインデックスで探す）
+SEARCH_MIN_TERM_LENGTH = 3
+
+_WORD_CHAR = re.compile(r'\w')
+
+
+def to_bigrams(text: str) -> List[str]:
+    """文字列を2文字単位のトークンに分割（記号・空白をまたぐ組は除く）"""
+    text = text.lower()
+    return [text[i:i + 2] for i in range(len(text) - 1)
+            if _WORD_CHAR.match(text[i]) and _WORD_CHAR.match(text[i + 1])]
+
+
+def compute_delta(source: Dict, target: Dict) -> Dict:
+    """source を target に変換するフィールド単位の差分"""
+    delta = {}
+    for key, value in target.items():
+        if key in source and source[key] == value:
+            continue
+        old = source.get(key)
+        if isinstance(old, list) and isinstance(value, list) and len(old) == len(value) and value:
+            items = {str(i): item for i, (before, item) in enumerate(zip(old, value)) if before != item}
+            if len(items) < len(value) * LIST_ITEM_DELTA_RATIO:
+                delta.setdefault('items', {})[key] = items
+                continue
+        delta.setdefault('set', {})[key] = value
+    removed = [key for key in source if key not in target]
+    if removed:
+        delta['unset'] = removed
+    return delta
+
+
+def apply_delta(material: Dict, delta: Dict) -> Dict:
+    """差分を適用した新しい教材を返す（元の教材は変更しない）"""
+    result = dict(material)
+    for key in delta.get('unset', []):
+        result.pop(key, None)
+    result.update(delta.get('set', {}))
+    for key, items in delta.get('items', {}).items():
+        values = list(result.get(key) or [])
+        for index, item in items.items():
+            values[int(index)] = item
+        result[key] = values
+    return result
+
+
+def diff_materials(old: Dict, new: Dict) -> List[Dict]:
+    """2つの版の差分（表示用）: field・index（リスト要素の場合）・old・new"""
+    changes = []
+    for key in list(old) + [k for k in new if k not in old]:
+        before, after = old.get(key), new.get(key)
+        if before == after:
+            continue
+        if isinstance(before, list) and isinstance(after, list):
+            for i in range(max(len(before), len(after))):
+                item_before = before[i] if i < len(before) else None
+                item_after = after[i] if i < len(after) else None
+                if item_before != item_after:
+                    changes.append({'field': key, 'index': i, 'old': item_before, 'new': item_after})
+        else:
+            changes.append({'field': key, 'index': None, 'old': before, 'new': after})
+    return changes
+
+
+def _decode_field(value_type: str, value):
+    """json_each の (type, value) を Python の値に戻す"""
+    if value_type in ('array', 'object'):
+        return json.loads(value)
+    if value_type in ('true', 'false'):
+        return value_type == 'true'
+    return value
+
+
+class PageFieldLoader:
+    """1ページ分の教材の本文項目を読み込む（項目ごとにページ全体分を1回の問い合わせで取り出す）"""
+
+    def __init__(self, store: 'MaterialStore', material_ids: List[int]):
+        self.store = store
+        self.material_ids = material_ids
+        # 項目名 -> {教材ID: 値}
+        self._fields: Dict[str, Dict[int, object]] = {}
+
+    def __call__(self, material_id: int, field: str):
+        values = self._fields.get(field)
+        if values is None:
+            values = self._fields[field] = self.store.load_material_fields(self.material_ids, field)
+        return values.get(material_id)
+
+
+class MaterialStore:
+    """SQLiteに保存された教材リポジトリ"""
+
+    def __init__(self, db_path: str = MATERIAL_DB_PATH):
+        self.db_path = db_path
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            conn.executescript(SEARCH_SCHEMA)
+            # 検索インデックス導入前のDBは初回に全件登録する
+            if (conn.execute("SELECT COUNT(*) FROM materials_fts").fetchone()[0] == 0
+                    and conn.execute("SELECT COUNT(*) FROM materials").fetchone()[0] > 0):
+                self._rebuild_search_index(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """トランザクション付きの接続（終了時にコミットして閉じる）"""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # コンテキスト
+
+    def create_context(self, context_data: Dict, name: str = '', content_hash: Optional[str] = None) -> int:
+        """コンテキストを作成（content_hash を指定すると find_context で引けるよう記録する）"""
+        now = datetime.now().isoformat()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO contexts (name, data, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (name, self._dump_context(context_data), now, now)
+            )
+            context_id = cursor.lastrowid
+            self._replace_topics(conn, context_id, context_data.get('topic_list') or [])
+            if content_hash:
+                conn.execute(
+                    "INSERT OR REPLACE INTO context_sources (content_hash, context_id) VALUES (?, ?)",
+                    (content_hash, context_id)
+                )
+        return context_id
+
+    def find_context(self, content_hash: str) -> Optional[int]:
+        """取り込み元の内容ハッシュで作成済みのコンテキストを探す"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT context_id FROM context_sources WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row['context_id'] if row else None
+
+    def update_context(self, context_id: int, context_data: Dict, name: Optional[str] = None):
+        """コンテキストとトピックリストを更新"""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE contexts SET data = ?, name = COALESCE(?, name), updated_at = ? WHERE id = ?",
+                (self._dump_context(context_data), name, datetime.now().isoformat(), context_id)
+            )
+            self._replace_topics(conn, context_id, context_data.get('topic_list') or [])
+
+    def get_context(self, context_id: int) -> Optional[Dict]:
+        """コンテキスト（トピックリストを含む）"""
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM contexts WHERE id = ?", (context_id,)).fetchone()
+            if row is None:
+                return None
+            topics = [r['topic'] for r in conn.execute(
+                "SELECT topic FROM topics WHERE context_id = ? ORDER BY position", (context_id,)
+            )]
+        context_data = json.loads(row['data'])
+        context_data['topic_list'] = topics
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'context_data': context_data,
+            'updated_at': row['updated_at']
+        }
+
+    def list_contexts(self, limit: int = 50) -> List[Dict]:
+        """最近更新したコンテキストの一覧（教材数付き）"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT c.id, c.name, c.updated_at, "
+                "(SELECT COUNT(*) FROM materials m WHERE m.context_id = c.id) AS material_count "
+                "FROM contexts c ORDER BY c.updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _dump_context(self, context_data: Dict) -> str:
+        # トピックはtopicsテーブルに保存する
+        data = {k: v for k, v in context_data.items() if k != 'topic_list'}
+        return json.dumps(data, ensure_ascii=False)
+
+    def _replace_topics(self, conn: sqlite3.Connection, context_id: int, topics: List[str]):
+        conn.execute("DELETE FROM topics WHERE context_id = ?", (context_id,))
+        conn.executemany(
+            "INSERT INTO topics (context_id, position, topic) VALUES (?, ?, ?)",
+            [(context_id, i, topic) for i, topic in enumerate(topics)]
+        )
+
+    # 教材
+
+    def add_materials(self, materials: Iterable[Dict], context_id: Optional[int] = None) -> List[int]:
+        """教材を追加し、採番されたIDを返す"""
+        now = datetime.now().isoformat()
+        ids = []
+        with self._connection() as conn:
+            for material in materials:
+                cursor = conn.execute(
+                    "INSERT INTO materials (context_id, topic, type, data, content_hash, generated_at, "
+                    "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (context_id, material.get('topic', ''), material.get('type', ''),
+                     json.dumps(material, ensure_ascii=False), material_content_hash(material),
+                     material.get('generated_at'), now, now)
+                )
+                ids.append(cursor.lastrowid)
+                self._index_expressions(conn, cursor.lastrowid, material)
+                self._index_search(conn, cursor.lastrowid, material)
+        return ids
+
+    def update_material(self, material_id: int, material: Dict, source: str = '') -> Optional[int]:
+        """教材を更新し、変更前の版を履歴に残す（新しい版番号を返す。変更がなければ None）
+
+        source: 変更の種類（手動修復・重複自動修正・ロールバックなど）
+        """
+        with self._connection() as conn:
+            row = conn.execute("SELECT data FROM materials WHERE id = ?", (material_id,)).fetchone()
+            if row is None:
+                return None
+            previous = json.loads(row['data'])
+            if previous == material:
+                return None
+
+            version = self._current_version(conn, material_id)
+            delta = compute_delta(material, previous)
+            snapshot = row['data'] if version % VERSION_SNAPSHOT_INTERVAL == 0 else None
+            changed_fields = sorted({change['field'] for change in diff_materials(previous, material)})
+            conn.execute(
+                "INSERT INTO material_versions (material_id, version, delta, snapshot, source, changed_fields, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (material_id, version, json.dumps(delta, ensure_ascii=False), snapshot, source,
+                 json.dumps(changed_fields, ensure_ascii=False), datetime.now().isoformat())
+            )
+            conn.execute(
+                "UPDATE materials SET topic = ?, type = ?, data = ?, content_hash = ?, updated_at = ? "
+                "WHERE id = ?",
+                (material.get('topic', ''), material.get('type', ''), json.dumps(material, ensure_ascii=False),
+                 material_content_hash(material), datetime.now().isoformat(), material_id)
+            )
+            conn.execute("DELETE FROM expressions WHERE material_id = ?", (material_id,))
+            self._index_expressions(conn, material_id, material)
+            self._unindex_search(conn, material_id)
+            self._index_search(conn, material_id, material)
+        return version + 1
+
+    def delete_material(self, material_id: int):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+            self._unindex_search(conn, material_id)
+
+    def get_material(self, material_id: int) -> Optional[Dict]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT data FROM materials WHERE id = ?", (material_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def get_material_records(self, material_ids: List[int]) -> List[Tuple[int, Dict]]:
+        """指定したIDの教材を (ID, 教材) で返す（指定順）"""
+        if not material_ids:
+            return []
+        placeholders = ",".join("?" * len(material_ids))
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, data FROM materials WHERE id IN ({placeholders})", tuple(material_ids)
+            ).fetchall()
+        by_id = {row['id']: json.loads(row['data']) for row in rows}
+        return [(material_id, by_id[material_id]) for material_id in material_ids if material_id in by_id]
+
+    def get_materials(self, material_ids: List[int]) -> List[Dict]:
+        """指定したIDの教材（指定順）"""
+        return [material for _, material in self.get_material_records(material_ids)]
+
+    def existing_hashes(self, content_hashes: List[str]) -> Set[str]:
+        """リポジトリに既にある教材内容ハッシュ"""
+        found = set()
+        hashes = list(set(content_hashes))
+        # SQLiteのパラメータ数上限を超えないよう分割して問い合わせる
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT DISTINCT content_hash FROM materials WHERE content_hash IN ({placeholders})",
+                    tuple(chunk)
+                ).fetchall()
+            found.update(row['content_hash'] for row in rows)
+        return found
+
+    def count_materials(self, context_id: Optional[int] = None) -> int:
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM materials{where}", args).fetchone()[0]
+
+    def list_materials(self, context_id: Optional[int] = None, offset: int = 0,
+                       limit: int = DEFAULT_PAGE_SIZE) -> List[Tuple[int, Dict]]:
+        """1ページ分の教材を (ID, 教材) で返す（登録順）"""
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT id, data FROM materials{where} ORDER BY id LIMIT ? OFFSET ?",
+                args + (limit, offset)
+            ).fetchall()
+        return [(row['id'], json.loads(row['data'])) for row in rows]
+
+    def load_material_records(self, context_id: Optional[int] = None) -> List[Tuple[int, Dict]]:
+        """全教材を (ID, 教材) で返す（品質チェック・一括出力など全件が必要な処理用）"""
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT id, data FROM materials{where} ORDER BY id", args).fetchall()
+        return [(row['id'], json.loads(row['data'])) for row in rows]
+
+    def load_materials(self, context_id: Optional[int] = None) -> List[Dict]:
+        return [material for _, material in self.load_material_records(context_id)]
+
+    def iter_materials(self, context_id: Optional[int] = None, batch_size: int = 500) -> Iterator[Dict]:
+        """全教材を登録順に少しずつ読み込んで返す（書き出しなど全件を保持しなくてよい処理用）"""
+        where, args = self._context_filter(context_id)
+        where += " AND id > ?" if where else " WHERE id > ?"
+        last_id = 0
+        while True:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    f"SELECT id, data FROM materials{where} ORDER BY id LIMIT ?", args + (last_id, batch_size)
+                ).fetchall()
+            for row in rows:
+                yield json.loads(row['data'])
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def list_typed_materials(self, context_id: Optional[int] = None, offset: int = 0,
+                             limit: Optional[int] = DEFAULT_PAGE_SIZE) -> List[Material]:
+        """教材を型付きモデルで返す（見出しのみ読み込み、本文項目は参照時に読み込む。limit=None で全件）"""
+        where, args = self._context_filter(context_id)
+        sql = (f"SELECT id, type, topic, generated_at, "
+               f"(SELECT json_group_array(key) FROM json_each(materials.data)) AS keys "
+               f"FROM materials{where} ORDER BY id")
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            args += (limit, offset)
+        with self._connection() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        # 表示中の教材の同じ項目はまとめて読み込む（教材ごと・項目ごとに接続を開かない）
+        materials = []
+        for start in range(0, len(rows), DEFAULT_PAGE_SIZE):
+            page = rows[start:start + DEFAULT_PAGE_SIZE]
+            loader = PageFieldLoader(self, [row['id'] for row in page])
+            materials.extend(material_from_row(row['id'], row['type'], row['topic'], row['generated_at'],
+                                               row['keys'], loader)
+                             for row in page)
+        return materials
+
+    def get_typed_material(self, material_id: int) -> Optional[Material]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT id, type, topic, generated_at, "
+                "(SELECT json_group_array(key) FROM json_each(materials.data)) AS keys "
+                "FROM materials WHERE id = ?", (material_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return material_from_row(row['id'], row['type'], row['topic'], row['generated_at'], row['keys'],
+                                 self.load_material_field)
+
+    def load_material_field(self, material_id: int, field: str):
+        """教材の1項目だけを取り出す（JSON全体はPython側でデコードしない）"""
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT j.type, j.value FROM materials m, json_each(m.data) j WHERE m.id = ? AND j.key = ?",
+                (material_id, field)
+            ).fetchone()
+        if row is None:
+            return None
+        return _decode_field(row['type'], row['value'])
+
+    def load_material_fields(self, material_ids: List[int], field: str) -> Dict[int, object]:
+        """複数の教材の同じ項目を1回の問い合わせで取り出す（項目のない教材は含まない）"""
+        if not material_ids:
+            return {}
+        placeholders = ",".join("?" * len(material_ids))
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT m.id, j.type, j.value FROM materials m, json_each(m.data) j "
+                f"WHERE m.id IN ({placeholders}) AND j.key = ?",
+                tuple(material_ids) + (field,)
+            ).fetchall()
+        return {row['id']: _decode_field(row['type'], row['value']) for row in rows}
+
+    def material_titles(self, context_id: Optional[int] = None) -> List[Tuple[int, str]]:
+        """教材の (ID, トピック) 一覧（本文は読み込まない）"""
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT id, topic FROM materials{where} ORDER BY id", args).fetchall()
+        return [(row['id'], row['topic']) for row in rows]
+
+    def revision(self, context_id: Optional[int] = None) -> Tuple[int, Optional[str], int]:
+        """教材セットの変更検知用の値（件数・最終更新日時・最大ID）"""
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT COUNT(*), MAX(updated_at), COALESCE(MAX(id), 0) FROM materials{where}", args
+            ).fetchone()
+        return row[0], row[1], row[2]
+
+    def _context_filter(self, context_id: Optional[int]) -> Tuple[str, tuple]:
+        if context_id is None:
+            return "", ()
+        return " WHERE context_id = ?", (context_id,)
+
+    # 有用表現
+
+    def _index_expressions(self, conn: sqlite3.Connection, material_id: int, material: Dict):
+        conn.executemany(
+            "INSERT INTO expressions (material_id, position, expression, english) VALUES (?, ?, ?, ?)",
+            [(material_id, i, expr, extract_english_part(expr).lower())
+             for i, expr in enumerate(material.get('useful_expressions') or [])]
+        )
+
+    def used_expressions(self, context_id: Optional[int] = None) -> Set[str]:
+        """使用済み表現（英語部分・小文字）"""
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT e.english FROM expressions e JOIN materials m ON m.id = e.material_id"
+                + where.replace("context_id", "m.context_id"), args
+            ).fetchall()
+        return {row['english'] for row in rows}
+
+    def count_expressions(self, context_id: Optional[int] = None) -> int:
+        where, args = self._context_filter(context_id)
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM expressions e JOIN materials m ON m.id = e.material_id"
+                + where.replace("context_id", "m.context_id"), args
+            ).fetchone()[0]
+
+    # 版履歴
+
+    def _current_version(self, conn: sqlite3.Connection, material_id: int) -> int:
+        row = conn.execute(
+            "SELECT MAX(version) FROM material_versions WHERE material_id = ?", (material_id,)
+        ).fetchone()
+        return (row[0] or 0) + 1
+
+    def list_versions(self, material_id: int) -> List[Dict]:
+        """版の一覧（新しい順）: version・source（その版を作った変更）・changed_fields・created_at"""
+        with self._connection() as conn:
+            created = conn.execute("SELECT created_at FROM materials WHERE id = ?", (material_id,)).fetchone()
+            rows = conn.execute(
+                "SELECT version, source, changed_fields, created_at FROM material_versions "
+                "WHERE material_id = ? ORDER BY version DESC", (material_id,)
+            ).fetchall()
+        if created is None:
+            return []
+        # material_versions の版 v の行は「v から v+1 への変更」を表す
+        versions = [
+            {
+                'version': row['version'] + 1,
+                'source': row['source'],
+                'changed_fields': json.loads(row['changed_fields']),
+                'created_at': row['created_at']
+            }
+            for row in rows
+        ]
+        versions.append({'version': 1, 'source': '作成', 'changed_fields': [], 'created_at': created['created_at']})
+        return versions
+
+    def get_material_version(self, material_id: int, version: int) -> Optional[Dict]:
+        """指定した版の教材を復元（最寄りのスナップショットまたは最新版から差分を戻す）"""
+        with self._connection() as conn:
+            current = self._current_version(conn, material_id)
+            if version < 1 or version > current:
+                return None
+            row = conn.execute("SELECT data FROM materials WHERE id = ?", (material_id,)).fetchone()
+            if row is None:
+                return None
+            if version == current:
+                return json.loads(row['data'])
+
+            snapshot_row = conn.execute(
+                "SELECT version, snapshot FROM material_versions WHERE material_id = ? AND version >= ? "
+                "AND snapshot IS NOT NULL ORDER BY version LIMIT 1", (material_id, version)
+            ).fetchone()
+            if snapshot_row:
+                material, start = json.loads(snapshot_row['snapshot']), snapshot_row['version']
+            else:
+                material, start = json.loads(row['data']), current
+            deltas = conn.execute(
+                "SELECT delta FROM material_versions WHERE material_id = ? AND version >= ? AND version < ? "
+                "ORDER BY version DESC", (material_id, version, start)
+            ).fetchall()
+        for delta_row in deltas:
+            material = apply_delta(material, json.loads(delta_row['delta']))
+        return material
+
+    def diff_versions(self, material_id: int, old_version: int, new_version: int) -> List[Dict]:
+        old = self.get_material_version(material_id, old_version)
+        new = self.get_material_version(material_id, new_version)
+        if old is None or new is None:
+            return []
+        return diff_materials(old, new)
+
+    def rollback_material(self, material_id: int, version: int) -> Optional[int]:
+        """指定した版の内容に戻す（ロールバック自体も新しい版として記録）"""
+        material = self.get_material_version(material_id, version)
+        if material is None:
+            return None
+        return self.update_material(material_id, material, source=f"v{version}にロールバック")
+
+    # 全文検索
+
+    def _index_search(self, conn: sqlite3.Connection, material_id: int, material: Dict):
+        values = []
+        for fields in SEARCH_FIELDS.values():
+            parts = []
+            for field in fields:
+                value = material.get(field)
+                if isinstance(value, list):
+                    parts.extend(str(item) for item in value)
+                elif value:
+                    parts.append(str(value))
+            values.append('\n'.join(parts))
+        conn.execute(
+            f"INSERT INTO materials_fts (rowid, {', '.join(SEARCH_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            [material_id] + values
+        )
+        conn.execute(
+            "INSERT INTO materials_bigram (rowid, grams) VALUES (?, ?)",
+            (material_id, ' '.join(dict.fromkeys(to_bigrams('\n'.join(values)))))
+        )
+
+    def _unindex_search(self, conn: sqlite3.Connection, material_id: int):
+        conn.execute("DELETE FROM materials_fts WHERE rowid = ?", (material_id,))
+        conn.execute("DELETE FROM materials_bigram WHERE rowid = ?", (material_id,))
+
+    def _rebuild_search_index(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM materials_fts")
+        conn.execute("DELETE FROM materials_bigram")
+        for row in conn.execute("SELECT id, data FROM materials"):
+            self._index_search(conn, row['id'], json.loads(row['data']))
+
+    def search(self, query: str, context_id: Optional[int] = None, limit: int = 50) -> List[Dict]:
+        """トピック・対話文・表現・質問・ディスカッション欄を全文検索（空白区切りはAND）"""
+        terms = query.split()
+        if not terms:
+            return []
+
+        # 3文字以上の語はtrigram、2文字の語は2-gramインデックス、1文字の語は検索対象欄の部分一致で絞り込む
+        long_terms = [term for term in terms if len(term) >= SEARCH_MIN_TERM_LENGTH]
+        bigram_terms = [term.lower() for term in terms if len(term) == 2 and len(to_bigrams(term)) == 1]
+        other_terms = [term for term in terms if term not in long_terms and term.lower() not in bigram_terms]
+
+        joins, conditions, args = [], [], []
+        if long_terms:
+            joins.append("JOIN materials_fts f ON f.rowid = m.id")
+            conditions.append("materials_fts MATCH ?")
+            args.append(" AND ".join(self._fts_phrase(term) for term in long_terms))
+        if bigram_terms:
+            conditions.append("m.id IN (SELECT rowid FROM materials_bigram WHERE materials_bigram MATCH ?)")
+            args.append(" AND ".join(self._fts_phrase(term) for term in bigram_terms))
+        for term in other_terms:
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            # 教材JSONのキー名に一致しないよう、インデックスと同じ検索対象欄だけを見る
+            matches = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in SEARCH_FIELDS)
+            conditions.append(f"m.id IN (SELECT rowid FROM materials_fts WHERE {matches})")
+            args.extend([f"%{escaped}%"] * len(SEARCH_FIELDS))
+        if context_id is not None:
+            conditions.append("m.context_id = ?")
+            args.append(context_id)
+
+        if long_terms:
+            columns = "snippet(materials_fts, -1, '**', '**', '…', 16) AS snippet"
+            order = "f.rank"
+        else:
+            columns = "m.topic AS snippet"
+            order = "m.id DESC"
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT m.id, m.context_id, m.topic, m.type, {columns} FROM materials m {' '.join(joins)} "
+                f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?",
+                args + [limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _fts_phrase(self, term: str) -> str:
+        return '"' + term.replace('"', '""') + '"'
+
+    # 品質結果
+
+    def save_quality_scores(self, results: Iterable[Tuple[int, Dict, float, Dict]]):
+        """(教材ID, 教材, スコア, 指標) の品質結果を保存"""
+        now = datetime.now().isoformat()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO quality_results (material_id, content_hash, score, components, checked_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(material_id) DO UPDATE SET "
+                "content_hash = excluded.content_hash, score = excluded.score, "
+                "components = excluded.components, checked_at = excluded.checked_at",
+                [(material_id, material_content_hash(material), score, json.dumps(components), now)
+                 for material_id, material, score, components in results]
+            )
+
+    def quality_scores(self, material_ids: List[int]) -> Dict[int, float]:
+        """保存済みの品質スコア（教材が更新されていないもののみ）"""
+        if not material_ids:
+            return {}
+        placeholders = ",".join("?" * len(material_ids))
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT q.material_id, q.score FROM quality_results q JOIN materials m ON m.id = q.material_id "
+                f"WHERE q.material_id IN ({placeholders}) AND q.content_hash = m.content_hash",
+                tuple(material_ids)
+            ).fetchall()
+        return {row['material_id']: row['score'] for row in rows}
+
+    # Google Docs出力
+
+    def doc_exports(self, material_ids: List[int]) -> Dict[int, Dict]:
+        """教材IDごとの出力済みドキュメント {document_id, sections, end_index}"""
+        if not material_ids:
+            return {}
+        placeholders = ",".join("?" * len(material_ids))
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT material_id, document_id, sections, end_index FROM doc_exports "
+                f"WHERE material_id IN ({placeholders})",
+                tuple(material_ids)
+            ).fetchall()
+        return {
+            row['material_id']: {'document_id': row['document_id'], 'sections': json.loads(row['sections']),
+                                 'end_index': row['end_index']}
+            for row in rows
+        }
+
+    def save_doc_exports(self, exports: Dict[int, Dict]):
+        """出力済みドキュメントの記録を保存（教材IDごとに上書き）"""
+        now = datetime.now().isoformat()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO doc_exports (material_id, document_id, sections, end_index, exported_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(material_id) DO UPDATE SET "
+                "document_id = excluded.document_id, sections = excluded.sections, "
+                "end_index = excluded.end_index, exported_at = excluded.exported_at",
+                [(material_id, export['document_id'], json.dumps(export['sections'], ensure_ascii=False),
+                  export['end_index'], now)
+                 for material_id, export in exports.items()]
+            )
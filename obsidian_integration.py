@@ -5,15 +5,144 @@ Obsidian連携機能
 
 import os
 import json
+import queue
 import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import streamlit as st
+from quality_scoring import stable_hash
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import markdown
 import re
 
+# エクスポートの同時書き込み数（ネットワークドライブでは待ち時間を重ねられるよう多めにする）
+OBSIDIAN_WRITE_WORKERS = int(os.getenv('OBSIDIAN_WRITE_WORKERS', '8'))
+
+# 書き込んだファイルをディスクに確定させるか（0で無効。速いが停電時に内容が失われることがある）
+OBSIDIAN_FSYNC = os.getenv('OBSIDIAN_FSYNC', '1') != '0'
+
+# 差分同期の記録ファイル（クライアントフォルダごと。.で始まるためObsidianには表示されない）
+SYNC_MANIFEST_NAME = ".sync_manifest.json"
+
+# ファイル名に使えない文字
+UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\r\n\t]+')
+
+# ファイル監視: 最後の変更からこの秒数だけ変更がなければ処理する（Obsidianは入力のたびに自動保存する）
+OBSIDIAN_WATCH_DEBOUNCE = float(os.getenv('OBSIDIAN_WATCH_DEBOUNCE', '1.0'))
+
+# カウンセリングノートのフォルダ（監視してコンテキストを読み込む）
+COUNSELING_FOLDER = "01_カウンセリング"
+
+# コンテキストインデックス: バックグラウンドで再スキャンする間隔（秒）とキャッシュファイル（06_設定 に保存）
+OBSIDIAN_INDEX_INTERVAL = float(os.getenv('OBSIDIAN_INDEX_INTERVAL', '30'))
+CONTEXT_INDEX_NAME = ".context_index.json"
+CONTEXT_INDEX_VERSION = 1
+
+# フロントマターでクライアント名を表すキー
+CLIENT_KEYS = ('client', 'client_name', 'クライアント', 'クライアント名')
+
+# 日時付きエクスポートフォルダの末尾（クライアント名_YYYYMMDD_HHMMSS）
+EXPORT_TIMESTAMP_SUFFIX = re.compile(r'_\d{8}_\d{6}$')
+LIST_ITEM = re.compile(r'^\s*(?:[-*]|\d+\.)\s+(.+?)\s*$')
+
+# このアプリが書き込んだファイル -> 書き込み直後の (更新時刻, サイズ)。監視で自分の書き込みを無視するために使う
+_own_writes: Dict[str, Tuple[int, int]] = {}
+_own_writes_lock = threading.Lock()
+
+
+def record_own_write(path):
+    stat = os.stat(path)
+    with _own_writes_lock:
+        _own_writes[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size)
+
+
+def is_own_write(path) -> bool:
+    """ファイルがこのアプリの書き込み以降に変更されていないか"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    with _own_writes_lock:
+        return _own_writes.get(os.path.abspath(path)) == (stat.st_mtime_ns, stat.st_size)
+
+
+def safe_filename(name) -> str:
+    """ファイル名に使えない文字を _ に置き換える"""
+    return UNSAFE_FILENAME.sub('_', str(name)).strip() or 'Unknown'
+
+
+class VaultWriter:
+    """Obsidianフォルダへのまとめ書き
+    
+    各ファイルは同じフォルダの一時ファイル（.で始まる名前）に書いてから os.replace で置き換えるため、
+    Obsidianや同期プラグインから書きかけのファイルは見えない。内容の生成・書き込み・fsync はスレッドで
+    並列に行い、置き換えはすべての書き込みが終わってからまとめて行う（フォルダの fsync は最後に1回）
+    """
+    
+    def __init__(self, max_workers: int = OBSIDIAN_WRITE_WORKERS, fsync: bool = OBSIDIAN_FSYNC):
+        self.max_workers = max_workers
+        self.fsync = fsync
+    
+    def _write_temp(self, path: Path, content: Union[str, Callable[[], str]]) -> Tuple[Path, int]:
+        """一時ファイルに書き込み、(一時ファイル, バイト数) を返す"""
+        data = (content() if callable(content) else content).encode('utf-8')
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        return temp_path, len(data)
+    
+    def _sync_directory(self, folder: Path):
+        # ファイル名の置き換えを確定させる（フォルダを開けないWindowsでは行わない）
+        if not self.fsync or os.name == 'nt':
+            return
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def write_files(self, files: List[Tuple[Path, Union[str, Callable[[], str]]]]) -> Dict:
+        """(パス, 内容または内容を返す関数) のファイルをまとめて書き込み、書き込み量と速度を返す"""
+        started = time.perf_counter()
+        written = []
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(files)))) as pool:
+                futures = [(path, pool.submit(self._write_temp, path, content)) for path, content in files]
+                for path, future in futures:
+                    written.append((path,) + future.result())
+        except Exception:
+            for _, future in futures:
+                if future.done() and not future.exception():
+                    future.result()[0].unlink(missing_ok=True)
+            raise
+        
+        for path, temp_path, _ in written:
+            os.replace(temp_path, path)
+            record_own_write(path)
+        for folder in {path.parent for path, _, _ in written}:
+            self._sync_directory(folder)
+        
+        seconds = time.perf_counter() - started
+        total_bytes = sum(size for _, _, size in written)
+        return {
+            'files': len(written),
+            'bytes': total_bytes,
+            'seconds': seconds,
+            'files_per_second': len(written) / seconds if seconds else 0.0,
+            'mb_per_second': total_bytes / 1024 / 1024 / seconds if seconds else 0.0
+        }
+
 class ObsidianIntegration:
     """Obsidian連携クラス"""
     
@@ -37,57 +166,155 @@ class ObsidianIntegration:
             folder_path.mkdir(parents=True, exist_ok=True)
     
     def export_materials_to_obsidian(self, materials, client_name, topic_list=None):
-        """教材をObsidian形式でエクスポート"""
+        """教材をObsidian形式でエクスポート（マークダウン生成と書き込みは並列、各ファイルは一時ファイルから置き換え）"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        materials = list(materials)
         
         # クライアントフォルダ作成
-        client_folder = self.base_path / "05_生成教材" / f"{client_name}_{timestamp}"
+        client_folder = self.base_path / "05_生成教材" / f"{safe_filename(client_name)}_{timestamp}"
         client_folder.mkdir(parents=True, exist_ok=True)
         
+        files = []
         exported_files = []
         
-        # 教材ファイルのエクスポート
+        # 教材ファイル（マークダウンとJSON）
         for i, material in enumerate(materials):
-            # マークダウンファイル生成
-            md_content = self.generate_material_markdown(material, i+1)
-            md_filename = f"教材{i+1:02d}_{material.get('topic', 'Unknown')}.md"
-            md_path = client_folder / md_filename
-            
-            with open(md_path, 'w', encoding='utf-8') as f:
-                f.write(md_content)
-            
-            # JSONファイルも同時生成
-            json_filename = f"教材{i+1:02d}_{material.get('topic', 'Unknown')}.json"
-            json_path = client_folder / json_filename
-            
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(material, f, ensure_ascii=False, indent=2)
-            
+            topic = material.get('topic', 'Unknown')
+            md_path = client_folder / f"教材{i+1:02d}_{safe_filename(topic)}.md"
+            json_path = client_folder / f"教材{i+1:02d}_{safe_filename(topic)}.json"
+            files.append((md_path, partial(self.generate_material_markdown, material, i+1)))
+            files.append((json_path, partial(json.dumps, material, ensure_ascii=False, indent=2)))
             exported_files.append({
                 'markdown': str(md_path),
                 'json': str(json_path),
-                'topic': material.get('topic', 'Unknown')
+                'topic': topic
             })
         
-        # サマリーファイル生成
-        summary_content = self.generate_summary_markdown(materials, client_name, timestamp)
+        # サマリーファイル
         summary_path = client_folder / "README.md"
-        
-        with open(summary_path, 'w', encoding='utf-8') as f:
-            f.write(summary_content)
+        files.append((summary_path, partial(self.generate_summary_markdown, materials, client_name, timestamp)))
         
         # トピックリストも保存
         if topic_list:
-            topics_content = self.generate_topics_markdown(topic_list, client_name)
-            topics_path = client_folder / "トピックリスト.md"
-            
-            with open(topics_path, 'w', encoding='utf-8') as f:
-                f.write(topics_content)
+            files.append((client_folder / "トピックリスト.md",
+                          partial(self.generate_topics_markdown, topic_list, client_name)))
+        
+        stats = VaultWriter().write_files(files)
         
         return {
             'folder': str(client_folder),
             'files': exported_files,
-            'summary': str(summary_path)
+            'summary': str(summary_path),
+            'stats': stats
+        }
+    
+    def load_sync_manifest(self, client_folder: Path) -> Dict:
+        """差分同期の記録（教材ID -> 番号・パス・ハッシュ、サマリー類のハッシュ）"""
+        try:
+            with open(client_folder / SYNC_MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            manifest = {}
+        manifest.setdefault('next_number', 1)
+        manifest.setdefault('materials', {})
+        manifest.setdefault('files', {})
+        return manifest
+    
+    def sync_materials_to_obsidian(self, records, client_name, topic_list=None):
+        """教材をクライアントフォルダに差分同期（records: (教材ID, 教材) のリスト）
+        
+        フォルダは「05_生成教材/クライアント名」に固定し、前回から追加・変更された教材のファイルだけを書き込む。
+        教材の番号は初回同期時に決めて以降は変えないため、教材の削除で他のファイル名はずれない。
+        削除された教材のファイルと、トピック変更で名前が変わった古いファイルは削除する
+        """
+        client_folder = self.base_path / "05_生成教材" / safe_filename(client_name)
+        client_folder.mkdir(parents=True, exist_ok=True)
+        manifest = self.load_sync_manifest(client_folder)
+        previous = manifest['materials']
+        # 手で削除されたファイルは書き直すため、フォルダの一覧を1回だけ取得する
+        existing_names = {entry.name for entry in os.scandir(client_folder)}
+        
+        files = []
+        changed_files = []
+        entries = {}
+        stale_paths = []
+        unchanged = 0
+        for material_id, material in records:
+            entry = previous.get(str(material_id))
+            number = entry['number'] if entry else manifest['next_number']
+            if not entry:
+                manifest['next_number'] += 1
+            topic = material.get('topic', 'Unknown')
+            base_name = f"教材{number:02d}_{safe_filename(topic)}"
+            new_entry = {
+                'number': number,
+                'markdown': f"{base_name}.md",
+                'json': f"{base_name}.json",
+                'hash': stable_hash(material)
+            }
+            entries[str(material_id)] = new_entry
+            
+            if (entry == new_entry and new_entry['markdown'] in existing_names
+                    and new_entry['json'] in existing_names):
+                unchanged += 1
+                continue
+            files.append((client_folder / new_entry['markdown'],
+                          partial(self.generate_material_markdown, material, number)))
+            files.append((client_folder / new_entry['json'],
+                          partial(json.dumps, material, ensure_ascii=False, indent=2)))
+            changed_files.append({
+                'markdown': str(client_folder / new_entry['markdown']),
+                'json': str(client_folder / new_entry['json']),
+                'topic': topic
+            })
+            if entry:
+                stale_paths.extend(client_folder / entry[kind] for kind in ('markdown', 'json')
+                                   if entry[kind] != new_entry[kind])
+        
+        removed = [material_id for material_id in previous if material_id not in entries]
+        for material_id in removed:
+            stale_paths.extend(client_folder / previous[material_id][kind] for kind in ('markdown', 'json'))
+        
+        # サマリー・トピックリストは内容の元になる情報が変わったときだけ書き直す（生成日時は比較しない）
+        ordered = sorted(records, key=lambda record: entries[str(record[0])]['number'])
+        summary_hash = stable_hash([
+            client_name,
+            [(entries[str(material_id)]['number'], material.get('topic'), material.get('type'),
+              len(material.get('useful_expressions', [])), material.get('quality_score'))
+             for material_id, material in ordered]
+        ])
+        if records and (manifest['files'].get('README.md') != summary_hash or 'README.md' not in existing_names):
+            files.append((client_folder / "README.md", partial(
+                self.generate_summary_markdown, [material for _, material in ordered], client_name,
+                datetime.now().strftime("%Y%m%d_%H%M%S"),
+                [entries[str(material_id)]['number'] for material_id, _ in ordered]
+            )))
+        topics_hash = stable_hash([client_name, topic_list or []])
+        if topic_list and (manifest['files'].get('トピックリスト.md') != topics_hash
+                           or 'トピックリスト.md' not in existing_names):
+            files.append((client_folder / "トピックリスト.md",
+                          partial(self.generate_topics_markdown, topic_list, client_name)))
+        
+        manifest['materials'] = entries
+        manifest['files'] = {'README.md': summary_hash}
+        if topic_list:
+            manifest['files']['トピックリスト.md'] = topics_hash
+        # 記録はノートと同じまとめ書きに含め、ノートの書き込みに失敗したときは更新しない
+        if files or stale_paths:
+            files.append((client_folder / SYNC_MANIFEST_NAME,
+                          json.dumps(manifest, ensure_ascii=False, indent=2)))
+        stats = VaultWriter().write_files(files)
+        
+        for path in stale_paths:
+            path.unlink(missing_ok=True)
+        
+        return {
+            'folder': str(client_folder),
+            'files': changed_files,
+            'unchanged': unchanged,
+            'deleted': len(removed),
+            'stale_files': [str(path) for path in stale_paths],
+            'stats': stats
         }
     
     def generate_material_markdown(self, material, index):
@@ -196,8 +423,8 @@ class ObsidianIntegration:
         
         return md_content
     
-    def generate_summary_markdown(self, materials, client_name, timestamp):
-        """サマリーファイルを生成"""
+    def generate_summary_markdown(self, materials, client_name, timestamp, numbers=None):
+        """サマリーファイルを生成（numbers: 教材の番号。省略時は1からの連番）"""
         content = f"""# 📚 教材セット: {client_name}
 
 ## 📋 概要
@@ -212,7 +439,8 @@ class ObsidianIntegration:
         for i, material in enumerate(materials):
             topic = material.get('topic', 'Unknown')
             material_type = material.get('type', 'Unknown')
-            content += f"- **教材{i+1:02d}**: {topic} ({material_type})\n"
+            number = numbers[i] if numbers else i + 1
+            content += f"- **教材{number:02d}**: {topic} ({material_type})\n"
         
         content += f"""
 
@@ -326,27 +554,404 @@ class ObsidianIntegration:
         return items
 
 class ObsidianFileHandler(FileSystemEventHandler):
-    """Obsidianファイル変更監視ハンドラー"""
+    """Obsidianファイル変更監視ハンドラー
     
-    def __init__(self, callback_function):
+    同じファイルへの連続した変更はまとめ、最後の変更から debounce 秒たったときに1回だけ callback を呼ぶ。
+    このアプリが書き込んだままのファイルと、.で始まるファイル（一時ファイル・同期の記録）は無視する
+    """
+    
+    def __init__(self, callback_function, debounce: float = OBSIDIAN_WATCH_DEBOUNCE):
         self.callback = callback_function
+        self.debounce = debounce
+        self.pending: Dict[str, float] = {}  # パス -> 最後の変更時刻
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+    
+    def _queue(self, path):
+        if not path.endswith('.md') or os.path.basename(path).startswith('.'):
+            return
+        with self.lock:
+            self.pending[path] = time.monotonic()
+        self.wakeup.set()
     
     def on_modified(self, event):
         if event.is_directory:
             return
         
-        if event.src_path.endswith('.md'):
-            # マークダウンファイルの変更を検知
-            self.callback(event.src_path)
+        # マークダウンファイルの変更を検知
+        self._queue(event.src_path)
+    
+    def on_created(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path)
+    
+    def on_moved(self, event):
+        # 一時ファイルから置き換える保存方法では移動先が変更されたファイルになる
+        if not event.is_directory:
+            self._queue(event.dest_path)
+    
+    def _flush_loop(self):
+        while not self.stopped:
+            with self.lock:
+                timeout = None
+                if self.pending:
+                    timeout = max(0.0, min(self.pending.values()) + self.debounce - time.monotonic())
+            self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            
+            now = time.monotonic()
+            with self.lock:
+                ready = [path for path, changed in self.pending.items() if now - changed >= self.debounce]
+                for path in ready:
+                    del self.pending[path]
+            for path in ready:
+                if self.stopped or is_own_write(path):
+                    continue
+                try:
+                    self.callback(path)
+                except Exception as e:
+                    print(f"ファイル変更の処理エラー（{path}）: {e}")
+    
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
 
-def start_obsidian_watcher(obsidian_path, callback_function):
+def start_obsidian_watcher(obsidian_path, callback_function, debounce=OBSIDIAN_WATCH_DEBOUNCE):
     """Obsidianフォルダの監視を開始"""
-    event_handler = ObsidianFileHandler(callback_function)
+    event_handler = ObsidianFileHandler(callback_function, debounce)
     observer = Observer()
     observer.schedule(event_handler, obsidian_path, recursive=True)
     observer.start()
     return observer
 
+class CounselingContextWatcher:
+    """カウンセリングノートを監視し、変更されたファイルだけを解析してキューに積む
+    
+    監視スレッドからは Streamlit を操作できないため、解析結果はキューに積み、
+    画面の再実行時に drain で取り出してセッションに反映する
+    """
+    
+    def __init__(self, integration, debounce: float = OBSIDIAN_WATCH_DEBOUNCE):
+        self.integration = integration
+        self.folder = integration.base_path / COUNSELING_FOLDER
+        self.changes = queue.Queue()
+        self.hashes: Dict[str, str] = {}  # パス -> 前回解析した内容のハッシュ
+        self.handler = ObsidianFileHandler(self._on_change, debounce)
+        self.observer = Observer()
+        self.observer.schedule(self.handler, str(self.folder), recursive=True)
+        self.observer.start()
+    
+    def _on_change(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError:
+            return
+        # 保存されても内容が同じなら解析しない
+        digest = stable_hash(content)
+        if self.hashes.get(path) == digest:
+            return
+        self.hashes[path] = digest
+        self.changes.put((path, self.integration.parse_markdown_context(content)))
+    
+    def drain(self) -> Dict[str, Dict]:
+        """溜まった変更を取り出す（同じファイルは最新の解析結果のみ）"""
+        changes = {}
+        while True:
+            try:
+                path, context_data = self.changes.get_nowait()
+            except queue.Empty:
+                return changes
+            changes[path] = context_data
+    
+    def stop(self):
+        self.observer.stop()
+        self.handler.stop()
+
+def parse_front_matter(content):
+    """先頭の --- で囲まれたフロントマターを (辞書, 本文) に分ける（key: value・リストのみ対応）"""
+    if not content.startswith('---'):
+        return {}, content
+    end = content.find('\n---', 3)
+    if end == -1:
+        return {}, content
+    data = {}
+    key = None
+    for line in content[3:end].splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if stripped.startswith('- ') and key:
+            if not isinstance(data.get(key), list):
+                data[key] = []
+            data[key].append(stripped[2:].strip().strip('"\''))
+        elif ':' in stripped:
+            key, value = stripped.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+            if value.startswith('[') and value.endswith(']'):
+                data[key] = [item.strip().strip('"\'') for item in value[1:-1].split(',') if item.strip()]
+            else:
+                data[key] = value.strip('"\'')
+    body = content[end + 4:]
+    return data, body[body.find('\n') + 1:] if '\n' in body else ''
+
+class VaultIndex:
+    """Obsidianフォルダ全体のノートの索引（カウンセリング・トピックリスト・生成教材）
+    
+    ノートはフロントマターと見出し・セクションを1度だけ解析し、更新時刻とサイズが変わるまで再利用する。
+    索引は 06_設定/.context_index.json に保存するため、再起動後も変更されたノートだけを解析すればよい。
+    スキャンはバックグラウンドのスレッドで行い、検索はメモリ上の索引だけで行う
+    """
+    
+    def __init__(self, integration):
+        self.integration = integration
+        self.base_path = integration.base_path
+        self.cache_path = self.base_path / "06_設定" / CONTEXT_INDEX_NAME
+        self.entries: Dict[str, Dict] = {}  # 相対パス -> 項目
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.last_refresh: Optional[float] = None
+        self.last_stats: Dict = {}
+        self.thread: Optional[threading.Thread] = None
+        self._load_cache()
+    
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if cache.get('version') == CONTEXT_INDEX_VERSION:
+            self.entries = cache.get('entries', {})
+    
+    def _index_note(self, relative: str, content: str) -> Dict:
+        """ノート1件の索引項目"""
+        parts = Path(relative).parts
+        folder = parts[0] if len(parts) > 1 else ''
+        front_matter, body = parse_front_matter(content)
+        title_match = re.search(r'^#\s+(.+)$', body, re.MULTILINE)
+        title = title_match.group(1).strip() if title_match else Path(relative).stem
+        
+        client = next((str(front_matter[key]) for key in CLIENT_KEYS if front_matter.get(key)), '')
+        if not client:
+            if folder == "05_生成教材" and len(parts) > 2:
+                client = EXPORT_TIMESTAMP_SUFFIX.sub('', parts[1])
+            elif len(parts) > 2:
+                # 「01_カウンセリング/クライアント名/メモ.md」のようにクライアントごとのフォルダに分けている場合
+                client = parts[1]
+            else:
+                client = Path(relative).stem
+        
+        entry = {'kind': 'note', 'title': title, 'client': client, 'front_matter': front_matter}
+        if folder == COUNSELING_FOLDER:
+            entry['kind'] = 'counseling'
+            entry['context'] = self.integration.parse_markdown_context(body)
+        elif folder == "04_トピックリスト" or Path(relative).name == "トピックリスト.md":
+            entry['kind'] = 'topics'
+            entry['topics'] = self._topic_items(body)
+        elif folder == "05_生成教材" and Path(relative).name.startswith("教材"):
+            entry['kind'] = 'material'
+            type_match = re.search(r'\*\*タイプ\*\*:\s*(.+)', body)
+            entry['type'] = type_match.group(1).strip() if type_match else ''
+        
+        context = entry.get('context', {})
+        searchable = [client, title, relative, context.get('counseling_memo', ''),
+                      context.get('business_scenes', '')]
+        searchable += [str(value) for value in front_matter.values()]
+        searchable += context.get('topic_list', []) + entry.get('topics', [])
+        entry['search_text'] = "\n".join(searchable).lower()
+        return entry
+    
+    def _topic_items(self, body: str) -> List[str]:
+        """トピックリストの項目（「トピック」を含む見出しがあればその下の項目のみ）"""
+        items = {}
+        heading = ''
+        for line in body.splitlines():
+            if line.startswith('#'):
+                heading = line
+                continue
+            match = LIST_ITEM.match(line)
+            if match:
+                items.setdefault('トピック' in heading, []).append(match.group(1))
+        return items.get(True) or items.get(False, [])
+    
+    def refresh(self) -> Dict:
+        """フォルダを走査し、追加・変更されたノートだけを解析する"""
+        with self.refresh_lock:
+            started = time.perf_counter()
+            with self.lock:
+                previous = dict(self.entries)
+            entries = {}
+            parsed = 0
+            for root, dirs, names in os.walk(self.base_path):
+                # .obsidian などの隠しフォルダは対象外
+                dirs[:] = [name for name in dirs if not name.startswith('.')]
+                for name in names:
+                    if not name.endswith('.md') or name.startswith('.'):
+                        continue
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, self.base_path)
+                    try:
+                        stat = os.stat(path)
+                        entry = previous.get(relative)
+                        if not entry or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                            with open(path, 'r', encoding='utf-8') as f:
+                                entry = self._index_note(relative, f.read())
+                            entry.update(path=relative, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                            parsed += 1
+                    except (OSError, UnicodeDecodeError):
+                        continue
+                    entries[relative] = entry
+            
+            removed = len(set(previous) - set(entries))
+            with self.lock:
+                self.entries = entries
+            if parsed or removed:
+                self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+                VaultWriter(fsync=False).write_files([(self.cache_path, partial(
+                    json.dumps, {'version': CONTEXT_INDEX_VERSION, 'entries': entries}, ensure_ascii=False
+                ))])
+            self.last_refresh = time.time()
+            self.last_stats = {'files': len(entries), 'parsed': parsed, 'removed': removed,
+                               'seconds': time.perf_counter() - started}
+            return self.last_stats
+    
+    def start(self, interval: float = OBSIDIAN_INDEX_INTERVAL):
+        """バックグラウンドで索引を作成し、interval 秒ごとに再スキャンする"""
+        if self.thread is not None:
+            return
+        
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"コンテキストインデックス作成エラー: {e}")
+                time.sleep(interval)
+        
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+    
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """語をすべて含むノート（クライアント名に一致するもの・新しいものを先に）"""
+        terms = query.lower().split()
+        with self.lock:
+            entries = list(self.entries.values())
+        matches = [entry for entry in entries if all(term in entry['search_text'] for term in terms)]
+        matches.sort(key=lambda entry: (not any(term in entry['client'].lower() for term in terms),
+                                        -entry['mtime_ns']))
+        return matches[:limit]
+    
+    def client_notes(self, client: str) -> Dict[str, List[Dict]]:
+        """クライアントのノートを種類ごとに新しい順で返す"""
+        notes = {'counseling': [], 'topics': [], 'material': [], 'note': []}
+        with self.lock:
+            entries = [entry for entry in self.entries.values() if entry['client'] == client]
+        for entry in sorted(entries, key=lambda entry: -entry['mtime_ns']):
+            notes[entry['kind']].append(entry)
+        return notes
+
+_vault_indexes: Dict[str, VaultIndex] = {}
+_vault_indexes_lock = threading.Lock()
+
+def get_vault_index(integration) -> VaultIndex:
+    """Obsidianフォルダごとに1つの索引をプロセス内で共有し、初回にバックグラウンドのスキャンを開始"""
+    key = str(integration.base_path)
+    with _vault_indexes_lock:
+        if key not in _vault_indexes:
+            _vault_indexes[key] = VaultIndex(integration)
+            _vault_indexes[key].start()
+        return _vault_indexes[key]
+
+def show_client_search(integration):
+    """クライアントのカウンセリングノート・トピック・過去の教材を索引から検索して読み込む"""
+    st.subheader("🔎 クライアント検索")
+    index = get_vault_index(integration)
+    
+    col_query, col_refresh = st.columns([3, 1])
+    with col_query:
+        query = st.text_input("クライアント名・キーワード", key="vault_search_query",
+                              placeholder="例: 田中商事 融資")
+    with col_refresh:
+        if st.button("🔄 再スキャン", key="vault_index_refresh"):
+            index.refresh()
+    
+    stats = index.last_stats
+    if index.last_refresh is None:
+        st.caption(f"⏳ 索引を作成中...（キャッシュ済み {len(index.entries)}件）")
+    else:
+        st.caption(f"📇 {stats['files']}件のノートを索引済み（前回のスキャンで{stats['parsed']}件を解析・"
+                   f"{stats['seconds']:.2f}秒）")
+    
+    if not query.strip():
+        return
+    results = index.search(query)
+    if not results:
+        st.info("該当するノートがありません")
+        return
+    
+    clients = list(dict.fromkeys(entry['client'] for entry in results))
+    client = st.selectbox("クライアント", clients, key="vault_search_client")
+    notes = index.client_notes(client)
+    
+    for i, entry in enumerate(notes['counseling']):
+        col_name, col_load = st.columns([3, 1])
+        with col_name:
+            st.write(f"📝 {entry['title']}")
+            st.caption(entry['path'])
+        with col_load:
+            if st.button("📖 読み込む", key=f"vault_load_context_{i}"):
+                merge_context_data(st.session_state.context_data, entry['context'])
+                # ファイル監視中はこのノートの変更を自動で反映する
+                st.session_state.obsidian_context_path = str(integration.base_path / entry['path'])
+                st.success(f"✅ {entry['title']} をコンテキストに読み込みました")
+    
+    for i, entry in enumerate(notes['topics']):
+        col_name, col_load = st.columns([3, 1])
+        with col_name:
+            st.write(f"📋 {entry['title']}（{len(entry['topics'])}件）")
+            st.caption(entry['path'])
+        with col_load:
+            if entry['topics'] and st.button("📥 トピック読込", key=f"vault_load_topics_{i}"):
+                st.session_state.context_data['topic_list'] = list(entry['topics'])
+                st.success(f"✅ {len(entry['topics'])}件のトピックを読み込みました")
+    
+    if notes['material']:
+        with st.expander(f"📚 過去の教材（{len(notes['material'])}件）"):
+            for entry in notes['material']:
+                st.write(f"• {entry['title']}（{entry.get('type') or '教材'}）")
+                st.caption(entry['path'])
+
+def merge_context_data(context_data, note_context):
+    """ノートから解析したコンテキストを反映（ノートにない・空の項目は既存の値を残す）"""
+    for key, value in note_context.items():
+        if value not in ('', [], {}, None):
+            context_data[key] = value
+
+def apply_context_changes():
+    """監視で検知したカウンセリングノートの変更をセッションに反映し、変更があったかを返す
+    
+    画面の描画前（main の先頭と定期実行のフラグメント）で呼ぶ。
+    読み込み元のノート（obsidian_context_path。変更一覧の「反映」で設定される）の変更は
+    コンテキストに即反映し、それ以外のノートは変更一覧に入れて選択したときに反映する
+    """
+    watcher: Optional[CounselingContextWatcher] = st.session_state.get('context_watcher')
+    if watcher is None:
+        return False
+    changes = watcher.drain()
+    changed = st.session_state.setdefault('obsidian_changed_files', {})
+    for path, context_data in changes.items():
+        if path == st.session_state.get('obsidian_context_path'):
+            merge_context_data(st.session_state.context_data, context_data)
+            # 定期実行から画面全体を再実行しても消えないようトーストで通知する
+            st.toast(f"🔄 {Path(path).name} の変更をコンテキストに反映しました")
+        else:
+            changed[path] = context_data
+    return bool(changes)
+
 # Streamlit UI用関数
 def show_obsidian_integration():
     """Obsidian連携タブのUI"""
@@ -377,18 +982,30 @@ def show_obsidian_integration():
             else:
                 st.warning("⚠️ フォルダが空です")
         
-        # ファイル監視
+        # ファイル監視（カウンセリングノートの変更を検知）
         if st.button("🔍 ファイル監視開始"):
-            if 'observer' not in st.session_state:
-                def file_changed(file_path):
-                    st.info(f"📝 ファイル変更検知: {file_path}")
-                
-                st.session_state.observer = start_obsidian_watcher(
-                    str(base_path), file_changed
-                )
-                st.success("✅ ファイル監視を開始しました")
+            if 'context_watcher' not in st.session_state:
+                st.session_state.context_watcher = CounselingContextWatcher(st.session_state.obsidian_integration)
+                st.success(f"✅ {COUNSELING_FOLDER} の監視を開始しました")
             else:
                 st.info("✅ 既に監視中です")
+        
+        if 'context_watcher' in st.session_state:
+            followed = st.session_state.get('obsidian_context_path')
+            if followed:
+                st.caption(f"📌 読み込み元: {Path(followed).name}（変更は自動で反映されます）")
+            st.button("🔄 変更を確認", key="check_context_changes")
+            changed = st.session_state.get('obsidian_changed_files', {})
+            for i, (path, context_data) in enumerate(list(changed.items())):
+                col_name, col_apply = st.columns([3, 1])
+                with col_name:
+                    st.write(f"📝 {Path(path).name}")
+                with col_apply:
+                    if st.button("反映", key=f"apply_context_change_{i}"):
+                        merge_context_data(st.session_state.context_data, context_data)
+                        st.session_state.obsidian_context_path = path
+                        del changed[path]
+                        st.success(f"✅ {Path(path).name} をコンテキストに反映しました")
     
     with col2:
         st.subheader("📤 エクスポート")
@@ -396,28 +1013,54 @@ def show_obsidian_integration():
         # クライアント名入力
         client_name = st.text_input("クライアント名", placeholder="例: 田中商事_山田様")
         
+        # 差分同期: 同じクライアントフォルダを更新し、変更のある教材だけ書き込む
+        sync_mode = st.checkbox(
+            "🔄 差分同期（クライアントフォルダを更新）", value=True, key="obsidian_sync_mode",
+            help="オフにすると、エクスポートのたびに日時付きの新しいフォルダへ全教材を書き出します"
+        )
+        
         # エクスポート実行
         if st.button("📥 Obsidianにエクスポート") and client_name:
-            if st.session_state.generated_materials:
+            records = []
+            if st.session_state.get('context_id') is not None and 'material_store' in st.session_state:
+                records = st.session_state.material_store.load_material_records(st.session_state.context_id)
+            if records:
+                integration = st.session_state.obsidian_integration
+                topic_list = st.session_state.context_data.get('topic_list', [])
                 with st.spinner("Obsidianにエクスポート中..."):
-                    result = st.session_state.obsidian_integration.export_materials_to_obsidian(
-                        st.session_state.generated_materials,
-                        client_name,
-                        st.session_state.context_data.get('topic_list', [])
-                    )
+                    if sync_mode:
+                        result = integration.sync_materials_to_obsidian(records, client_name, topic_list)
+                    else:
+                        result = integration.export_materials_to_obsidian(
+                            [material for _, material in records], client_name, topic_list
+                        )
                 
-                st.success(f"✅ {len(result['files'])}件の教材をエクスポートしました")
+                stats = result['stats']
+                if sync_mode:
+                    st.success(
+                        f"✅ 同期しました（更新 {len(result['files'])}件・変更なし {result['unchanged']}件・"
+                        f"削除 {result['deleted']}件）"
+                    )
+                else:
+                    st.success(f"✅ {len(result['files'])}件の教材をエクスポートしました")
                 st.info(f"📁 保存先: {result['folder']}")
+                st.caption(
+                    f"⏱️ {stats['files']}ファイル・{stats['bytes'] / 1024:.0f}KB を{stats['seconds']:.2f}秒で書き込み"
+                    f"（{stats['files_per_second']:.0f}ファイル/秒・{stats['mb_per_second']:.1f}MB/秒）"
+                )
                 
                 # ファイル一覧表示
-                with st.expander("📋 エクスポートされたファイル"):
-                    for file_info in result['files']:
-                        st.write(f"• {file_info['topic']}")
-                        st.write(f"  - マークダウン: {file_info['markdown']}")
-                        st.write(f"  - JSON: {file_info['json']}")
+                if result['files']:
+                    with st.expander("📋 エクスポートされたファイル"):
+                        for file_info in result['files']:
+                            st.write(f"• {file_info['topic']}")
+                            st.write(f"  - マークダウン: {file_info['markdown']}")
+                            st.write(f"  - JSON: {file_info['json']}")
             else:
                 st.warning("⚠️ エクスポートする教材がありません")
         
+        show_client_search(st.session_state.obsidian_integration)
+        
         # インポート機能
         st.subheader("📥 インポート")
         uploaded_file = st.file_uploader("Obsidianファイルをアップロード", type=['md'])
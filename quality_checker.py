@@ -0,0 +1,380 @@
+"""
+インクリメンタル品質チェック
+教材ごとのチェック結果と教材横断の重複インデックスを保持し、変更された教材のみを再評価する
+
+チェックは register_check で登録したパイプラインとして並列に実行し、完了したチェックから順に結果を返す。
+AI審査（judge）は既定では実行されず、明示的に指定した場合のみ実行する。
+
+コマンドライン（夜間QA用）:
+    python quality_checker.py materials.json --memo-file counseling.md --output report.json
+    python quality_checker.py materials.json --checks context,level,duplicate,judge
+"""
+
+import argparse
+import json
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from quality_scoring import (
+    extract_keywords,
+    material_content_hash,
+    normalize_expression,
+    score_context_relevance,
+    score_level_fit,
+    stable_hash,
+    summarize_quality
+)
+from quality_judge import judge_materials_check
+
+# 登録済みチェック: 名前 -> 設定
+QUALITY_CHECKS: Dict[str, Dict] = {}
+
+
+def register_check(name: str, label: str, scope: str = 'material', default: bool = True):
+    """品質チェックを登録するデコレーター
+
+    scope='material': func(material, context_data) -> List[str]（教材単体で判定）
+    scope='batch': func(materials, context_data) -> List[Optional[List[str]]]
+                   （教材単体の判定をまとめて実行。None は判定失敗として次回再実行）
+    scope='collection': func(checker, materials) -> List[str]（教材横断で判定）
+    default=False のチェックは明示的に指定した場合のみ実行する
+    """
+    def decorator(func: Callable) -> Callable:
+        QUALITY_CHECKS[name] = {
+            'name': name,
+            'label': label,
+            'scope': scope,
+            'default': default,
+            'func': func
+        }
+        return func
+    return decorator
+
+
+@lru_cache(maxsize=32)
+def _keywords_for(counseling_memo: str) -> Tuple[str, ...]:
+    return tuple(extract_keywords(counseling_memo))
+
+
+@register_check('context', 'コンテキスト準拠チェック')
+def check_material_context(material: Dict, context_data: Dict) -> List[str]:
+    """教材単体のコンテキスト準拠チェック"""
+    keywords = list(_keywords_for(context_data.get('counseling_memo', '')))
+    relevance = score_context_relevance(material, keywords)
+    if relevance is not None and relevance < 1.0:
+        return ["コンテキストとの関連性が低い可能性"]
+    return []
+
+
+@register_check('level', 'レベル調整チェック')
+def check_material_level(material: Dict, context_data: Dict) -> List[str]:
+    """教材単体のレベル調整チェック"""
+    level_fit = score_level_fit(material)
+    if level_fit is not None and level_fit < 1.0:
+        return ["語彙レベルが目標より高い可能性"]
+    return []
+
+
+@register_check('duplicate', '重複チェック', scope='collection')
+def check_collection_duplicates(checker: 'IncrementalQualityChecker', materials: List[Dict]) -> List[str]:
+    """教材横断の重複チェック"""
+    return checker.duplicate_issues()
+
+
+register_check('judge', 'AI審査（Claude）', scope='batch', default=False)(judge_materials_check)
+
+
+def default_check_names() -> List[str]:
+    """既定で実行するチェック名"""
+    return [name for name, check in QUALITY_CHECKS.items() if check['default']]
+
+
+class IncrementalQualityChecker:
+    """変更された教材のみを再評価する品質チェッカー"""
+
+    def __init__(self):
+        # 教材スロット（リスト上の位置）ごとの内容ハッシュ
+        self.material_hashes: List[str] = []
+        # 教材スロットごとの表現キー（正規化済み）
+        self.material_expressions: List[List[str]] = []
+        # 表現キー -> {教材インデックス: [(表現インデックス, 元の表現)]}
+        self.expression_index: Dict[str, Dict[int, List[Tuple[int, str]]]] = {}
+        # 表現キー -> 出現回数
+        self.expression_counts: Dict[str, int] = {}
+        # 2回以上出現している表現キー
+        self.duplicate_keys: Set[str] = set()
+        # (内容ハッシュ, コンテキストキー) -> {チェック名: 問題一覧}
+        self.results: Dict[Tuple[str, str], Dict[str, List[str]]] = {}
+        self.context_key = ''
+
+    def sync(self, materials: List[Dict], context_data: Dict) -> List[int]:
+        """教材リストとの差分を重複インデックスに反映し、内容が変わった教材インデックスを返す"""
+        self.context_key = stable_hash(context_data.get('counseling_memo', ''))
+
+        changed = []
+        for i in range(max(len(materials), len(self.material_hashes))):
+            if i >= len(materials):
+                self._remove_slot(i)
+                continue
+
+            material_hash = material_content_hash(materials[i])
+            if i < len(self.material_hashes) and self.material_hashes[i] == material_hash:
+                continue
+
+            if i < len(self.material_hashes):
+                self._remove_slot(i)
+            self._add_slot(i, materials[i], material_hash)
+            changed.append(i)
+
+        del self.material_hashes[len(materials):]
+        del self.material_expressions[len(materials):]
+
+        # 参照されなくなった結果を破棄
+        live_keys = {(material_hash, self.context_key) for material_hash in self.material_hashes}
+        for key in [key for key in self.results if key not in live_keys]:
+            del self.results[key]
+
+        return changed
+
+    def pending(self, check_name: str) -> List[int]:
+        """指定チェックの結果がまだない教材インデックス（同一内容は1件のみ）"""
+        pending = []
+        seen = set()
+        for i, material_hash in enumerate(self.material_hashes):
+            key = (material_hash, self.context_key)
+            if key in seen:
+                continue
+            if check_name not in self.results.get(key, {}):
+                pending.append(i)
+                seen.add(key)
+        return pending
+
+    def store_result(self, check_name: str, index: int, issues: List[str]):
+        """教材単体チェックの結果を保存"""
+        key = (self.material_hashes[index], self.context_key)
+        self.results.setdefault(key, {})[check_name] = issues
+
+    def update(self, materials: List[Dict], context_data: Dict) -> List[int]:
+        """差分を反映し、既定の教材単体チェックを同期実行して再評価した教材インデックスを返す"""
+        self.sync(materials, context_data)
+        evaluated = set()
+        for check in QUALITY_CHECKS.values():
+            if check['scope'] != 'material' or not check['default']:
+                continue
+            for i in self.pending(check['name']):
+                self.store_result(check['name'], i, check['func'](materials[i], context_data))
+                evaluated.add(i)
+        return sorted(evaluated)
+
+    def _add_slot(self, index: int, material: Dict, material_hash: str):
+        """教材を重複インデックスに追加"""
+        while len(self.material_hashes) <= index:
+            self.material_hashes.append('')
+            self.material_expressions.append([])
+
+        keys = []
+        for j, expr in enumerate(material.get('useful_expressions') or []):
+            key = normalize_expression(expr)
+            keys.append(key)
+            occurrences = self.expression_index.setdefault(key, {})
+            occurrences.setdefault(index, []).append((j, expr))
+            self.expression_counts[key] = self.expression_counts.get(key, 0) + 1
+            if self.expression_counts[key] > 1:
+                self.duplicate_keys.add(key)
+
+        self.material_hashes[index] = material_hash
+        self.material_expressions[index] = keys
+
+    def _remove_slot(self, index: int):
+        """教材を重複インデックスから除去"""
+        if index >= len(self.material_hashes):
+            return
+
+        for key in set(self.material_expressions[index]):
+            occurrences = self.expression_index.get(key, {})
+            removed = len(occurrences.pop(index, []))
+            self.expression_counts[key] = self.expression_counts.get(key, 0) - removed
+            if not occurrences:
+                self.expression_index.pop(key, None)
+                self.expression_counts.pop(key, None)
+            if self.expression_counts.get(key, 0) <= 1:
+                self.duplicate_keys.discard(key)
+
+        self.material_hashes[index] = ''
+        self.material_expressions[index] = []
+
+    def material_issues(self, check_name: str, materials: List[Dict]) -> List[str]:
+        """教材単体チェックの結果（教材番号付き）"""
+        issues = []
+        for i, material in enumerate(materials):
+            results = self.results.get((self.material_hashes[i], self.context_key), {})
+            for issue in results.get(check_name, []):
+                if check_name == 'context':
+                    issues.append(f"教材{i+1} '{material.get('topic', 'unknown')}': {issue}")
+                else:
+                    issues.append(f"教材{i+1}: {issue}")
+        return issues
+
+    def context_issues(self, materials: List[Dict]) -> List[str]:
+        """コンテキスト準拠チェックの結果"""
+        return self.material_issues('context', materials)
+
+    def level_issues(self, materials: List[Dict]) -> List[str]:
+        """レベル調整チェックの結果"""
+        return self.material_issues('level', materials)
+
+    def duplicate_details(self) -> List[Dict]:
+        """重複表現の詳細（修復UI用）"""
+        details = []
+        for key in self.duplicate_keys:
+            occurrences = sorted(
+                (i, j, expr)
+                for i, entries in self.expression_index[key].items()
+                for j, expr in entries
+            )
+            details.append({
+                'expression': key,
+                'occurrences': occurrences,
+                'original_expressions': [expr for i, j, expr in occurrences]
+            })
+        details.sort(key=lambda detail: detail['occurrences'][0][:2])
+        return details
+
+    def duplicate_issues(self, details: Optional[List[Dict]] = None) -> List[str]:
+        """重複チェックの結果"""
+        issues = []
+        for detail in details if details is not None else self.duplicate_details():
+            material_nums = [f"教材{i+1}" for i, j, expr in detail['occurrences']]
+            issues.append(f"重複表現: '{detail['expression']}' が {', '.join(material_nums)} で重複")
+        return issues
+
+
+def run_quality_pipeline(materials: List[Dict], context_data: Dict,
+                         check_names: Optional[List[str]] = None,
+                         checker: Optional[IncrementalQualityChecker] = None) -> Iterator[Tuple[str, List[str]]]:
+    """登録済みチェックを並列実行し、完了したチェックから (チェック名, 問題一覧) を返す"""
+    checker = checker or IncrementalQualityChecker()
+    checker.sync(materials, context_data)
+    checks = [QUALITY_CHECKS[name] for name in (default_check_names() if check_names is None else check_names)]
+
+    # 教材横断チェックは重複インデックスを参照するだけなので即座に返す
+    for check in checks:
+        if check['scope'] == 'collection':
+            yield check['name'], check['func'](checker, materials)
+
+    material_checks = [check for check in checks if check['scope'] in ('material', 'batch')]
+    if not material_checks:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(material_checks)) as thread_pool:
+        futures = {}
+        for check in material_checks:
+            indices = checker.pending(check['name'])
+            future = thread_pool.submit(_evaluate_check, check['name'], indices, materials, context_data)
+            futures[future] = (check['name'], indices)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                check_name, indices = futures.pop(future)
+                failed = []
+                for i, issues in zip(indices, future.result()):
+                    if issues is None:
+                        failed.append(f"教材{i+1}: {QUALITY_CHECKS[check_name]['label']}に失敗しました（再実行してください）")
+                    else:
+                        checker.store_result(check_name, i, issues)
+                yield check_name, checker.material_issues(check_name, materials) + failed
+
+
+def _evaluate_check(check_name: str, indices: List[int], materials: List[Dict],
+                    context_data: Dict) -> List[List[str]]:
+    """教材単体チェックを評価"""
+    targets = [materials[i] for i in indices]
+    if not targets:
+        return []
+    func = QUALITY_CHECKS[check_name]['func']
+    if QUALITY_CHECKS[check_name]['scope'] == 'batch':
+        return func(targets, context_data)
+    return [func(material, context_data) for material in targets]
+
+
+def load_materials_from_export(path: str) -> List[Dict]:
+    """JSONエクスポート（教材リスト / 単体教材ファイル）を読み込み"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        if 'materials' in data:
+            return data['materials']
+        if 'generated_material' in data:
+            material = dict(data['generated_material'])
+            material.setdefault('topic', data.get('final_situation', 'Unknown'))
+            return [material]
+        return [data]
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """品質チェックをコマンドラインから実行"""
+    parser = argparse.ArgumentParser(description="教材JSONエクスポートの品質チェック")
+    parser.add_argument('exports', nargs='+', help="教材JSONファイル")
+    parser.add_argument('--memo-file', help="カウンセリングメモのファイル")
+    parser.add_argument('--templates', help="テンプレート設定のJSONファイル")
+    parser.add_argument('--checks', default=','.join(default_check_names()),
+                        help=f"実行するチェック（カンマ区切り、既定: {','.join(default_check_names())}、"
+                             f"選択可: {','.join(QUALITY_CHECKS)}）")
+    parser.add_argument('--context', help="コンテキスト情報のJSONファイル（english_level等）")
+    parser.add_argument('--output', help="結果を書き出すJSONファイル")
+    parser.add_argument('--fail-on-issues', action='store_true', help="問題があれば終了コード1を返す")
+    args = parser.parse_args(argv)
+
+    check_names = [name.strip() for name in args.checks.split(',') if name.strip()]
+    unknown = [name for name in check_names if name not in QUALITY_CHECKS]
+    if unknown:
+        parser.error(f"未登録のチェック: {', '.join(unknown)}")
+
+    materials = []
+    for path in args.exports:
+        materials.extend(load_materials_from_export(path))
+
+    context_data = {'counseling_memo': ''}
+    if args.context:
+        with open(args.context, 'r', encoding='utf-8') as f:
+            context_data.update(json.load(f))
+    if args.memo_file:
+        with open(args.memo_file, 'r', encoding='utf-8') as f:
+            context_data['counseling_memo'] = f.read()
+
+    templates = {}
+    if args.templates:
+        with open(args.templates, 'r', encoding='utf-8') as f:
+            templates = json.load(f)
+
+    report = {'materials': len(materials), 'checks': {}}
+    for check_name, issues in run_quality_pipeline(materials, context_data, check_names):
+        report['checks'][check_name] = issues
+        print(f"{QUALITY_CHECKS[check_name]['label']}: {len(issues)}件", file=sys.stderr)
+
+    summary = summarize_quality(materials, context_data, templates)
+    report['summary'] = {
+        'avg_quality': summary['avg_quality'],
+        'needs_fix': summary['needs_fix'],
+        'duplicate_count': summary['duplicate_count'],
+        'scores': summary['scores']
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    total_issues = sum(len(issues) for issues in report['checks'].values())
+    return 1 if args.fail_on_issues and total_issues else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+AI審査（LLMジャッジ）機能
+複数教材を1リクエストにまとめてClaudeにルーブリック審査させ、判定結果を内容ハッシュでキャッシュする
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from quality_scoring import material_content_hash, stable_hash
+
+JUDGE_RUBRIC = """各項目を1〜5点で採点してください（5が最高）。
+- naturalness: 英語表現・対話の自然さ（ネイティブが実際に使う言い回しか）
+- business_appropriateness: ビジネス場面での適切さ（丁寧さ、場面設定の現実性）
+- level_fit: 受講者の英語レベルへの適合度
+- overall: 教材としての総合評価
+issues には、修正が必要な点を具体的に挙げてください（問題がなければ空配列）。"""
+
+# 1リクエストあたりの教材数
+JUDGE_BATCH_SIZE = 8
+
+# 同時リクエスト数の上限
+JUDGE_MAX_WORKERS = 4
+
+# この総合点未満の教材を要修正とする
+JUDGE_PASS_SCORE = 3
+
+# 審査に不要な大きいフィールド
+JUDGE_EXCLUDED_FIELDS = {'audio_script', 'chart_data', 'generated_at', 'quality_score'}
+
+# 審査結果キャッシュの上限（長時間動かすプロセスでも増え続けないよう、古いものから捨てる）
+JUDGE_CACHE_MAX_ENTRIES = 4096
+
+_verdict_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_put(key: str, verdict: Dict):
+    """審査結果をキャッシュ（_cache_lock を保持して呼ぶ）"""
+    _verdict_cache[key] = verdict
+    _verdict_cache.move_to_end(key)
+    while len(_verdict_cache) > JUDGE_CACHE_MAX_ENTRIES:
+        _verdict_cache.popitem(last=False)
+
+
+class MaterialJudge:
+    """教材をまとめてAI審査するクラス"""
+
+    def __init__(self, client=None, batch_size: int = JUDGE_BATCH_SIZE,
+                 max_workers: int = JUDGE_MAX_WORKERS, cache_path: Optional[str] = None):
+        self.client = client
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.cache_path = cache_path
+        if cache_path:
+            self.load_cache()
+
+    def _get_client(self):
+        if self.client is None:
+            from claude_api import ClaudeAPIClient
+            self.client = ClaudeAPIClient()
+        return self.client
+
+    def load_cache(self):
+        """審査結果のキャッシュファイルを読み込み"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            with _cache_lock:
+                for key, verdict in cached.items():
+                    _cache_put(key, verdict)
+        except Exception as e:
+            print(f"審査キャッシュ読み込みエラー: {e}")
+
+    def save_cache(self):
+        """審査結果のキャッシュファイルを書き出し"""
+        if not self.cache_path:
+            return
+        with _cache_lock:
+            snapshot = dict(_verdict_cache)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def judge(self, materials: List[Dict], context_data: Dict) -> List[Optional[Dict]]:
+        """教材ごとの審査結果を返す（失敗した教材は None）"""
+        context_key = stable_hash({
+            'rubric': JUDGE_RUBRIC,
+            'english_level': context_data.get('english_level', ''),
+            'counseling_memo': context_data.get('counseling_memo', '')[:300]
+        })
+        keys = [f"{material_content_hash(material)}:{context_key}" for material in materials]
+
+        # キャッシュにない教材を内容単位で重複なく抽出
+        pending = {}
+        # この呼び出しで審査した結果（上限を超えてキャッシュから捨てられても返せるよう保持）
+        judged = {}
+        with _cache_lock:
+            for key, material in zip(keys, materials):
+                if key not in _verdict_cache and key not in pending:
+                    pending[key] = material
+
+        if pending:
+            pending_items = list(pending.items())
+            batches = [pending_items[start:start + self.batch_size]
+                       for start in range(0, len(pending_items), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(batches)))) as pool:
+                for batch, verdicts in zip(batches, pool.map(lambda b: self._judge_batch(b, context_data), batches)):
+                    with _cache_lock:
+                        for (key, _), verdict in zip(batch, verdicts):
+                            if verdict is not None:
+                                judged[key] = verdict
+                                _cache_put(key, verdict)
+            self.save_cache()
+
+        with _cache_lock:
+            for key in keys:
+                if key in _verdict_cache:
+                    _verdict_cache.move_to_end(key)
+            return [judged.get(key) or _verdict_cache.get(key) for key in keys]
+
+    def _judge_batch(self, batch, context_data: Dict) -> List[Optional[Dict]]:
+        """1リクエスト分の教材を審査"""
+        payload = [
+            {k: v for k, v in material.items() if k not in JUDGE_EXCLUDED_FIELDS}
+            for _, material in batch
+        ]
+        try:
+            return self._get_client().judge_materials(payload, JUDGE_RUBRIC, context_data)
+        except Exception as e:
+            print(f"AI審査エラー: {e}")
+            return [None] * len(batch)
+
+
+def verdict_issues(verdict: Dict) -> List[str]:
+    """審査結果を品質チェックの問題一覧に変換"""
+    issues = []
+    overall = verdict.get('overall')
+    if isinstance(overall, (int, float)) and overall < JUDGE_PASS_SCORE:
+        issues.append(
+            f"AI審査 総合{overall}/5（自然さ{verdict.get('naturalness', '-')}・"
+            f"ビジネス適切性{verdict.get('business_appropriateness', '-')}・"
+            f"レベル{verdict.get('level_fit', '-')}）"
+        )
+    issues.extend(f"AI指摘: {issue}" for issue in verdict.get('issues') or [])
+    return issues
+
+
+def judge_materials_check(materials: List[Dict], context_data: Dict) -> List[Optional[List[str]]]:
+    """品質チェックパイプライン用: 教材ごとのAI審査結果（審査失敗は None）"""
+    judge = MaterialJudge(cache_path=os.getenv('JUDGE_CACHE_PATH'))
+    return [verdict_issues(verdict) if verdict is not None else None
+            for verdict in judge.judge(materials, context_data)]
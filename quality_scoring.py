@@ -0,0 +1,264 @@
+"""
+品質スコアリング機能
+教材ごとの品質スコアを算出し、教材内容のハッシュ単位でキャッシュする
+"""
+
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# スコアの重み（合計は任意。存在しない指標は除外して正規化する）
+SCORE_WEIGHTS = {
+    'context': 0.25,
+    'level': 0.2,
+    'duplicate': 0.2,
+    'structure': 0.2,
+    'length': 0.15
+}
+
+# 品質スコアの閾値（5点満点）
+NEEDS_FIX_THRESHOLD = 3.0
+
+# コンテキスト関連性: このキーワード数に一致すれば満点
+RELEVANCE_TARGET_HITS = 3
+
+# レベル判定: 4語以上の表現の割合がこれを超えると減点
+LEVEL_COMPLEX_RATIO_LIMIT = 0.7
+
+# ハッシュ計算から除外するキー（内容ではなくメタ情報）
+HASH_EXCLUDED_KEYS = {'generated_at', 'quality_score'}
+
+# 教材タイプごとの必須フィールド
+REQUIRED_FIELDS = {
+    'ロールプレイ': ['model_dialogue', 'useful_expressions', 'additional_questions'],
+    'ディスカッション': ['discussion_topic', 'background_info', 'key_points',
+                 'useful_expressions', 'discussion_questions'],
+    '表現練習': ['chart_description', 'chart_data', 'useful_vocabulary',
+             'practice_questions', 'explanation_points']
+}
+
+# 教材タイプごとの (フィールド, テンプレート設定キー) の件数目標
+COUNT_TARGETS = {
+    'ロールプレイ': [('useful_expressions', 'useful_expressions_count'),
+                ('additional_questions', 'additional_questions_count')],
+    'ディスカッション': [('key_points', 'viewpoints_count')],
+    '表現練習': [('useful_vocabulary', 'vocabulary_count'),
+             ('practice_questions', 'practice_questions')]
+}
+
+# 教材タイプごとの (本文フィールド, テンプレート設定キー) の語数目標
+LENGTH_TARGETS = {
+    'ロールプレイ': ('model_dialogue', 'dialogue_length'),
+    '表現練習': ('chart_description', 'explanation_length')
+}
+
+_CACHE_MAX_ENTRIES = 4096
+_component_cache: "OrderedDict[Tuple[str, str, str], Dict]" = OrderedDict()
+_summary_cache: "OrderedDict[Tuple, Dict]" = OrderedDict()
+
+
+def stable_hash(data) -> str:
+    """辞書・リストを安定したJSON表現でハッシュ化"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def material_content_hash(material: Dict) -> str:
+    """教材内容のハッシュを計算（生成日時などのメタ情報は除外）"""
+    content = {k: v for k, v in material.items() if k not in HASH_EXCLUDED_KEYS}
+    return stable_hash(content)
+
+
+def normalize_expression(expr: str) -> str:
+    """重複判定用に表現を正規化（英語部分のみを小文字で抽出）"""
+    expr_clean = expr.lower().strip()
+    if ':' in expr:
+        expr_clean = expr.split(':')[1].strip().lower()
+    elif '-' in expr:
+        expr_clean = expr.split('-')[0].strip().lower()
+    return expr_clean
+
+
+def extract_keywords(text: str) -> List[str]:
+    """カウンセリングメモからキーワードを抽出"""
+    tokens = re.split(r'[\s・：:、。，,（）()「」\[\]/／\-]+', text.lower())
+    return [token for token in tokens if len(token) >= 2]
+
+
+def _count_words(text: str) -> int:
+    """本文の語数を数える（話者ラベルは除外）"""
+    text = re.sub(r'(^|\n)\s*[A-Z][\w\s]{0,20}:\s*', r'\1', text)
+    return len(re.findall(r"[A-Za-z0-9][A-Za-z0-9'\-.,%]*", text))
+
+
+def parse_length_range(spec) -> Optional[Tuple[int, int]]:
+    """'180-220語' のような長さ指定を (最小, 最大) に変換"""
+    if not spec:
+        return None
+    numbers = [int(n) for n in re.findall(r'\d+', str(spec))]
+    if not numbers:
+        return None
+    if len(numbers) == 1:
+        return numbers[0], numbers[0]
+    return min(numbers[0], numbers[1]), max(numbers[0], numbers[1])
+
+
+def score_context_relevance(material: Dict, keywords: List[str]) -> Optional[float]:
+    """コンテキスト関連性（0.0-1.0）"""
+    if not keywords:
+        return None
+    content = str(material).lower()
+    hits = sum(1 for keyword in set(keywords) if keyword in content)
+    return min(1.0, hits / RELEVANCE_TARGET_HITS)
+
+
+def score_level_fit(material: Dict) -> Optional[float]:
+    """レベル適合度（0.0-1.0）"""
+    expressions = material.get('useful_expressions')
+    if not expressions:
+        return None
+    complex_ratio = sum(1 for expr in expressions if len(expr.split()) > 3) / len(expressions)
+    if complex_ratio <= LEVEL_COMPLEX_RATIO_LIMIT:
+        return 1.0
+    return max(0.0, (1.0 - complex_ratio) / (1.0 - LEVEL_COMPLEX_RATIO_LIMIT))
+
+
+def score_structure(material: Dict, template_config: Dict) -> Optional[float]:
+    """テンプレートに対する構成の完全性（0.0-1.0）"""
+    material_type = material.get('type')
+    required = REQUIRED_FIELDS.get(material_type)
+    if not required:
+        return None
+
+    scores = [1.0 if material.get(field) else 0.0 for field in required]
+    for field, config_key in COUNT_TARGETS.get(material_type, []):
+        target = template_config.get(config_key)
+        if isinstance(target, int) and target > 0:
+            actual = len(material.get(field) or [])
+            scores.append(min(1.0, actual / target))
+
+    return sum(scores) / len(scores)
+
+
+def score_length(material: Dict, template_config: Dict) -> Optional[float]:
+    """長さ目標への適合度（0.0-1.0）"""
+    target = LENGTH_TARGETS.get(material.get('type'))
+    if not target:
+        return None
+    field, config_key = target
+    length_range = parse_length_range(template_config.get(config_key))
+    text = material.get(field)
+    if not length_range or not isinstance(text, str):
+        return None
+
+    words = _count_words(text)
+    low, high = length_range
+    if low <= words <= high:
+        return 1.0
+    if words < low:
+        return words / low
+    return high / words
+
+
+def _cache_put(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
+
+
+def score_material_components(material: Dict, context_data: Dict, template_config: Dict,
+                              material_hash: Optional[str] = None) -> Dict:
+    """教材単体で決まる指標を算出（内容ハッシュでキャッシュ）"""
+    material_hash = material_hash or material_content_hash(material)
+    counseling_memo = context_data.get('counseling_memo', '')
+    key = (material_hash, stable_hash(counseling_memo), stable_hash(template_config or {}))
+
+    cached = _component_cache.get(key)
+    if cached is not None:
+        _component_cache.move_to_end(key)
+        return cached
+
+    template_config = template_config or {}
+    components = {
+        'context': score_context_relevance(material, extract_keywords(counseling_memo)),
+        'level': score_level_fit(material),
+        'structure': score_structure(material, template_config),
+        'length': score_length(material, template_config)
+    }
+    _cache_put(_component_cache, key, components)
+    return components
+
+
+def combine_scores(components: Dict) -> float:
+    """指標を5点満点の総合スコアに統合"""
+    weighted = [(SCORE_WEIGHTS[name], value) for name, value in components.items()
+                if value is not None and name in SCORE_WEIGHTS]
+    if not weighted:
+        return 0.0
+    total_weight = sum(weight for weight, _ in weighted)
+    average = sum(weight * value for weight, value in weighted) / total_weight
+    return round(1.0 + 4.0 * average, 1)
+
+
+def find_duplicate_expressions(materials: List[Dict]) -> Dict[str, List[int]]:
+    """複数教材で使われている表現 -> 教材インデックス一覧"""
+    expressions_map = {}
+    for i, material in enumerate(materials):
+        for expr in material.get('useful_expressions') or []:
+            expressions_map.setdefault(normalize_expression(expr), []).append(i)
+    return {expr: indices for expr, indices in expressions_map.items() if len(indices) > 1}
+
+
+def summarize_quality(materials: List[Dict], context_data: Dict, templates: Dict) -> Dict:
+    """教材セット全体の品質サマリーを算出
+
+    戻り値:
+        scores: 教材ごとのスコア（5点満点）
+        components: 教材ごとの指標
+        avg_quality: 平均品質スコア
+        needs_fix: 閾値未満の教材数
+        duplicate_count: 重複表現の件数
+    """
+    hashes = [material_content_hash(material) for material in materials]
+    key = (tuple(hashes), stable_hash(context_data.get('counseling_memo', '')), stable_hash(templates))
+
+    cached = _summary_cache.get(key)
+    if cached is not None:
+        _summary_cache.move_to_end(key)
+        return cached
+
+    duplicates = find_duplicate_expressions(materials)
+    duplicated_in = {}
+    for expr, indices in duplicates.items():
+        for i in indices:
+            duplicated_in.setdefault(i, set()).add(expr)
+
+    scores = []
+    all_components = []
+    for i, (material, material_hash) in enumerate(zip(materials, hashes)):
+        template_config = templates.get(material.get('type'), {})
+        components = dict(score_material_components(material, context_data, template_config, material_hash))
+
+        expressions = material.get('useful_expressions') or []
+        if expressions:
+            duplicated = sum(1 for expr in expressions
+                             if normalize_expression(expr) in duplicated_in.get(i, ()))
+            components['duplicate'] = 1.0 - duplicated / len(expressions)
+        else:
+            components['duplicate'] = None
+
+        all_components.append(components)
+        scores.append(combine_scores(components))
+
+    summary = {
+        'scores': scores,
+        'components': all_components,
+        'avg_quality': sum(scores) / len(scores) if scores else 0.0,
+        'needs_fix': sum(1 for score in scores if score < NEEDS_FIX_THRESHOLD),
+        'duplicate_count': len(duplicates)
+    }
+    _cache_put(_summary_cache, key, summary)
+    return summary
@@ -76,6 +76,204 @@ A: Based on our initial assessment, I'd like to propose a structured loan packag
         print(f"❌ テスト失敗: {e}")
         return False
 
+def test_google_docs_fake_backend():
+    """Google Docs出力の書式・インデックスをローカルのスタンドインで確認"""
+    import fake_google_docs
+    from google_docs_api import GoogleDocsAPIClient, build_material_requests
+    
+    print("🧪 Google Docs出力テスト（スタンドイン）開始")
+    
+    os.environ['GOOGLE_DOCS_BACKEND'] = 'fake'
+    fake_google_docs.get_fake_service().backend.latency = 0
+    client = GoogleDocsAPIClient()
+    del os.environ['GOOGLE_DOCS_BACKEND']
+    
+    material = {
+        'type': 'ロールプレイ',
+        'topic': '新規顧客への融資提案 💼',
+        'model_dialogue': 'A: Good morning! 😀\nB: Good morning.',
+        'useful_expressions': ["I'd like to propose... - 提案したいのですが", 'Based on our analysis... - 分析に基づいて'],
+        'additional_questions': ['どのように提案しますか？']
+    }
+    url = client.create_and_write_material('テスト教材', material)
+    assert url, "ドキュメント出力に失敗しました"
+    document = client.get_document(url.split('/d/')[1].split('/')[0])
+    
+    paragraphs = [element['paragraph'] for element in document['body']['content'] if 'paragraph' in element]
+    styles = {p['elements'][0]['textRun']['content']: p['paragraphStyle']['namedStyleType'] for p in paragraphs}
+    bullets = [p['elements'][0]['textRun']['content'] for p in paragraphs if 'bullet' in p]
+    
+    # 絵文字（UTF-16で2単位）を含んでも見出し・箇条書きの位置がずれない
+    assert styles['📚 語学教材: ロールプレイ\n'] == 'TITLE'
+    assert styles['💬 モデルダイアログ\n'] == 'HEADING_2'
+    assert styles['B: Good morning.\n'] == 'NORMAL_TEXT'
+    assert bullets == [f"{item}\n" for item in material['useful_expressions'] + material['additional_questions']]
+    assert len(build_material_requests(material)) == 1 + 1 + 4 + 2  # 本文挿入・タイトル・見出し・箇条書き
+    print("✅ Google Docs出力テスト成功")
+    
+    # 再出力: 変更のない教材はAPIを呼ばず、変更したブロックだけを置き換える
+    status, export = client.sync_material('テスト教材', material)
+    assert status == 'created'
+    assert client.sync_material('テスト教材', material, export) == ('unchanged', export)
+    repaired = dict(material, useful_expressions=['Could you clarify... 🙏 - 確認させてください'])
+    status, export = client.sync_material('テスト教材', repaired, export)
+    assert status == 'updated'
+    document = client.get_document(export['document_id'])
+    paragraphs = [element['paragraph'] for element in document['body']['content'] if 'paragraph' in element]
+    bullets = [p['elements'][0]['textRun']['content'] for p in paragraphs if 'bullet' in p]
+    assert bullets == [f"{item}\n" for item in repaired['useful_expressions'] + repaired['additional_questions']]
+    assert document['body']['content'][-1]['endIndex'] == export['end_index']
+    print("✅ Google Docs差分更新テスト成功")
+
+def test_job_queue_claim_requeue_retry():
+    """ジョブキューの取得・停止ジョブの再キュー・失敗分の再実行"""
+    import tempfile
+    from job_queue import JobQueue, JobWorker
+    
+    print("🧪 ジョブキューテスト開始")
+    
+    class FakeClient:
+        def generate_roleplay_material(self, context_data, topic, template_config, used_expressions):
+            if topic == '失敗するトピック':
+                raise RuntimeError("生成エラー")
+            return {'type': 'ロールプレイ', 'useful_expressions': [f"{topic} - 表現"]}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.db'))
+        job_id = queue.enqueue(['融資提案', '失敗するトピック'], {}, 'ロールプレイ', {}, quality_check=False)
+        worker = JobWorker(queue, client_factory=FakeClient)
+        
+        # 取得したジョブは他のワーカーに渡らない
+        job = queue.claim_next(worker.worker_id)
+        assert job['id'] == job_id
+        assert queue.get_job(job_id)['status'] == 'running'
+        assert queue.get_job(job_id)['worker_id'] == worker.worker_id
+        assert queue.claim_next('other-worker') is None
+        
+        # ハートビートが途絶えたジョブだけ待機中に戻る
+        assert queue.requeue_stale() == 0
+        assert queue.requeue_stale(stale_seconds=-1) == 1
+        assert queue.get_job(job_id)['status'] == 'queued'
+        
+        # 再取得して実行: 失敗したトピックも状態付きで記録される
+        job = queue.claim_job(job_id, worker.worker_id)
+        worker.run_job(job)
+        assert queue.get_job(job_id)['status'] == 'completed'
+        assert queue.status_counts(job_id) == {'ok': 1, 'failed': 1}
+        assert [material['topic'] for material in queue.job_materials(job_id)] == ['融資提案']
+        
+        # 失敗分のみ再実行: 正常なトピックは残し、失敗したトピックだけ未実行に戻す
+        assert queue.retry_failed(job_id) == 1
+        assert queue.get_job(job_id)['status'] == 'queued'
+        assert queue.status_counts(job_id) == {'ok': 1, 'pending': 1}
+        assert queue.retry_failed(job_id) == 0  # 待機中のジョブは再実行しない
+    print("✅ ジョブキューテスト成功")
+
+def test_material_versions_across_snapshots():
+    """スナップショット間隔をまたぐ版の復元とロールバック"""
+    import tempfile
+    from material_store import VERSION_SNAPSHOT_INTERVAL, MaterialStore
+    
+    print("🧪 教材の版履歴テスト開始")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MaterialStore(os.path.join(tmp, 'materials.db'))
+        context_id = store.create_context({'counseling_memo': ''}, 'テスト')
+        versions = [{
+            'type': 'ロールプレイ',
+            'topic': '融資提案',
+            'model_dialogue': 'A: Hello.\nB: Hi.',
+            'useful_expressions': [f"expression {i}" for i in range(5)]
+        }]
+        material_id = store.add_materials(versions, context_id)[0]
+        
+        # スナップショットを2つ以上またぐまで、リストの要素変更と項目の追加・削除を繰り返す
+        for i in range(1, VERSION_SNAPSHOT_INTERVAL * 2 + 3):
+            material = dict(versions[-1])
+            material['useful_expressions'] = list(material['useful_expressions'])
+            material['useful_expressions'][i % 5] = f"expression {i} (rev)"
+            if i % 3 == 0:
+                material['audio_script'] = f"script {i}"
+            else:
+                material.pop('audio_script', None)
+            assert store.update_material(material_id, material, source='手動修復') == i + 1
+            versions.append(material)
+        
+        assert store.update_material(material_id, versions[-1]) is None  # 変更なしは版を作らない
+        for version, expected in enumerate(versions, 1):
+            assert store.get_material_version(material_id, version) == expected, f"v{version} の復元が不正"
+        assert store.get_material_version(material_id, len(versions) + 1) is None
+        
+        # ロールバックも新しい版として記録され、元の履歴は残る
+        new_version = store.rollback_material(material_id, 3)
+        assert new_version == len(versions) + 1
+        assert store.get_material_version(material_id, new_version) == versions[2]
+        assert store.get_material_version(material_id, len(versions)) == versions[-1]
+        assert store.list_versions(material_id)[0]['source'] == 'v3にロールバック'
+    print("✅ 教材の版履歴テスト成功")
+
+def test_material_search_term_lengths():
+    """1文字・2文字・3文字以上の語での全文検索"""
+    import tempfile
+    from material_store import MaterialStore
+    
+    print("🧪 全文検索テスト開始")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MaterialStore(os.path.join(tmp, 'materials.db'))
+        context_id = store.create_context({'counseling_memo': ''}, 'テスト')
+        store.add_materials([
+            {'type': 'ロールプレイ', 'topic': '新規顧客への融資提案', 'model_dialogue': 'A: Could we review the loan?',
+             'useful_expressions': ['I would like to propose...']},
+            {'type': 'ディスカッション', 'topic': '契約更新の交渉', 'discussion_topic': '価格改定',
+             'key_points': ['値引き幅']},
+        ], context_id)
+        
+        def topics(query):
+            return [result['topic'] for result in store.search(query)]
+        
+        # 3文字以上: trigram
+        assert topics('融資提案') == ['新規顧客への融資提案']
+        assert topics('loan') == ['新規顧客への融資提案']
+        # 2文字: 2-gramインデックス（空白区切りはAND）
+        assert topics('契約') == ['契約更新の交渉']
+        assert topics('融資 契約') == []
+        # 1文字: 検索対象欄のみ（教材JSONのキー名には一致しない）
+        assert topics('幅') == ['契約更新の交渉']
+        assert topics('y') == []
+        assert topics('?') == ['新規顧客への融資提案']
+        assert topics('%') == []
+    print("✅ 全文検索テスト成功")
+
+def test_json_export_round_trip():
+    """JSON配列出力の逐次生成・逐次読み込みの往復と不正な入力"""
+    import io
+    import json
+    from material_export import iter_json_array, iter_json_export
+    
+    print("🧪 JSON出力・読み込みテスト開始")
+    
+    materials = [
+        {'type': 'ロールプレイ', 'topic': f"トピック{i}", 'model_dialogue': 'A: "Hi"\nB: [ok], {fine}',
+         'useful_expressions': ['x' * (i * 50)], 'score': i * 0.5, 'audio': None, 'draft': i % 2 == 0}
+        for i in range(40)
+    ]
+    for items in (materials, materials[:1], []):
+        text = "".join(iter_json_export(iter(items)))
+        assert text == json.dumps(items, ensure_ascii=False, indent=2)
+        # チャンク境界が要素や数値の途中に来ても同じ内容を読み戻せる
+        for chunk_size in (1, 7, 64 * 1024):
+            assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == items
+    assert list(iter_json_array(io.StringIO('[1, 23, 456]'), chunk_size=1)) == [1, 23, 456]
+    
+    for broken in ('{"materials": []}', '', '[1, 2', '[1; 2]', '[{"topic": "x"'):
+        try:
+            list(iter_json_array(io.StringIO(broken), chunk_size=4))
+        except ValueError:
+            continue
+        raise AssertionError(f"不正なJSONを受け付けました: {broken!r}")
+    print("✅ JSON出力・読み込みテスト成功")
+
 if __name__ == "__main__":
     success = test_claude_api()
     if success: